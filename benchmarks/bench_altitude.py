@@ -0,0 +1,43 @@
+# bench_altitude.py
+"""
+CPython microbenchmark and accuracy check for pressure-to-altitude: the exact
+barometric formula (float pow) against bmp280.AltitudeLUT interpolation.
+
+Run from the repository root:
+    python benchmarks/bench_altitude.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bmp280 import AltitudeLUT, exact_altitude
+
+N = 200000
+GROUND_PA = 98000.0
+
+
+def main():
+    for size in (32, 64, 128, 256):
+        lut = AltitudeLUT(size)
+        lut.set_ground(GROUND_PA)
+        worst = 0.0
+        p = GROUND_PA * lut.ratio_min
+        while p < GROUND_PA * lut.ratio_max:
+            ref = exact_altitude(p) - exact_altitude(GROUND_PA)
+            worst = max(worst, abs(lut.altitude(p) - ref))
+            p += 1.3
+        print(f"size {size:4d}: max error {worst * 100:6.2f} cm (bound {lut.max_error() * 100:6.2f} cm)")
+
+    lut = AltitudeLUT()
+    lut.set_ground(GROUND_PA)
+    ground = exact_altitude(GROUND_PA)
+    for label, fn in (("exact formula (relative)", lambda: exact_altitude(97000.0) - ground),
+                      ("AltitudeLUT.altitude", lambda: lut.altitude(97000.0))):
+        best = min(timeit.repeat(fn, number=N, repeat=5))
+        print(f"{label:<30} {best / N * 1e6:7.3f} us/call")
+
+
+if __name__ == "__main__":
+    main()
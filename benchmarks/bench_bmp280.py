@@ -0,0 +1,63 @@
+# bench_bmp280.py
+"""
+CPython microbenchmark and accuracy check for BMP280 compensation: the
+datasheet integer formulas used by BMP280.read() against the floating-point
+variant, plus the previous uncalibrated read for reference.
+
+Run from the repository root:
+    python benchmarks/bench_bmp280.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bmp280 import BMP280
+from mock_machine import I2C, SimClock, Trajectory, SimBMP280
+
+N = 100000
+
+
+def integer(bmp, adc_t, adc_p):
+    t = bmp.compensate_temperature(adc_t)
+    return t / 100.0, bmp.compensate_pressure(adc_p) / 256.0
+
+
+def uncalibrated(adc_t, adc_p):
+    """The previous IMUGY91.read_bmp280 arithmetic (no trimming coefficients)."""
+    return adc_t / 5120.0, adc_p / 256.0
+
+
+def bench(label, fn):
+    best = min(timeit.repeat(fn, number=N, repeat=5))
+    print(f"{label:<40} {best / N * 1e6:7.2f} us/call")
+
+
+def main():
+    clock = SimClock()
+    i2c = I2C()
+    sim = i2c.attach(SimBMP280(Trajectory(), clock, press_noise=0.0))
+    bmp = BMP280(i2c)
+    clock.advance(0.1)
+    adc_t, adc_p = bmp.read_raw()
+    bench("integer compensation (32/64-bit)", lambda: integer(bmp, adc_t, adc_p))
+    bench("float compensation", lambda: bmp.compensate_float(adc_t, adc_p))
+    bench("previous uncalibrated", lambda: uncalibrated(adc_t, adc_p))
+
+    # Agreement over the sensor's operating range
+    worst_t = worst_p = 0.0
+    for temp in range(-40, 86, 5):
+        for alt in range(-500, 9001, 250):
+            sim.source = Trajectory(alt=float(alt), temp=float(temp))
+            clock.advance(0.1)
+            adc_t, adc_p = bmp.read_raw()
+            ti, pi = integer(bmp, adc_t, adc_p)
+            tf, pf = bmp.compensate_float(adc_t, adc_p)
+            worst_t = max(worst_t, abs(ti - tf))
+            worst_p = max(worst_p, abs(pi - pf))
+    print(f"max |integer - float|: {worst_t:.3f} C, {worst_p:.3f} Pa")
+
+
+if __name__ == "__main__":
+    main()
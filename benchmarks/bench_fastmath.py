@@ -0,0 +1,91 @@
+# bench_fastmath.py
+"""
+CPython accuracy and speed check for fastmath against the math module.
+Accuracy sweeps the whole input domain: atan2 around the full circle at
+three radii, asin across [-1, 1] and inv_sqrt over twelve decades. Speed is
+the per-call cost of each function and of Madgwick.euler_into() with and
+without fast_math.
+
+Run from the repository root:
+    python benchmarks/bench_fastmath.py
+
+On CPython the C library wins (a Python-level polynomial is several bytecode
+operations against one C call); the numbers that decide FAST_MATH are the
+same sweep run on the board.
+"""
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fastmath
+from imu_gy91 import Madgwick, IMUSample
+
+STEPS = 100000
+N = 100000
+
+
+def accuracy():
+    worst = {'atan2': 0.0, 'atan2_deg': 0.0, 'asin': 0.0, 'asin_deg': 0.0, 'inv_sqrt': 0.0}
+    for i in range(1, STEPS):
+        # Open interval: at +/-180 deg the sign of zero picks the branch
+        t = -math.pi + 2.0 * math.pi * i / STEPS
+        for r in (1e-3, 1.0, 1e4):
+            y = r * math.sin(t)
+            x = r * math.cos(t)
+            exact = math.atan2(y, x)
+            worst['atan2'] = max(worst['atan2'], abs(fastmath.atan2(y, x) - exact))
+            worst['atan2_deg'] = max(worst['atan2_deg'],
+                                     abs(fastmath.atan2_deg(y, x) - math.degrees(exact)))
+    for i in range(STEPS + 1):
+        x = -1.0 + 2.0 * i / STEPS
+        exact = math.asin(x)
+        worst['asin'] = max(worst['asin'], abs(fastmath.asin(x) - exact))
+        worst['asin_deg'] = max(worst['asin_deg'], abs(fastmath.asin_deg(x) - math.degrees(exact)))
+    for i in range(STEPS + 1):
+        x = 10.0 ** (-6.0 + 12.0 * i / STEPS)
+        worst['inv_sqrt'] = max(worst['inv_sqrt'], abs(fastmath.inv_sqrt(x) * math.sqrt(x) - 1.0))
+    units = {'atan2': 'rad', 'atan2_deg': 'deg', 'asin': 'rad', 'asin_deg': 'deg',
+             'inv_sqrt': 'relative'}
+    for name, err in worst.items():
+        print(f"max error {name:<10} {err:.2e} {units[name]}")
+
+
+def per_call(label, fn):
+    best = min(timeit.repeat(fn, number=N, repeat=5))
+    print(f"{label:<32} {best / N * 1e9:7.1f} ns/call")
+
+
+def speed():
+    atan2 = math.atan2
+    asin = math.asin
+    degrees = math.degrees
+    sqrt = math.sqrt
+    f_atan2 = fastmath.atan2
+    f_atan2_deg = fastmath.atan2_deg
+    f_asin_deg = fastmath.asin_deg
+    f_inv_sqrt = fastmath.inv_sqrt
+    per_call("math.atan2", lambda: atan2(-0.3, 0.7))
+    per_call("fastmath.atan2", lambda: f_atan2(-0.3, 0.7))
+    per_call("math.degrees(math.atan2)", lambda: degrees(atan2(-0.3, 0.7)))
+    per_call("fastmath.atan2_deg", lambda: f_atan2_deg(-0.3, 0.7))
+    per_call("math.degrees(math.asin)", lambda: degrees(asin(0.4)))
+    per_call("fastmath.asin_deg", lambda: f_asin_deg(0.4))
+    per_call("1 / math.sqrt", lambda: 1.0 / sqrt(2.5))
+    per_call("fastmath.inv_sqrt", lambda: f_inv_sqrt(2.5))
+    out = IMUSample()
+    for fast in (False, True):
+        f = Madgwick(fast_math=fast)
+        f.q0, f.q1, f.q2, f.q3 = 0.9, 0.1, -0.2, 0.3
+        per_call("euler_into(fast_math=%s)" % fast, lambda: f.euler_into(out))
+
+
+def main():
+    accuracy()
+    speed()
+
+
+if __name__ == "__main__":
+    main()
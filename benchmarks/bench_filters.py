@@ -0,0 +1,62 @@
+# bench_filters.py
+"""
+CPython microbenchmark for the gyro filter bank: per-sample cost of one
+low-pass plus one notch stage on three axes, single-sample versus a 42-frame
+FIFO batch, and the number of objects tracked by the GC before and after.
+
+Run from the repository root:
+    python benchmarks/bench_filters.py
+"""
+import gc
+import math
+import os
+import sys
+import timeit
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from filters import FilterBank
+
+N = 20000
+FRAMES = 42
+FS = 1000.0
+
+
+def make_bank():
+    bank = FilterBank(3)
+    bank.add_lowpass(80.0, FS)
+    bank.add_notch(160.0, FS)
+    return bank
+
+
+def main():
+    bank = make_bank()
+    update = bank.update
+
+    def single():
+        update(0, 1.5)
+        update(1, -0.5)
+        update(2, 0.25)
+
+    data = array('f', [math.sin(i) for i in range(6 * FRAMES)])
+
+    def batch():
+        bank.process(data, FRAMES)
+
+    for label, fn, samples in (("update() x3 axes", single, 1),
+                               ("process() %d frames" % FRAMES, batch, FRAMES)):
+        number = max(1, N // samples)
+        best = min(timeit.repeat(fn, number=number, repeat=5))
+        print(f"{label:<24} {best / (number * samples) * 1e6:7.3f} us/sample (3 axes)")
+
+    gc.collect()
+    before = len(gc.get_objects())
+    for _ in range(1000):
+        batch()
+    gc.collect()
+    print(f"GC-tracked objects after 1000 batches: {len(gc.get_objects()) - before:+d}")
+
+
+if __name__ == "__main__":
+    main()
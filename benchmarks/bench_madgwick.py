@@ -0,0 +1,66 @@
+# bench_madgwick.py
+"""
+CPython microbenchmark for the Madgwick filter update cost.
+
+Run from the repository root:
+    python benchmarks/bench_madgwick.py
+"""
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archive'))
+
+from imu_gy91 import Madgwick
+from madgwick import MadgwickAHRS
+
+N = 100000
+
+
+class GyroOnlyListFilter:
+    """The previous imu_gy91.Madgwick: gyro integration only, new list per call."""
+    def __init__(self):
+        self.q = [1.0, 0.0, 0.0, 0.0]
+
+    def update(self, gx, gy, gz, ax, ay, az, dt):
+        q1, q2, q3, q4 = self.q
+        norm = math.sqrt(ax * ax + ay * ay + az * az)
+        if norm == 0:
+            return
+        gx = math.radians(gx)
+        gy = math.radians(gy)
+        gz = math.radians(gz)
+        qDot1 = 0.5 * (-q2 * gx - q3 * gy - q4 * gz)
+        qDot2 = 0.5 * (q1 * gx + q3 * gz - q4 * gy)
+        qDot3 = 0.5 * (q1 * gy - q2 * gz + q4 * gx)
+        qDot4 = 0.5 * (q1 * gz + q2 * gy - q3 * gx)
+        q1 += qDot1 * dt
+        q2 += qDot2 * dt
+        q3 += qDot3 * dt
+        q4 += qDot4 * dt
+        norm = math.sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)
+        self.q = [q1 / norm, q2 / norm, q3 / norm, q4 / norm]
+
+
+def bench(label, fn):
+    best = min(timeit.repeat(fn, number=N, repeat=5))
+    print(f"{label:<40} {best / N * 1e6:7.2f} us/update")
+
+
+def main():
+    old = GyroOnlyListFilter()
+    imu = Madgwick()
+    marg = Madgwick()
+    ref = MadgwickAHRS(sample_period=0.001)
+    bench("previous gyro-only (list q)", lambda: old.update(1.0, -2.0, 0.5, 0.01, 0.02, 0.98, 0.001))
+    bench("Madgwick.update (6-DoF)", lambda: imu.update(1.0, -2.0, 0.5, 0.01, 0.02, 0.98, 0.001))
+    bench("Madgwick.update_marg (9-DoF)",
+          lambda: marg.update_marg(1.0, -2.0, 0.5, 0.01, 0.02, 0.98, 0.2, 0.01, -0.45, 0.001))
+    bench("archive MadgwickAHRS.update (9-DoF)",
+          lambda: ref.update(1.0, -2.0, 0.5, 0.01, 0.02, 0.98, 0.2, 0.01, -0.45))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+# bmp280.py
+"""
+Driver for the BMP280 barometer on the GY-91 board.
+
+The factory trimming coefficients (dig_T1..dig_P9) are read once at init and
+kept in slots. Each read is a single 6-byte burst of the pressure and
+temperature ADC registers, compensated with the datasheet's 32-bit integer
+temperature and 64-bit integer pressure formulas (BMP280 datasheet 3.11.3).
+compensate_float() is the datasheet's floating-point variant, kept for
+comparison (see benchmarks/bench_bmp280.py). AltitudeLUT converts pressure
+to height above a captured ground reference without a float pow per sample.
+
+configure() sets oversampling, IIR filter, standby time and power mode.
+poll() is the non-blocking path for the flight loop: it only touches the bus
+once a new conversion can have finished. In forced mode it also checks the
+status register's measuring bit and starts the next conversion straight
+after reading the last one, so the conversion time overlaps the rest of the
+loop. In normal mode the data registers are shadowed and the measuring bit
+is set for most of a short cycle, so freshness comes from the cycle time.
+"""
+import struct
+import time
+from array import array
+
+try:
+    _ticks_us = time.ticks_us
+    _ticks_diff = time.ticks_diff
+    _ticks_add = time.ticks_add
+except AttributeError:  # CPython
+    def _ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def _ticks_diff(a, b):
+        return a - b
+
+    def _ticks_add(a, b):
+        return a + b
+
+BMP280_ADDR = 0x76
+BMP280_CALIB = 0x88   # dig_T1..dig_P9, 24 bytes little-endian
+BMP280_CHIP_ID = 0xD0
+BMP280_STATUS = 0xF3
+BMP280_STATUS_MEASURING = 0x08
+BMP280_CTRL_MEAS = 0xF4
+BMP280_CONFIG = 0xF5
+BMP280_PRESS_MSB = 0xF7  # press_msb..temp_xlsb, 6 bytes
+BMP280_CALIB_FMT = '<HhhHhhhhhhhh'
+
+MODE_SLEEP = 0
+MODE_FORCED = 1
+MODE_NORMAL = 3
+# Register codes are the index into each tuple
+OVERSAMPLING = (0, 1, 2, 4, 8, 16)  # 0 skips the measurement
+IIR_COEFF = (0, 2, 4, 8, 16)        # 0 is filter off
+STANDBY_MS = (0.5, 62.5, 125, 250, 500, 1000, 2000, 4000)
+
+# International barometric formula: h = ALT_SCALE * (1 - (p / p_sea) ** ALT_EXP)
+ALT_SCALE = 44330.0
+ALT_EXP = 0.1903
+
+
+class BMP280:
+    """
+    BMP280 with cached calibration and integer compensation. The defaults
+    (x1 oversampling, filter off, normal mode, 1 s standby) match the
+    previous fixed ctrl_meas 0x27 / config 0xA0. `clock` is a ticks_us-style
+    function; inject one for tests. temperature (deg C) and pressure (Pa)
+    hold the latest reading and are NaN until the first one.
+    """
+    __slots__ = ('i2c', 'addr', 'clock', '_buf', '_reg', 't_fine',
+                 'dig_T1', 'dig_T2', 'dig_T3',
+                 'dig_P1', 'dig_P2', 'dig_P3', 'dig_P4', 'dig_P5',
+                 'dig_P6', 'dig_P7', 'dig_P8', 'dig_P9',
+                 'mode', 'ctrl_meas', 'measure_us', 'period_us', '_due', '_pending',
+                 'temperature', 'pressure', 'conversions', 'busy_polls')
+
+    def __init__(self, i2c, addr=BMP280_ADDR, osrs_t=1, osrs_p=1, iir=0, standby_ms=1000,
+                 mode=MODE_NORMAL, clock=None):
+        self.i2c = i2c
+        self.addr = addr
+        self.clock = clock or _ticks_us
+        self._buf = bytearray(6)
+        self._reg = bytearray(1)
+        self.t_fine = 0
+        self.temperature = float('nan')
+        self.pressure = float('nan')
+        self.conversions = 0  # readings taken
+        self.busy_polls = 0   # polls that found a conversion still running
+        self._read_calibration()
+        self.configure(osrs_t, osrs_p, iir, standby_ms, mode)
+
+    def _write(self, reg, value):
+        self._reg[0] = value
+        self.i2c.writeto_mem(self.addr, reg, self._reg)
+
+    def configure(self, osrs_t=1, osrs_p=1, iir=0, standby_ms=1000, mode=MODE_NORMAL):
+        """
+        Set temperature/pressure oversampling (0, 1, 2, 4, 8 or 16), the IIR
+        filter coefficient (0, 2, 4, 8 or 16), normal-mode standby time
+        (one of STANDBY_MS) and the power mode. Raises ValueError for
+        unsupported values. The device is put to sleep while config is
+        written, since writes to it can be ignored in normal mode.
+        """
+        if osrs_t not in OVERSAMPLING or osrs_p not in OVERSAMPLING:
+            raise ValueError("oversampling must be one of %r" % (OVERSAMPLING,))
+        if iir not in IIR_COEFF:
+            raise ValueError("IIR coefficient must be one of %r" % (IIR_COEFF,))
+        if standby_ms not in STANDBY_MS:
+            raise ValueError("standby must be one of %r ms" % (STANDBY_MS,))
+        if mode not in (MODE_SLEEP, MODE_FORCED, MODE_NORMAL):
+            raise ValueError("unknown mode")
+        ctrl = (OVERSAMPLING.index(osrs_t) << 5) | (OVERSAMPLING.index(osrs_p) << 2)
+        config = (STANDBY_MS.index(standby_ms) << 5) | (IIR_COEFF.index(iir) << 2)
+        self._write(BMP280_CTRL_MEAS, ctrl)
+        self._write(BMP280_CONFIG, config)
+        self.ctrl_meas = ctrl
+        self.mode = mode
+        # Maximum conversion time (datasheet 3.8.1)
+        self.measure_us = int(1250 + 2300 * osrs_t + (2300 * osrs_p + 575 if osrs_p else 0))
+        self.period_us = self.measure_us
+        if mode == MODE_NORMAL:
+            self.period_us += int(standby_ms * 1000)
+        self._pending = False
+        self._due = None
+        if mode == MODE_NORMAL:
+            self._write(BMP280_CTRL_MEAS, ctrl | MODE_NORMAL)
+            self._due = _ticks_add(self.clock(), self.measure_us)
+
+    def _read_calibration(self):
+        cal = struct.unpack(BMP280_CALIB_FMT, self.i2c.readfrom_mem(self.addr, BMP280_CALIB, 24))
+        (self.dig_T1, self.dig_T2, self.dig_T3,
+         self.dig_P1, self.dig_P2, self.dig_P3, self.dig_P4, self.dig_P5,
+         self.dig_P6, self.dig_P7, self.dig_P8, self.dig_P9) = cal
+
+    def read_raw(self):
+        """Burst-read the 20-bit ADC values. Returns (adc_t, adc_p)."""
+        d = self._buf
+        self.i2c.readfrom_mem_into(self.addr, BMP280_PRESS_MSB, d)
+        adc_p = (d[0] << 12) | (d[1] << 4) | (d[2] >> 4)
+        adc_t = (d[3] << 12) | (d[4] << 4) | (d[5] >> 4)
+        return adc_t, adc_p
+
+    def compensate_temperature(self, adc_t):
+        """Temperature in 0.01 deg C. Also updates t_fine for the pressure formula."""
+        t1 = self.dig_T1
+        var1 = (((adc_t >> 3) - (t1 << 1)) * self.dig_T2) >> 11
+        d = (adc_t >> 4) - t1
+        var2 = (((d * d) >> 12) * self.dig_T3) >> 14
+        self.t_fine = var1 + var2
+        return (self.t_fine * 5 + 128) >> 8
+
+    def compensate_pressure(self, adc_p):
+        """Pressure in Pa as unsigned Q24.8 (divide by 256). Call after compensate_temperature."""
+        var1 = self.t_fine - 128000
+        var2 = var1 * var1 * self.dig_P6
+        var2 += (var1 * self.dig_P5) << 17
+        var2 += self.dig_P4 << 35
+        var1 = ((var1 * var1 * self.dig_P3) >> 8) + ((var1 * self.dig_P2) << 12)
+        var1 = (((1 << 47) + var1) * self.dig_P1) >> 33
+        if var1 == 0:
+            return 0  # avoid division by zero (no calibration)
+        p = 1048576 - adc_p
+        p = (((p << 31) - var2) * 3125) // var1
+        var1 = (self.dig_P9 * (p >> 13) * (p >> 13)) >> 25
+        var2 = (self.dig_P8 * p) >> 19
+        return ((p + var1 + var2) >> 8) + (self.dig_P7 << 4)
+
+    def compensate_float(self, adc_t, adc_p):
+        """Datasheet floating-point compensation. Returns (temp_c, press_pa)."""
+        var1 = (adc_t / 16384.0 - self.dig_T1 / 1024.0) * self.dig_T2
+        d = adc_t / 131072.0 - self.dig_T1 / 8192.0
+        var2 = d * d * self.dig_T3
+        t_fine = var1 + var2
+        temp = t_fine / 5120.0
+        var1 = t_fine / 2.0 - 64000.0
+        var2 = var1 * var1 * self.dig_P6 / 32768.0
+        var2 = var2 + var1 * self.dig_P5 * 2.0
+        var2 = var2 / 4.0 + self.dig_P4 * 65536.0
+        var1 = (self.dig_P3 * var1 * var1 / 524288.0 + self.dig_P2 * var1) / 524288.0
+        var1 = (1.0 + var1 / 32768.0) * self.dig_P1
+        if var1 == 0.0:
+            return temp, 0.0
+        p = 1048576.0 - adc_p
+        p = (p - var2 / 4096.0) * 6250.0 / var1
+        var1 = self.dig_P9 * p * p / 2147483648.0
+        var2 = p * self.dig_P8 / 32768.0
+        return temp, p + (var1 + var2 + self.dig_P7) / 16.0
+
+    def read(self):
+        """
+        One burst read, integer compensated. Returns (temp_c, press_pa) and
+        updates temperature/pressure. Does not check that a conversion is
+        ready; see poll().
+        """
+        adc_t, adc_p = self.read_raw()
+        self.temperature = self.compensate_temperature(adc_t) / 100.0
+        self.pressure = self.compensate_pressure(adc_p) / 256.0
+        self.conversions += 1
+        return self.temperature, self.pressure
+
+    def measuring(self):
+        """True while the status register reports a conversion in progress."""
+        self.i2c.readfrom_mem_into(self.addr, BMP280_STATUS, self._reg)
+        return bool(self._reg[0] & BMP280_STATUS_MEASURING)
+
+    def start(self):
+        """Trigger one forced-mode conversion."""
+        self._write(BMP280_CTRL_MEAS, self.ctrl_meas | MODE_FORCED)
+        self._due = _ticks_add(self.clock(), self.measure_us)
+        self._pending = True
+
+    def poll(self):
+        """
+        Non-blocking read for the flight loop. Returns True when a fresh
+        conversion was read into temperature/pressure, False otherwise.
+        No bus traffic happens until a conversion can have finished. In
+        forced mode the first call starts a conversion, the measuring bit is
+        checked before the data burst and every read starts the next one.
+        """
+        mode = self.mode
+        if mode == MODE_FORCED:
+            if not self._pending:
+                self.start()
+                return False
+        elif mode != MODE_NORMAL:
+            return False
+        now = self.clock()
+        if _ticks_diff(now, self._due) < 0:
+            return False
+        if mode == MODE_FORCED:
+            if self.measuring():
+                self.busy_polls += 1
+                return False
+            self.read()
+            self.start()
+        else:
+            self.read()
+            self._due = _ticks_add(now, self.period_us)
+        return True
+
+
+class AltitudeLUT:
+    """
+    Height above a ground reference from pressure, by linear interpolation
+    in a table of the barometric formula. The table is indexed by p / p_ground,
+    so it is built once and set_ground() only costs one pow. For pressure
+    ratios outside [ratio_min, ratio_max] (about -850 m to +3100 m from the
+    ground with the defaults) it falls back to the exact formula.
+
+    Interpolation error is bounded by h''(ratio_min) * step**2 / 8, reported
+    by max_error(); with the default 128 entries that is under 3 cm, well
+    below the BMP280's noise.
+    """
+    __slots__ = ('ratio_min', 'ratio_max', 'sea_level_pa', 'ground', '_table', '_inv_step',
+                 '_inv_ground', '_scale', '_last')
+
+    def __init__(self, size=128, ratio_min=0.68, ratio_max=1.11, sea_level_pa=101325.0):
+        if size < 2 or not 0.0 < ratio_min < ratio_max:
+            raise ValueError("need size >= 2 and 0 < ratio_min < ratio_max")
+        self.sea_level_pa = sea_level_pa
+        step = (ratio_max - ratio_min) / (size - 1)
+        # Put a node exactly on ratio 1 so altitude() is exactly 0 at the ground
+        ratio_min = 1.0 - round((1.0 - ratio_min) / step) * step
+        self.ratio_min = ratio_min
+        self.ratio_max = ratio_min + (size - 1) * step
+        self._inv_step = 1.0 / step
+        # Entry i: ALT_SCALE * (1 - r ** ALT_EXP) for r = ratio_min + i * step
+        self._table = array('f', [ALT_SCALE * (1.0 - (ratio_min + i * step) ** ALT_EXP)
+                                  for i in range(size)])
+        self._last = size - 2
+        self.ground = None
+        self._inv_ground = 1.0 / sea_level_pa
+        self._scale = 1.0
+
+    def set_ground(self, pressure_pa):
+        """
+        Capture the ground reference; altitude() is zero at this pressure.
+        Raises ValueError for a non-positive pressure (BMP280 reports 0
+        without calibration data), leaving the previous reference in place.
+        """
+        if not pressure_pa > 0:
+            raise ValueError("ground pressure must be positive")
+        self.ground = pressure_pa
+        self._inv_ground = 1.0 / pressure_pa
+        # h(p) - h(p0) = (p0 / p_sea) ** ALT_EXP * ALT_SCALE * (1 - (p / p0) ** ALT_EXP)
+        self._scale = (pressure_pa / self.sea_level_pa) ** ALT_EXP
+
+    def altitude(self, pressure_pa):
+        """Metres above the ground reference (above sea_level_pa if none was set)."""
+        x = (pressure_pa * self._inv_ground - self.ratio_min) * self._inv_step
+        i = int(x)
+        if x < 0.0 or i > self._last:
+            return exact_altitude(pressure_pa, self.sea_level_pa) - \
+                exact_altitude(self.ground or self.sea_level_pa, self.sea_level_pa)
+        t = self._table
+        a = t[i]
+        return self._scale * (a + (t[i + 1] - a) * (x - i))
+
+    def max_error(self):
+        """Worst-case interpolation error in metres inside the table range."""
+        step = 1.0 / self._inv_step
+        d2 = ALT_SCALE * ALT_EXP * (1.0 - ALT_EXP) * self.ratio_min ** (ALT_EXP - 2.0)
+        return self._scale * d2 * step * step / 8.0
+
+
+def exact_altitude(pressure_pa, sea_level_pa=101325.0):
+    """International barometric formula, metres above sea_level_pa."""
+    return ALT_SCALE * (1.0 - (pressure_pa / sea_level_pa) ** ALT_EXP)
@@ -0,0 +1,607 @@
+# calibration.py
+"""
+Sensor calibration for the Pico Drone flight computer.
+
+Calibration holds the gyro bias, six-position accelerometer offset/scale,
+magnetometer hard-iron offsets with per-axis scale, and the barometer
+baseline, together with the IMU die temperature they were taken at. The
+magnetometer part is tagged with the sensor it was taken on (CAL_MAG_AK8963
+in uT, CAL_MAG_QMC5883L in raw counts) and only applied to that one. It packs
+into a 76-byte checksummed record on flash, so a boot only needs one small
+read instead of seconds of sampling. Results taken at a different
+temperature are reported as stale by stale(); the gyro bias is the part that
+drifts, and calibrate_gyro() takes well under a second to redo.
+
+The routines take the IMUGY91 (or a read function) and a `wait` callable run
+between samples; the default sleeps 2 ms. Pass a simulator clock advance for
+tests.
+
+Full hard/soft-iron magnetometer calibration is split between the board and
+a host: capture_mag() logs raw readings to flash, fit_ellipsoid() (CPython
+with NumPy) fits an offset and 3x3 correction matrix, and the result goes
+back to the board as a 55-byte mag_cal.bin read by load_mag():
+    python calibration.py fit mag_samples.csv mag_cal.bin
+"""
+import math
+import struct
+import time
+from array import array
+
+try:
+    _sleep_ms = time.sleep_ms
+except AttributeError:  # CPython
+    def _sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+CAL_FILE = 'calibration.bin'
+CAL_MAGIC = b'PDCL'
+CAL_VERSION = 1
+# magic, version, flags, gyro_bias[3], accel_offset[3], accel_scale[3],
+# mag_offset[3], mag_scale[3], baro_baseline, temp, checksum
+CAL_FMT = '<4sBB17fH'
+CAL_SIZE = struct.calcsize(CAL_FMT)  # 76 bytes
+
+# Calibration.flags: which parts hold measured values
+CAL_GYRO = 0x01
+CAL_ACCEL = 0x02
+CAL_MAG = 0x04
+CAL_BARO = 0x08
+# With CAL_MAG: the magnetometer the offset/scale belong to. Their units
+# differ, so has_mag() only matches the sensor the calibration was taken on.
+CAL_MAG_AK8963 = 0x10    # GY-91 AK8963 via the MPU-9250, uT
+CAL_MAG_QMC5883L = 0x20  # GY-273 QMC5883L, raw counts
+CAL_MAG_SENSORS = CAL_MAG_AK8963 | CAL_MAG_QMC5883L
+
+# Ellipsoid magnetometer coefficients: magic, version, offset[3], matrix[9] (rows), checksum
+MAG_FILE = 'mag_cal.bin'
+MAG_SAMPLES_FILE = 'mag_samples.csv'
+MAG_MAGIC = b'PDMG'
+MAG_FMT = '<4sB12fH'
+MAG_SIZE = struct.calcsize(MAG_FMT)  # 55 bytes
+
+MAX_TEMP_DELTA = 8.0  # deg C between calibration and boot before the gyro bias is stale
+
+
+def _fletcher16(data, end):
+    a = b = 0
+    for i in range(end):
+        a = (a + data[i]) % 255
+        b = (b + a) % 255
+    return (b << 8) | a
+
+
+def _wait():
+    _sleep_ms(2)
+
+
+class Calibration:
+    """Calibration constants. Vectors are (x, y, z) tuples in the sensor's units."""
+    __slots__ = ('flags', 'gyro_bias', 'accel_offset', 'accel_scale', 'mag_offset', 'mag_scale',
+                 'baro_baseline', 'temp')
+
+    def __init__(self):
+        self.flags = 0
+        self.gyro_bias = (0.0, 0.0, 0.0)      # deg/s, subtracted
+        self.accel_offset = (0.0, 0.0, 0.0)   # g, subtracted before scaling
+        self.accel_scale = (1.0, 1.0, 1.0)    # reading of 1 g along each axis
+        self.mag_offset = (0.0, 0.0, 0.0)     # hard iron, magnetometer units
+        self.mag_scale = (1.0, 1.0, 1.0)      # multiplies after the offset
+        self.baro_baseline = 0.0              # ground pressure, Pa
+        self.temp = float('nan')              # IMU temperature at calibration, deg C
+
+    def stale(self, temp, max_delta=MAX_TEMP_DELTA):
+        """True if the gyro bias is missing or was taken more than max_delta deg C away."""
+        if not self.flags & CAL_GYRO:
+            return True
+        d = temp - self.temp
+        return not -max_delta <= d <= max_delta  # NaN compares False: stale
+
+    def has_mag(self, sensor):
+        """True if there is a magnetometer calibration taken on `sensor` (CAL_MAG_*)."""
+        return bool(self.flags & CAL_MAG and self.flags & sensor)
+
+    def set_mag(self, offset, scale, sensor):
+        """Store a magnetometer offset/scale and tag it with the sensor it belongs to."""
+        self.mag_offset = tuple(offset)
+        self.mag_scale = tuple(scale)
+        self.flags = (self.flags & ~CAL_MAG_SENSORS) | CAL_MAG | sensor
+
+    def pack(self):
+        buf = bytearray(CAL_SIZE)
+        struct.pack_into(CAL_FMT, buf, 0, CAL_MAGIC, CAL_VERSION, self.flags,
+                         *(self.gyro_bias + self.accel_offset + self.accel_scale +
+                           self.mag_offset + self.mag_scale),
+                         self.baro_baseline, self.temp, 0)
+        struct.pack_into('<H', buf, CAL_SIZE - 2, _fletcher16(buf, CAL_SIZE - 2))
+        return bytes(buf)
+
+    @classmethod
+    def unpack(cls, data):
+        """Parse a packed record. Raises ValueError if it is short, foreign or corrupt."""
+        if len(data) < CAL_SIZE:
+            raise ValueError("calibration record too short")
+        rec = struct.unpack_from(CAL_FMT, data)
+        if rec[0] != CAL_MAGIC or rec[1] != CAL_VERSION:
+            raise ValueError("not a calibration record")
+        if rec[-1] != _fletcher16(data, CAL_SIZE - 2):
+            raise ValueError("calibration checksum mismatch")
+        cal = cls()
+        v = rec[3:]
+        cal.flags = rec[2]
+        cal.gyro_bias = v[0:3]
+        cal.accel_offset = v[3:6]
+        cal.accel_scale = v[6:9]
+        cal.mag_offset = v[9:12]
+        cal.mag_scale = v[12:15]
+        cal.baro_baseline = v[15]
+        cal.temp = v[16]
+        return cal
+
+    def save(self, path=CAL_FILE):
+        """Write atomically: a torn write leaves the previous file in place."""
+        import os
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.pack())
+        os.rename(tmp, path)
+
+
+def load(path=CAL_FILE):
+    """Read a saved Calibration, or None if the file is missing or invalid."""
+    try:
+        with open(path, 'rb') as f:
+            return Calibration.unpack(f.read(CAL_SIZE))
+    except (OSError, ValueError):
+        return None
+
+
+def _uncalibrated(imu):
+    prev = imu.calibration
+    imu.set_calibration(None)
+    return prev
+
+
+def calibrate_gyro(imu, cal, samples=200, max_std=1.0, wait=_wait):
+    """
+    Average the gyro with the board still and store the bias and IMU
+    temperature in `cal`. Raises ValueError if the rates vary by more than
+    max_std deg/s (the board moved).
+    """
+    prev = _uncalibrated(imu)
+    try:
+        s = [0.0, 0.0, 0.0]
+        ss = [0.0, 0.0, 0.0]
+        temp = 0.0
+        for _ in range(samples):
+            r = imu.read_burst()
+            for i in range(3):
+                g = r[3 + i]
+                s[i] += g
+                ss[i] += g * g
+            temp += r[6]
+            wait()
+    finally:
+        imu.set_calibration(prev)
+    mean = [v / samples for v in s]
+    for i in range(3):
+        if ss[i] / samples - mean[i] * mean[i] > max_std * max_std:
+            raise ValueError("gyro calibration needs the board to be still")
+    cal.gyro_bias = tuple(mean)
+    cal.temp = temp / samples
+    cal.flags |= CAL_GYRO
+    return cal.gyro_bias
+
+
+class AccelSixPosition:
+    """
+    Six-position accelerometer calibration. Call capture() once with each
+    axis pointing up and once down (any order); solve() then stores per-axis
+    offset and scale in a Calibration.
+    """
+
+    def __init__(self):
+        self.faces = [None] * 6  # index 2 * axis + (1 if pointing down)
+
+    def capture(self, imu, samples=100, wait=_wait):
+        """Average one still orientation. Returns the face index it filled."""
+        prev = _uncalibrated(imu)
+        try:
+            s = [0.0, 0.0, 0.0]
+            for _ in range(samples):
+                r = imu.read_burst()
+                s[0] += r[0]
+                s[1] += r[1]
+                s[2] += r[2]
+                wait()
+        finally:
+            imu.set_calibration(prev)
+        mean = [v / samples for v in s]
+        axis = max(range(3), key=lambda i: abs(mean[i]))
+        if abs(mean[axis]) < 0.8 or any(abs(mean[i]) > 0.3 for i in range(3) if i != axis):
+            raise ValueError("hold one axis vertical for each six-position capture")
+        face = 2 * axis + (1 if mean[axis] < 0 else 0)
+        self.faces[face] = mean[axis]
+        return face
+
+    def done(self):
+        return all(f is not None for f in self.faces)
+
+    def solve(self, cal):
+        if not self.done():
+            raise ValueError("six-position calibration is missing orientations")
+        f = self.faces
+        cal.accel_offset = tuple((f[2 * i] + f[2 * i + 1]) / 2 for i in range(3))
+        cal.accel_scale = tuple((f[2 * i] - f[2 * i + 1]) / 2 for i in range(3))
+        cal.flags |= CAL_ACCEL
+        return cal.accel_offset, cal.accel_scale
+
+
+def calibrate_mag(read, cal, samples=500, wait=_wait, sensor=CAL_MAG_QMC5883L):
+    """
+    Min/max magnetometer calibration while the board is turned through all
+    orientations. `read` returns one raw (x, y, z) reading from `sensor`.
+    Stores the hard-iron offset and a per-axis scale that equalises the
+    three ranges.
+    """
+    lo = [float('inf')] * 3
+    hi = [float('-inf')] * 3
+    for _ in range(samples):
+        m = read()
+        for i in range(3):
+            if m[i] < lo[i]:
+                lo[i] = m[i]
+            if m[i] > hi[i]:
+                hi[i] = m[i]
+        wait()
+    radius = [(hi[i] - lo[i]) / 2 for i in range(3)]
+    if min(radius) <= 0:
+        raise ValueError("magnetometer calibration needs rotation about every axis")
+    avg = sum(radius) / 3
+    cal.set_mag([(hi[i] + lo[i]) / 2 for i in range(3)], [avg / r for r in radius], sensor)
+    return cal.mag_offset, cal.mag_scale
+
+
+def capture_mag(read, path=MAG_SAMPLES_FILE, samples=1000, wait=_wait):
+    """
+    Log raw (x, y, z) readings as CSV lines for fit_ellipsoid() while the
+    board is turned through every orientation (figure-of-eight on all axes).
+    """
+    with open(path, 'w') as f:
+        for _ in range(samples):
+            x, y, z = read()
+            f.write('%d,%d,%d\n' % (x, y, z))
+            wait()
+
+
+def pack_mag(offset, matrix):
+    """Pack an ellipsoid fit (offset and 3x3 rows) into a checksummed record."""
+    buf = bytearray(MAG_SIZE)
+    struct.pack_into(MAG_FMT, buf, 0, MAG_MAGIC, CAL_VERSION,
+                     *(tuple(offset) + tuple(v for row in matrix for v in row)), 0)
+    struct.pack_into('<H', buf, MAG_SIZE - 2, _fletcher16(buf, MAG_SIZE - 2))
+    return bytes(buf)
+
+
+def unpack_mag(data):
+    """Returns (offset, matrix rows). Raises ValueError if short, foreign or corrupt."""
+    if len(data) < MAG_SIZE:
+        raise ValueError("magnetometer record too short")
+    rec = struct.unpack_from(MAG_FMT, data)
+    if rec[0] != MAG_MAGIC or rec[1] != CAL_VERSION:
+        raise ValueError("not a magnetometer record")
+    if rec[-1] != _fletcher16(data, MAG_SIZE - 2):
+        raise ValueError("magnetometer checksum mismatch")
+    v = rec[2:14]
+    return v[0:3], (v[3:6], v[6:9], v[9:12])
+
+
+def load_mag(path=MAG_FILE):
+    """Read ellipsoid coefficients as (offset, matrix), or None if missing or invalid."""
+    try:
+        with open(path, 'rb') as f:
+            return unpack_mag(f.read(MAG_SIZE))
+    except (OSError, ValueError):
+        return None
+
+
+class MagCalibrator:
+    """
+    Streaming magnetometer calibration for use in flight. Each update() is one
+    recursive least-squares step of a sphere fit (hard-iron offset) or, with
+    diagonal=True, an axis-aligned ellipsoid fit that adds a per-axis scale.
+    All state is a few fixed-size arrays: 4 or 6 parameters and their
+    covariance.
+
+    Alongside the fit it tracks which of 24 direction bins around the
+    estimated centre have been visited, and a running spread of the corrected
+    field magnitude, for both the fit and the reference calibration in use.
+    improved() is True once the fit has converged (enough samples and
+    coverage, small spread) and beats the reference; commit() then stores it
+    in a Calibration and saves it.
+    """
+    BINS = 24
+
+    def __init__(self, diagonal=False, forget=1.0, min_samples=300, min_coverage=0.75,
+                 max_spread=0.03, improvement=0.8, smoothing=0.02):
+        n = 6 if diagonal else 4
+        self.n = n
+        self.forget = forget
+        self.min_samples = min_samples
+        self.min_coverage = min_coverage
+        self.max_spread = max_spread
+        self.improvement = improvement
+        self.smoothing = smoothing
+        self.theta = array('f', [0.0] * n)
+        self.P = array('f', [0.0] * (n * n))
+        self._phi = array('f', [0.0] * n)
+        self._pphi = array('f', [0.0] * n)
+        self._stats = array('f', [0.0] * 4)  # running mean of r and r^2: fit, reference
+        self.set_reference((0.0, 0.0, 0.0), (1.0, 1.0, 1.0))
+        self.reset()
+
+    def reset(self):
+        """Forget all samples (e.g. after a payload or battery change)."""
+        n = self.n
+        for i in range(n):
+            self.theta[i] = 0.0
+            for j in range(n):
+                self.P[i * n + j] = 1000.0 if i == j else 0.0
+        for i in range(4):
+            self._stats[i] = 0.0
+        self._scale = 0.0  # 1 / first field magnitude: keeps the fit near unit values
+        self.samples = 0
+        self.bins = 0
+        self.valid = False
+        self.ox = self.oy = self.oz = 0.0
+        self.kx = self.ky = self.kz = 1.0
+
+    def set_reference(self, offset, scale):
+        """The offset/scale currently applied, in raw counts, to compare the fit against."""
+        self._ref = tuple(offset) + tuple(scale)
+        self._stats[2] = self._stats[3] = 0.0
+
+    def update(self, x, y, z):
+        """Add one raw reading (only feed fresh samples)."""
+        if not self._scale:
+            norm = math.sqrt(x * x + y * y + z * z)
+            if norm == 0.0:
+                return
+            self._scale = 1.0 / norm
+        s = self._scale
+        ref = self._ref
+        r = math.sqrt(((x - ref[0]) * ref[3]) ** 2 + ((y - ref[1]) * ref[4]) ** 2
+                      + ((z - ref[2]) * ref[5]) ** 2) * s
+        self._track(2, r)
+        x *= s
+        y *= s
+        z *= s
+        phi = self._phi
+        if self.n == 4:
+            # |m|^2 = 2 o.m + (R^2 - |o|^2)
+            phi[0] = x
+            phi[1] = y
+            phi[2] = z
+            phi[3] = 1.0
+            target = x * x + y * y + z * z
+        else:
+            # x^2 = -b y^2 - c z^2 + 2 ox x + 2 b oy y + 2 c oz z + k
+            phi[0] = -y * y
+            phi[1] = -z * z
+            phi[2] = x
+            phi[3] = y
+            phi[4] = z
+            phi[5] = 1.0
+            target = x * x
+        self._rls(target)
+        self.samples += 1
+        if not self._solve():
+            return
+        dx = x - self.ox
+        dy = y - self.oy
+        dz = z - self.oz
+        self._track(0, math.sqrt((dx * self.kx) ** 2 + (dy * self.ky) ** 2 + (dz * self.kz) ** 2))
+        # Direction bin: dominant axis, its sign and the signs of the other two
+        ax, ay, az = abs(dx), abs(dy), abs(dz)
+        if ax >= ay and ax >= az:
+            b = (dx < 0) * 4 + (dy < 0) * 2 + (dz < 0)
+        elif ay >= az:
+            b = 8 + (dy < 0) * 4 + (dx < 0) * 2 + (dz < 0)
+        else:
+            b = 16 + (dz < 0) * 4 + (dx < 0) * 2 + (dy < 0)
+        self.bins |= 1 << b
+
+    def _rls(self, target):
+        n = self.n
+        P = self.P
+        phi = self._phi
+        pphi = self._pphi
+        theta = self.theta
+        denom = self.forget
+        err = target
+        for i in range(n):
+            acc = 0.0
+            row = i * n
+            for j in range(n):
+                acc += P[row + j] * phi[j]
+            pphi[i] = acc
+            denom += phi[i] * acc
+            err -= theta[i] * phi[i]
+        inv = 1.0 / denom
+        for i in range(n):
+            theta[i] += pphi[i] * inv * err
+        # P = (P - P phi phi' P / denom) / forget; P stays symmetric
+        f = 1.0 / self.forget
+        for i in range(n):
+            gi = pphi[i] * inv
+            row = i * n
+            for j in range(n):
+                P[row + j] = (P[row + j] - gi * pphi[j]) * f
+
+    def _solve(self):
+        t = self.theta
+        if self.n == 4:
+            self.ox = 0.5 * t[0]
+            self.oy = 0.5 * t[1]
+            self.oz = 0.5 * t[2]
+        else:
+            b = t[0]
+            c = t[1]
+            if b <= 0.0 or c <= 0.0:
+                self.valid = False
+                return False
+            self.ox = 0.5 * t[2]
+            self.oy = 0.5 * t[3] / b
+            self.oz = 0.5 * t[4] / c
+            # Equalise the semi-axes, keeping their geometric mean
+            g = (b * c) ** (-1.0 / 6.0)
+            self.kx = g
+            self.ky = math.sqrt(b) * g
+            self.kz = math.sqrt(c) * g
+        self.valid = True
+        return True
+
+    def _track(self, i, r):
+        a = self.smoothing
+        st = self._stats
+        if not st[i]:
+            st[i] = r
+            st[i + 1] = r * r
+            return
+        st[i] += a * (r - st[i])
+        st[i + 1] += a * (r * r - st[i + 1])
+
+    def _spread(self, i):
+        st = self._stats
+        if not st[i]:
+            return float('inf')
+        var = st[i + 1] - st[i] * st[i]
+        return math.sqrt(var if var > 0.0 else 0.0) / st[i]
+
+    def spread(self):
+        """Running relative spread of |field| with the fit applied (0 for a perfect sphere)."""
+        return self._spread(0)
+
+    def reference_spread(self):
+        """The same for the reference calibration."""
+        return self._spread(2)
+
+    def coverage(self):
+        """Fraction of the direction bins visited."""
+        n = 0
+        b = self.bins
+        while b:
+            n += b & 1
+            b >>= 1
+        return n / self.BINS
+
+    def converged(self):
+        return (self.valid and self.samples >= self.min_samples
+                and self.coverage() >= self.min_coverage and self.spread() <= self.max_spread)
+
+    def improved(self):
+        """Converged and clearly better than the reference calibration."""
+        return self.converged() and self.spread() < self.improvement * self.reference_spread()
+
+    def offset(self):
+        """Hard-iron offset in raw counts."""
+        s = self._scale or 1.0
+        return self.ox / s, self.oy / s, self.oz / s
+
+    def scale(self):
+        return self.kx, self.ky, self.kz
+
+    def commit(self, cal, path=CAL_FILE, sensor=CAL_MAG_QMC5883L):
+        """
+        Store the fit as cal's magnetometer calibration for `sensor`, save cal
+        to `path` (None to skip the flash write) and make it the new
+        reference. Returns (offset, scale).
+        """
+        offset = self.offset()
+        scale = self.scale()
+        cal.set_mag(offset, scale, sensor)
+        if path is not None:
+            cal.save(path)
+        self.set_reference(offset, scale)
+        # The fit is now the reference: carry its running spread over
+        st = self._stats
+        st[2] = st[0]
+        st[3] = st[1]
+        return offset, scale
+
+
+def calibrate_baro(bmp, cal, samples=20, wait=_wait, max_polls=20000):
+    """
+    Average fresh BMP280 conversions (bmp280.BMP280.poll) into the ground
+    baseline. Raises OSError if max_polls pass without enough conversions.
+    """
+    total = 0.0
+    n = 0
+    for _ in range(max_polls):
+        if bmp.poll():
+            total += bmp.pressure
+            n += 1
+            if n == samples:
+                break
+        wait()
+    else:
+        raise OSError("barometer produced no conversions")
+    cal.baro_baseline = total / samples
+    cal.flags |= CAL_BARO
+    return cal.baro_baseline
+
+
+def fit_ellipsoid(samples):
+    """
+    Least-squares ellipsoid fit (CPython only; needs numpy). `samples` is an
+    (N, 3) array-like of raw readings covering many orientations. Returns
+    (offset, matrix) with matrix the symmetric 3x3 soft-iron correction that
+    maps readings onto a sphere whose radius is the geometric mean of the
+    ellipsoid's semi-axes, so corrected values stay in sensor counts.
+    Raises ValueError if the points do not determine an ellipsoid.
+    """
+    import numpy as np
+    p = np.asarray(samples, dtype=np.float64)
+    if p.ndim != 2 or p.shape[1] != 3 or len(p) < 9:
+        raise ValueError("need at least 9 (x, y, z) samples")
+    x, y, z = p.T
+    # a x^2 + b y^2 + c z^2 + 2d xy + 2e xz + 2f yz + 2g x + 2h y + 2i z = 1
+    d = np.column_stack((x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z,
+                         2 * x, 2 * y, 2 * z))
+    v = np.linalg.lstsq(d, np.ones(len(p)), rcond=None)[0]
+    a = np.array([[v[0], v[3], v[4]], [v[3], v[1], v[5]], [v[4], v[5], v[2]]])
+    try:
+        offset = -np.linalg.solve(a, v[6:9])
+    except np.linalg.LinAlgError:
+        raise ValueError("samples do not span an ellipsoid")
+    a = a / (1.0 + offset @ a @ offset)
+    w, vec = np.linalg.eigh(a)
+    if w.min() <= 0:
+        raise ValueError("samples do not span an ellipsoid; rotate about every axis")
+    radius = np.prod(1.0 / np.sqrt(w)) ** (1.0 / 3.0)
+    matrix = vec @ np.diag(np.sqrt(w) * radius) @ vec.T
+    return tuple(float(o) for o in offset), tuple(tuple(float(m) for m in row) for row in matrix)
+
+
+def fit_file(samples_path, out_path=MAG_FILE):
+    """Fit the CSV written by capture_mag() and save the coefficient file. Returns the fit."""
+    import numpy as np
+    p = np.loadtxt(samples_path, delimiter=',', ndmin=2)
+    offset, matrix = fit_ellipsoid(p)
+    with open(out_path, 'wb') as f:
+        f.write(pack_mag(offset, matrix))
+    m = (p - offset) @ np.array(matrix).T
+    r = np.linalg.norm(m, axis=1)
+    print("offset:", ", ".join("%.2f" % o for o in offset))
+    for row in matrix:
+        print("matrix:", ", ".join("%.5f" % v for v in row))
+    print("field radius %.1f, residual %.2f%% RMS over %d samples"
+          % (r.mean(), 100 * r.std() / r.mean(), len(p)))
+    return offset, matrix
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 3 or sys.argv[1] != 'fit':
+        print("usage: python calibration.py fit mag_samples.csv [mag_cal.bin]")
+        sys.exit(1)
+    fit_file(*sys.argv[2:4])
@@ -7,17 +7,7 @@ try:
     from machine import Pin, PWM
 except ImportError:
     # For local testing
-    class Pin:
-        OUT = 0
-        def __init__(self, pin, mode):
-            self.state = 0
-        def high(self):
-            self.state = 1
-        def low(self):
-            self.state = 0
-    class PWM:
-        def __init__(self, pin):
-            self.duty_u16 = lambda x: None
+    from mock_machine import Pin, PWM
 
 class DRV8833:
     """Simple DRV8833 half-bridge wrapper for a single brushed DC motor.
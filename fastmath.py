@@ -0,0 +1,125 @@
+# fastmath.py
+"""
+Fixed-cost approximations of atan2, asin and 1/sqrt for the Pico Drone hot
+paths. Each is a short polynomial (Abramowitz & Stegun 4.4.49 and 4.4.45)
+with no loops, so the cost does not depend on the input. Maximum absolute
+errors over the whole domain, as measured by benchmarks/bench_fastmath.py:
+
+    atan2(y, x)      1.2e-5 rad      atan2_deg(y, x)   6.6e-4 deg
+    asin(x)          6.8e-5 rad      asin_deg(x)       3.9e-3 deg
+    inv_sqrt(x)      5e-6 relative (two Newton steps)
+
+Well below the sensor noise in heading and attitude. The *_deg variants
+fold the radians-to-degrees factor into the coefficients, saving the
+math.degrees() call. Call sites choose per instance, e.g.
+Madgwick(fast_math=True) or MagnetometerGY273(i2c, fast_math=True); the
+default everywhere is the exact math module.
+
+Whether these win depends on the port: they replace libm calls with a few
+multiply-adds, which helps on a soft-float or FPU-without-libm target, while
+on CPython the C library is faster than any Python-level polynomial (see the
+benchmark). inv_sqrt() uses the bit-level seed trick and only pays off where
+math.sqrt is slow.
+"""
+import math
+import struct
+
+PI = math.pi
+HALF_PI = math.pi / 2
+RAD_TO_DEG = 180.0 / math.pi
+
+# atan(z) = z * (A1 + z^2 (A3 + z^2 (A5 + z^2 (A7 + z^2 A9)))) on [-1, 1]
+A1 = 0.9998660
+A3 = -0.3302995
+A5 = 0.1801410
+A7 = -0.0851330
+A9 = 0.0208351
+# asin(x) = pi/2 - sqrt(1 - x) (S0 + x (S1 + x (S2 + x S3))) on [0, 1]
+S0 = 1.5707288
+S1 = -0.2121144
+S2 = 0.0742610
+S3 = -0.0187293
+
+_D1 = A1 * RAD_TO_DEG
+_D3 = A3 * RAD_TO_DEG
+_D5 = A5 * RAD_TO_DEG
+_D7 = A7 * RAD_TO_DEG
+_D9 = A9 * RAD_TO_DEG
+_E0 = S0 * RAD_TO_DEG
+_E1 = S1 * RAD_TO_DEG
+_E2 = S2 * RAD_TO_DEG
+_E3 = S3 * RAD_TO_DEG
+
+_bits = bytearray(4)
+
+
+def atan2(y, x):
+    """math.atan2 to within 1.2e-5 rad. Returns 0 for (0, 0); -0.0 inputs count as positive."""
+    ax = x if x >= 0.0 else -x
+    ay = y if y >= 0.0 else -y
+    if ay <= ax:
+        if ax == 0.0:
+            return 0.0
+        z = ay / ax
+        z2 = z * z
+        a = z * (A1 + z2 * (A3 + z2 * (A5 + z2 * (A7 + z2 * A9))))
+    else:
+        z = ax / ay
+        z2 = z * z
+        a = HALF_PI - z * (A1 + z2 * (A3 + z2 * (A5 + z2 * (A7 + z2 * A9))))
+    if x < 0.0:
+        a = PI - a
+    return -a if y < 0.0 else a
+
+
+def atan2_deg(y, x):
+    """atan2(y, x) in degrees (-180 to 180) to within 7e-4 deg."""
+    ax = x if x >= 0.0 else -x
+    ay = y if y >= 0.0 else -y
+    if ay <= ax:
+        if ax == 0.0:
+            return 0.0
+        z = ay / ax
+        z2 = z * z
+        a = z * (_D1 + z2 * (_D3 + z2 * (_D5 + z2 * (_D7 + z2 * _D9))))
+    else:
+        z = ax / ay
+        z2 = z * z
+        a = 90.0 - z * (_D1 + z2 * (_D3 + z2 * (_D5 + z2 * (_D7 + z2 * _D9))))
+    if x < 0.0:
+        a = 180.0 - a
+    return -a if y < 0.0 else a
+
+
+def asin(x):
+    """math.asin to within 7e-5 rad; x is clamped to [-1, 1]."""
+    neg = x < 0.0
+    if neg:
+        x = -x
+    if x > 1.0:
+        x = 1.0
+    a = HALF_PI - math.sqrt(1.0 - x) * (S0 + x * (S1 + x * (S2 + x * S3)))
+    return -a if neg else a
+
+
+def asin_deg(x):
+    """asin(x) in degrees to within 4e-3 deg; x is clamped to [-1, 1]."""
+    neg = x < 0.0
+    if neg:
+        x = -x
+    if x > 1.0:
+        x = 1.0
+    a = 90.0 - math.sqrt(1.0 - x) * (_E0 + x * (_E1 + x * (_E2 + x * _E3)))
+    return -a if neg else a
+
+
+def inv_sqrt(x):
+    """1 / sqrt(x) for x > 0 to 5e-6 relative: float32 bit-level seed plus two Newton steps."""
+    b = _bits
+    struct.pack_into('<f', b, 0, x)
+    i = 0x5F3759DF - (struct.unpack_from('<I', b)[0] >> 1)
+    struct.pack_into('<I', b, 0, i)
+    y = struct.unpack_from('<f', b)[0]
+    h = 0.5 * x
+    y = y * (1.5 - h * y * y)
+    return y * (1.5 - h * y * y)
@@ -0,0 +1,138 @@
+# filters.py
+"""
+Cascaded biquad filters for the Pico Drone gyro path.
+
+FilterBank runs up to `max_stages` second-order sections per axis (low-pass
+or notch, RBJ audio-EQ cookbook designs) in transposed direct form II.
+Coefficients and state live in arrays allocated once in the constructor, so
+filtering a sample or a whole FIFO batch creates no lists, tuples or other
+containers. Each axis has its own chain; add_lowpass()/add_notch() append a
+stage to the axes given (all by default).
+
+    bank = FilterBank(3)
+    bank.add_lowpass(80.0, 1000.0)
+    bank.add_notch(160.0, 1000.0, q=3.0, axes=(0, 1))
+    gx = bank.update(0, gx)
+    bank.process(imu.fifo_data, n)  # gyro columns of n FIFO frames, in place
+"""
+import math
+from array import array
+
+BUTTERWORTH_Q = 0.7071067811865476
+NOTCH_Q = 3.0  # centre frequency / -3 dB width
+
+
+def _check(f, fs, q):
+    if not 0.0 < f < fs / 2:
+        raise ValueError("filter frequency must be between 0 and fs/2")
+    if q <= 0.0:
+        raise ValueError("filter Q must be positive")
+
+
+def lowpass_coeffs(fc, fs, q=BUTTERWORTH_Q):
+    """Second-order low-pass at fc Hz for sample rate fs. Returns (b0, b1, b2, a1, a2)."""
+    _check(fc, fs, q)
+    w0 = 2.0 * math.pi * fc / fs
+    cw = math.cos(w0)
+    alpha = math.sin(w0) / (2.0 * q)
+    a0 = 1.0 + alpha
+    b = (1.0 - cw) / (2.0 * a0)
+    return b, 2.0 * b, b, -2.0 * cw / a0, (1.0 - alpha) / a0
+
+
+def notch_coeffs(f0, fs, q=NOTCH_Q):
+    """Second-order notch centred on f0 Hz for sample rate fs. Returns (b0, b1, b2, a1, a2)."""
+    _check(f0, fs, q)
+    w0 = 2.0 * math.pi * f0 / fs
+    cw = math.cos(w0)
+    alpha = math.sin(w0) / (2.0 * q)
+    a0 = 1.0 + alpha
+    b1 = -2.0 * cw / a0
+    return 1.0 / a0, b1, 1.0 / a0, b1, (1.0 - alpha) / a0
+
+
+class FilterBank:
+    """Per-axis cascades of biquad stages with preallocated coefficients and state."""
+    __slots__ = ('axes', 'max_stages', 'stages', '_c', '_s')
+
+    def __init__(self, axes=3, max_stages=4):
+        self.axes = axes
+        self.max_stages = max_stages
+        self.stages = array('B', [0] * axes)  # stages in use per axis
+        self._c = array('f', [0.0] * (5 * axes * max_stages))  # b0 b1 b2 a1 a2 per stage
+        self._s = array('f', [0.0] * (2 * axes * max_stages))  # s1 s2 per stage
+
+    def _add(self, coeffs, axes):
+        if axes is None:
+            axes = range(self.axes)
+        for axis in axes:
+            if self.stages[axis] >= self.max_stages:
+                raise ValueError("filter bank axis %d is full" % axis)
+        stage = -1
+        for axis in axes:
+            k = self.stages[axis]
+            self._store(axis * self.max_stages + k, coeffs)
+            self.stages[axis] = k + 1
+            stage = k
+        return stage
+
+    def _store(self, k, coeffs):
+        c = self._c
+        j = 5 * k
+        for i in range(5):
+            c[j + i] = coeffs[i]
+
+    def add_lowpass(self, fc, fs, q=BUTTERWORTH_Q, axes=None):
+        """Append a low-pass stage to `axes` (default all). Returns its stage index."""
+        return self._add(lowpass_coeffs(fc, fs, q), axes)
+
+    def add_notch(self, f0, fs, q=NOTCH_Q, axes=None):
+        """Append a notch stage to `axes` (default all). Returns its stage index."""
+        return self._add(notch_coeffs(f0, fs, q), axes)
+
+    def set_notch(self, stage, f0, fs, q=NOTCH_Q, axes=None):
+        """Retune an existing stage to a notch at f0 without clearing its state."""
+        coeffs = notch_coeffs(f0, fs, q)
+        for axis in range(self.axes) if axes is None else axes:
+            if stage >= self.stages[axis]:
+                raise ValueError("no stage %d on axis %d" % (stage, axis))
+            self._store(axis * self.max_stages + stage, coeffs)
+
+    def clear(self):
+        """Remove every stage (all axes pass through unchanged)."""
+        for axis in range(self.axes):
+            self.stages[axis] = 0
+        self.reset()
+
+    def reset(self):
+        """Zero the filter state, e.g. after a FIFO overflow or a long pause."""
+        s = self._s
+        for i in range(len(s)):
+            s[i] = 0.0
+
+    def update(self, axis, x):
+        """Filter one sample through the chain of `axis` and return the output."""
+        c = self._c
+        s = self._s
+        base = axis * self.max_stages
+        for k in range(base, base + self.stages[axis]):
+            j = 5 * k
+            m = 2 * k
+            y = c[j] * x + s[m]
+            s[m] = c[j + 1] * x - c[j + 3] * y + s[m + 1]
+            s[m + 1] = c[j + 2] * x - c[j + 4] * y
+            x = y
+        return x
+
+    def process(self, data, n, offset=3, stride=6):
+        """
+        Filter n interleaved frames in place: axis a of frame i is
+        data[offset + a + i * stride]. The defaults select the gyro columns
+        of IMUGY91.fifo_data.
+        """
+        update = self.update
+        for axis in range(self.axes):
+            if not self.stages[axis]:
+                continue
+            for i in range(offset + axis, offset + axis + n * stride, stride):
+                data[i] = update(axis, data[i])
@@ -7,9 +7,14 @@ try:
       from machine import I2C, UART, Pin
 except ImportError:
       from mock_machine import I2C, UART, Pin
-import time
 import asyncio
-from imu_gy91 import IMUGY91
+from scheduler import Scheduler
+from instrumentation import LoopStats
+from telemetry import TelemetryLog
+from imu_gy91 import IMUGY91, IMUSample
+from filters import FilterBank
+import calibration
+from calibration import CAL_GYRO, CAL_MAG_QMC5883L
 from mag_gy273 import MagnetometerGY273
 from gps_neo6m import GPSNEO6M
 
@@ -25,10 +30,137 @@ uart = UART(1, baudrate=9600, tx=Pin(4), rx=Pin(5))
 
 print("I2C Scanning - ",i2c.scan())
 
-imu = IMUGY91(i2c)
-mag = MagnetometerGY273(i2c)
+# True: read the GY-91's own AK8963 through the MPU-9250 I2C master (one 21-byte
+# burst per IMU tick, 9-DoF attitude) instead of polling the GY-273 separately
+IMU_MAG = False
+
+# MPU ranges and filtering. The output rate is 1 kHz / (1 + IMU_RATE_DIV); the
+# 92 Hz DLPF (3.9 ms delay) keeps noise down without lagging a 1 kHz loop much.
+# See IMUGY91.configure() and GYRO_DLPF for the bandwidth/delay trade-off.
+IMU_ACCEL_RANGE = 4    # g
+IMU_GYRO_RANGE = 500   # deg/s
+IMU_DLPF = 2
+IMU_RATE_DIV = 0
+
+# True: the MPU samples into its FIFO at the output rate and each imu tick
+# drains the whole batch, so IMU_HZ can sit below the sensor rate without
+# dropping samples (drain at least every 40 ms)
+IMU_FIFO = False
+
+# True: Euler angles and heading use the fastmath polynomial atan2/asin
+# (fixed cost, within 0.004 deg) instead of math; per call site, see below.
+# Check benchmarks/bench_fastmath.py on the board before switching it on.
+FAST_MATH = False
+
+imu = IMUGY91(i2c, mag=IMU_MAG)
+imu.madgwick.fast_math = FAST_MATH
+imu.configure(IMU_ACCEL_RANGE, IMU_GYRO_RANGE, IMU_DLPF, IMU_RATE_DIV)
+if IMU_FIFO:
+      imu.enable_fifo()
+# BMP280 in normal mode with the datasheet's indoor navigation profile: x16
+# pressure / x2 temperature oversampling, IIR 16, 0.5 ms standby (~26 Hz output)
+imu.bmp.configure(osrs_t=2, osrs_p=16, iir=16, standby_ms=0.5)
+# Altitude above the take-off point; the ground reference is the first good
+# reading. The same table imu.read_all() uses, so both share one ground.
+baro_alt = imu.baro_alt
+# Magnetic declination at the flying site (degrees, east positive); heading is true
+MAG_DECLINATION = 0.0
+mag = None if IMU_MAG else MagnetometerGY273(i2c, MAG_DECLINATION, FAST_MATH)
 gps = GPSNEO6M(uart)
 
+# Calibration cache on flash. The gyro bias is re-measured (board still on the
+# ground, ~0.5 s) only when there is no cache or the IMU has warmed or cooled by
+# more than calibration.MAX_TEMP_DELTA since it was taken.
+CALIBRATION_FILE = calibration.CAL_FILE
+# Tries at the gyro bias before falling back to the cached (or zero) bias
+GYRO_CAL_ATTEMPTS = 3
+MAG_CALIBRATION_FILE = calibration.MAG_FILE
+
+# Online hard-iron calibration of the GY-273 while flying. A fit that has
+# converged and beats the calibration in use is applied at once and saved by
+# a background task at most every MAGCAL_SAVE_S seconds, never from the
+# flight loop; it is switched off when a host ellipsoid fit (mag_cal.bin) is
+# present.
+MAG_ONLINE_CAL = True
+MAGCAL_HZ = 10
+MAGCAL_SAVE_S = 60
+magcal_unsaved = False
+magcal = calibration.MagCalibrator() if MAG_ONLINE_CAL and mag is not None else None
+cal = calibration.Calibration()
+
+def load_calibration():
+      global cal, magcal
+      cal = calibration.load(CALIBRATION_FILE)
+      if cal is None:
+            cal = calibration.Calibration()
+      if cal.stale(imu.read_burst()[6]):
+            print("Calibrating gyro - keep the drone still")
+            for _ in range(GYRO_CAL_ATTEMPTS):
+                  try:
+                        calibration.calibrate_gyro(imu, cal)
+                  except ValueError:
+                        print("Gyro calibration disturbed - retrying")
+                        continue
+                  try:
+                        cal.save(CALIBRATION_FILE)
+                  except OSError as e:
+                        print("Calibration not saved:", e)
+                  break
+            else:
+                  # A bump at power-on must not stop the flight computer
+                  print("WARNING: gyro not calibrated, flying on the",
+                        "cached" if cal.flags & CAL_GYRO else "zero", "bias")
+      imu.set_calibration(cal)
+      if mag is not None:
+            # A host ellipsoid fit (calibration.py fit) beats the min/max one
+            ellipsoid = calibration.load_mag(MAG_CALIBRATION_FILE)
+            if ellipsoid is not None:
+                  mag.set_ellipsoid(*ellipsoid)
+                  magcal = None
+            elif cal.has_mag(CAL_MAG_QMC5883L):
+                  mag.set_calibration(cal.mag_offset, cal.mag_scale)
+                  if magcal is not None:
+                        magcal.set_reference(cal.mag_offset, cal.mag_scale)
+      return cal
+
+# Rate groups (Hz). Registered in this order, so the IMU runs first each pass.
+IMU_HZ = 500
+MAG_HZ = 100
+BARO_HZ = 50
+GPS_HZ = 10
+TELEMETRY_HZ = 10
+
+# Gyro filtering ahead of the attitude filter. The biquads need evenly spaced
+# samples at a known rate, which only the FIFO provides (the MPU's own clock).
+# On the scheduled path missed ticks are skipped, so the rate is uneven and
+# every corner frequency would move with it; without IMU_FIFO the gyro relies
+# on the MPU DLPF (IMU_DLPF) alone. Set GYRO_NOTCH_HZ to the motor vibration
+# peak seen in telemetry to add a notch on every axis.
+GYRO_LPF_HZ = 80.0
+GYRO_NOTCH_HZ = None
+if IMU_FIFO:
+      imu.gyro_filter = FilterBank(3)
+      imu.gyro_filter.add_lowpass(GYRO_LPF_HZ, imu.sample_rate)
+      if GYRO_NOTCH_HZ:
+            imu.gyro_filter.add_notch(GYRO_NOTCH_HZ, imu.sample_rate)
+
+# Loop timing instrumentation; set loop_stats.enabled = False to switch it off
+loop_stats = LoopStats()
+
+# Binary telemetry; the sink is opened in main() and flushed by telemetry.run().
+# Each boot starts a new file and keeps the previous one; a file stops growing
+# at TELEMETRY_MAX_BYTES (~13 min at 10 Hz) so flash stays free for calibration.
+TELEMETRY_FILE = 'telemetry.bin'
+TELEMETRY_PREV_FILE = 'telemetry.prev.bin'
+TELEMETRY_MAX_BYTES = 512 * 1024
+telemetry = TelemetryLog(max_bytes=TELEMETRY_MAX_BYTES)
+telemetry_task = None
+telemetry_restarts = 0
+
+# Latest value from each rate group, shared with the slower groups. Updated in
+# place by every group so the loop allocates no containers per tick.
+state = IMUSample()
+
 def drone_action(gamepad):
       # Replace with actual drone control logic
       if gamepad.is_up:
@@ -64,30 +196,174 @@ async def monitor_gamepad(gamepad):
             drone_action(gamepad)
             await asyncio.sleep(0.1)
 
-async def sensor_task():
+def imu_step(dt):
+      if IMU_FIFO:
+            n = imu.update_attitude_fifo()
+            if not n:
+                  return
+            d = imu.fifo_data
+            j = 6 * (n - 1)
+            state.ax = d[j]
+            state.ay = d[j + 1]
+            state.az = d[j + 2]
+            state.gx = d[j + 3]
+            state.gy = d[j + 4]
+            state.gz = d[j + 5]
+      else:
+            imu.update_attitude(dt, state)
+      imu.madgwick.euler_into(state)
+      if IMU_MAG:
+            # Yaw is counter-clockwise from magnetic north; heading is clockwise and true
+            state.heading = (MAG_DECLINATION - state.yaw) % 360.0
+
+def mag_step(dt):
+      # Status-gated: the heading is only recomputed when the QMC5883L has new data.
+      # Tilt comes from the roll/pitch sin/cos imu_step's euler_into() left behind.
+      if mag.update():
+            state.heading = mag.tilt_heading(imu.madgwick)
+
+def magcal_step(dt):
+      # Feeds the latest fresh sample; an improved fit is applied here and
+      # left for magcal_save_task() to write
+      global magcal_unsaved
+      if mag.stale:
+            return
+      magcal.update(mag.x, mag.y, mag.z)
+      if magcal.improved():
+            offset, scale = magcal.commit(cal, None, CAL_MAG_QMC5883L)
+            mag.set_calibration(offset, scale)
+            magcal_unsaved = True
+            print("Magnetometer calibration updated:", offset, scale)
+
+def save_magcal():
+      """Write a pending in-flight mag calibration; True once it is on flash."""
+      global magcal_unsaved
+      if not magcal_unsaved:
+            return False
+      try:
+            cal.save(CALIBRATION_FILE)
+      except OSError as e:
+            print("Calibration not saved:", e)  # kept pending, retried next time
+            return False
+      magcal_unsaved = False
+      return True
+
+async def magcal_save_task():
+      while True:
+            await asyncio.sleep(MAGCAL_SAVE_S)
+            save_magcal()
+
+def baro_step(dt):
+      # Own rate group, off the IMU path; the bus is only touched for new data
+      bmp = imu.bmp
+      # A pressure of 0 means the BMP280 has no calibration data: skip it and
+      # keep waiting for a real reading before taking the ground reference
+      if bmp.poll() and bmp.pressure > 0:
+            if baro_alt.ground is None:
+                  baro_alt.set_ground(bmp.pressure)
+            state.temp = bmp.temperature
+            state.press = bmp.pressure
+            state.alt = baro_alt.altitude(bmp.pressure)
+
+def gps_step(dt):
+      gps.poll()
+      state.set_gps(gps.latest())
+
+def open_telemetry():
+      import os
+      try:
+            os.remove(TELEMETRY_PREV_FILE)
+      except OSError:
+            pass
+      try:
+            os.rename(TELEMETRY_FILE, TELEMETRY_PREV_FILE)
+      except OSError:
+            pass
+      try:
+            return open(TELEMETRY_FILE, 'wb')
+      except OSError as e:
+            print("Telemetry disabled:", e)
+            return None
+
+def start_telemetry():
+      global telemetry_task
+      telemetry_task = asyncio.create_task(telemetry.run())
+      return telemetry_task
+
+def telemetry_step(dt):
+      # Packs into the ring only; never blocks on flash or USB serial
+      global telemetry_restarts
+      if telemetry_task is not None and telemetry_task.done():
+            # The flusher never returns; if it died, restart it before the ring fills
+            telemetry_restarts += 1
+            start_telemetry()
+      s = state
+      telemetry.log(s.ax, s.ay, s.az, s.gx, s.gy, s.gz, s.temp, s.alt, s.pitch, s.roll,
+                    s.heading, s.lat, s.lon, s.alt_gps, s.gps_valid)
+
+def build_scheduler(clock=None, stats=None):
       """
-      Periodically read sensors and print data.
+      Create the flight loop scheduler. Each group gets the exact dt since
+      its own previous run and skips (rather than bunches up) missed ticks.
       """
-      # Use time.monotonic for cross-platform timing
-      last = time.monotonic()
-      print("ax,ay,az,gx,gy,gz,tempC,alt_m,pitch,roll,heading,lat,lon,alt_gps")
-      while True:
-            now = time.monotonic()
-            dt = now - last
-            last = now
+      sched = Scheduler(clock, stats)
+      sched.add('imu', IMU_HZ, imu_step)
+      if mag is not None:
+            sched.add('mag', MAG_HZ, mag_step)
+      if magcal is not None:
+            sched.add('magcal', MAGCAL_HZ, magcal_step)
+      sched.add('baro', BARO_HZ, baro_step)
+      sched.add('gps', GPS_HZ, gps_step)
+      sched.add('telemetry', TELEMETRY_HZ, telemetry_step)
+      return sched
 
-            imu_data = imu.read_all(dt)
-            heading = mag.read_heading()
-            gps_data = gps.get_location()
+async def sensor_task():
+      """
+      Run the multi-rate sensor and telemetry loop.
+      """
+      await build_scheduler(stats=loop_stats).run()
 
-            print(f"{imu_data['ax']:.2f},{imu_data['ay']:.2f},{imu_data['az']:.2f},"
-                    f"{imu_data['gx']:.2f},{imu_data['gy']:.2f},{imu_data['gz']:.2f},"
-                    f"{imu_data['temp']:.2f},{imu_data['alt']:.2f},{imu_data['pitch']:.2f},{imu_data['roll']:.2f},"
-                    f"{heading:.2f},{gps_data['lat']:.6f},{gps_data['lon']:.6f},{gps_data['alt']:.2f}")
+def handle_command(line):
+      """
+      Serial console commands: 'stats' dumps loop timing, 'reset' clears it.
+      """
+      cmd = line.strip()
+      if cmd == 'stats':
+            loop_stats.dump()
+            print(f"telemetry,written={telemetry.written},dropped={telemetry.dropped},"
+                  f"flushed_bytes={telemetry.flushed},lost_bytes={telemetry.lost},"
+                  f"restarts={telemetry_restarts}")
+            if mag is not None:
+                  print(f"mag,overflows={mag.overflows},overruns={mag.overruns}")
+      elif cmd == 'reset':
+            loop_stats.reset()
+            print('Loop stats reset')
+      elif cmd:
+            print('Unknown command:', cmd)
 
+async def command_task():
+      """
+      Poll the USB serial console for commands without blocking the loop.
+      """
+      import sys
+      try:
+            import select
+            poller = select.poll()
+            poller.register(sys.stdin, select.POLLIN)
+      except (ImportError, AttributeError, OSError):
+            return
+      while True:
+            if poller.poll(0):
+                  handle_command(sys.stdin.readline())
             await asyncio.sleep(0.1)
 
 async def main():
+      load_calibration()
+      if telemetry.sink is None:
+            telemetry.sink = open_telemetry()
+      start_telemetry()
+      # Held for the life of main() so the task is not garbage collected
+      saver = asyncio.create_task(magcal_save_task()) if magcal is not None else None
       if GamePadServer is not None:
             gamepad = GamePadServer()
             blink = asyncio.create_task(gamepad.blink_task())
@@ -95,10 +371,11 @@ async def main():
             gamepad.tasks.append(monitor)
             gamepad.tasks.append(blink)
             sensor = asyncio.create_task(sensor_task())
-            await asyncio.gather(gamepad.main(), sensor)
+            commands = asyncio.create_task(command_task())
+            await asyncio.gather(gamepad.main(), sensor, commands)
       else:
             print("GamePadServer not available, running sensor task only.")
-            await sensor_task()
+            await asyncio.gather(sensor_task(), command_task())
 
 if __name__ == "__main__":
       while True:
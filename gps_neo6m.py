@@ -3,20 +3,602 @@
 Module for interfacing with a NEO-6M compatible GPS module on the Raspberry Pi Pico 2W using MicroPython.
 """
 import time
+import asyncio
+import struct
+
+# Fix timestamps are raw ticks_ms; ages go through ticks_diff so they stay
+# right across the MicroPython tick wrap (2**30 ms, about 12.4 days)
+try:
+    _ticks_ms = time.ticks_ms
+    _ticks_diff = time.ticks_diff
+except AttributeError:  # CPython
+    def _ticks_ms():
+        return time.monotonic_ns() // 1000000
+
+    def _ticks_diff(a, b):
+        return a - b
+
+RX_BUF_SIZE = 512  # Longest NMEA sentence is 82 bytes; leave room for bursts
+
+# Sentence type codes reported by NMEAParser.last_type
+NMEA_GGA = 1
+NMEA_RMC = 2
+NMEA_VTG = 3
+NMEA_GSA = 4
+NMEA_GSV = 5
+
+KNOTS_TO_MS = 0.514444
+KMH_TO_MS = 1.0 / 3.6
+
+_NMEA_MAX_FIELD = 16
+_NMEA_MAX_FIELDS = 20
+_ST_IDLE = 0
+_ST_BODY = 1
+_ST_CK_HI = 2
+_ST_CK_LO = 3
+
+# UBX binary protocol (u-blox 6 receiver description, protocol 7.03)
+UBX_SYNC1 = 0xB5
+UBX_SYNC2 = 0x62
+UBX_CLS_NAV = 0x01
+UBX_CLS_ACK = 0x05
+UBX_CLS_CFG = 0x06
+UBX_CLS_NMEA = 0xF0
+UBX_NAV_POSLLH = 0x02
+UBX_NAV_SOL = 0x06
+UBX_NAV_VELNED = 0x12
+UBX_ACK_NAK = 0x00
+UBX_ACK_ACK = 0x01
+UBX_CFG_PRT = 0x00
+UBX_CFG_MSG = 0x01
+UBX_CFG_RATE = 0x08
+UBX_MAX_PAYLOAD = 64  # NAV-SOL (52 bytes) is the largest frame we decode
+
+_UBX_SYNC1 = 0
+_UBX_SYNC2 = 1
+_UBX_HEADER = 2
+_UBX_PAYLOAD = 3
+_UBX_CK_A = 4
+_UBX_CK_B = 5
+
+
+class GPSFix:
+    """Latest navigation solution, updated in place by NMEAParser.
+
+    Units: degrees for lat/lon/course, metres for alt/accuracy, m/s for
+    speed and NED velocity, milliseconds for the GPS time of week (itow).
+    time is hhmmss.ss as a float, date is ddmmyy as an int.
+    """
+    __slots__ = ('lat', 'lon', 'alt', 'speed', 'course', 'hdop', 'pdop', 'vdop',
+                 'fix_quality', 'fix_type', 'satellites', 'satellites_in_view',
+                 'time', 'date', 'valid',
+                 'vel_n', 'vel_e', 'vel_d', 'h_acc', 'v_acc', 'itow')
+
+    def __init__(self):
+        self.lat = None
+        self.lon = None
+        self.alt = None
+        self.speed = None
+        self.course = None
+        self.hdop = None
+        self.pdop = None
+        self.vdop = None
+        self.fix_quality = 0
+        self.fix_type = 1  # GSA: 1 = no fix, 2 = 2D, 3 = 3D
+        self.satellites = 0
+        self.satellites_in_view = 0
+        self.time = None
+        self.date = None
+        self.valid = False
+        # Filled by the UBX driver only
+        self.vel_n = None
+        self.vel_e = None
+        self.vel_d = None
+        self.h_acc = None
+        self.v_acc = None
+        self.itow = None
+
+
+def _hex_nibble(b):
+    if 48 <= b <= 57:
+        return b - 48
+    if 65 <= b <= 70:
+        return b - 55
+    if 97 <= b <= 102:
+        return b - 87
+    return -1
+
+
+class NMEAParser:
+    """Byte-level incremental NMEA 0183 parser.
+
+    Bytes can be fed in arbitrary chunks. The XOR checksum is accumulated as
+    bytes arrive and a sentence only reaches the GPSFix once its *hh checksum
+    matches. Accepts $GP and $GN talkers for GGA, RMC, VTG, GSA and GSV; all
+    other sentences are checked and skipped. `positions` counts the GGA/RMC
+    sentences that carried a valid position.
+    """
+
+    def __init__(self, fix=None):
+        self.fix = fix if fix is not None else GPSFix()
+        self._field = bytearray(_NMEA_MAX_FIELD)
+        self._vals = [None] * _NMEA_MAX_FIELDS
+        self._state = _ST_IDLE
+        self._flen = 0
+        self._findex = 0
+        self._type = 0
+        self._ck = 0
+        self._rx_ck = 0
+        self.last_type = 0
+        self.sentences = 0
+        self.positions = 0
+        self.checksum_errors = 0
+
+    def feed(self, data):
+        """Consume bytes from any buffer; returns the number of valid sentences applied."""
+        done = 0
+        field = self._field
+        state = self._state
+        flen = self._flen
+        ck = self._ck
+        for b in data:
+            if b == 36:  # '$' always starts a new sentence
+                if state != _ST_IDLE:
+                    self._clear()  # the previous one was cut short
+                state = _ST_BODY
+                flen = 0
+                ck = 0
+                self._findex = 0
+                self._type = 0
+            elif state == _ST_BODY:
+                if b == 42:  # '*'
+                    self._flen = flen
+                    self._end_field()
+                    state = _ST_CK_HI
+                elif b == 44:  # ','
+                    ck ^= b
+                    self._flen = flen
+                    self._end_field()
+                    flen = 0
+                elif b == 13 or b == 10:
+                    state = _ST_IDLE  # no checksum: reject
+                    self.checksum_errors += 1
+                    self._clear()
+                elif flen < _NMEA_MAX_FIELD:
+                    ck ^= b
+                    field[flen] = b
+                    flen += 1
+                else:
+                    state = _ST_IDLE  # field too long: not NMEA
+                    self._clear()
+            elif state == _ST_CK_HI:
+                n = _hex_nibble(b)
+                if n < 0:
+                    state = _ST_IDLE
+                    self.checksum_errors += 1
+                    self._clear()
+                else:
+                    self._rx_ck = n << 4
+                    state = _ST_CK_LO
+            elif state == _ST_CK_LO:
+                n = _hex_nibble(b)
+                state = _ST_IDLE
+                if n < 0 or (self._rx_ck | n) != ck:
+                    self.checksum_errors += 1
+                    self._clear()
+                else:
+                    self.sentences += 1
+                    if self._type:
+                        self._commit()
+                        done += 1
+        self._state = state
+        self._flen = flen
+        self._ck = ck
+        return done
+
+    def _end_field(self):
+        idx = self._findex
+        self._findex = idx + 1
+        f = self._field
+        n = self._flen
+        if idx == 0:
+            self._type = self._sentence_type(f, n)
+            return
+        if not self._type or idx >= _NMEA_MAX_FIELDS:
+            return
+        if n == 0:
+            val = None
+        elif (self._type == NMEA_GGA and (idx == 2 or idx == 4)) or \
+                (self._type == NMEA_RMC and (idx == 3 or idx == 5)):
+            val = self._coord(f, n)
+        elif f[0] == 45 or f[0] == 46 or 48 <= f[0] <= 57:
+            val = self._number(f, 0, n)
+        else:
+            val = f[0]  # single-character flag such as N/S/E/W or A/V
+        self._vals[idx] = val
+
+    @staticmethod
+    def _sentence_type(f, n):
+        if n != 5 or f[0] != 71 or (f[1] != 80 and f[1] != 78):  # 'G', 'P' | 'N'
+            return 0
+        a, b, c = f[2], f[3], f[4]
+        if a == 71 and b == 71 and c == 65:
+            return NMEA_GGA
+        if a == 82 and b == 77 and c == 67:
+            return NMEA_RMC
+        if a == 86 and b == 84 and c == 71:
+            return NMEA_VTG
+        if a == 71 and b == 83 and c == 65:
+            return NMEA_GSA
+        if a == 71 and b == 83 and c == 86:
+            return NMEA_GSV
+        return 0
+
+    @staticmethod
+    def _number(f, start, end):
+        neg = False
+        if start < end and f[start] == 45:
+            neg = True
+            start += 1
+        ipart = 0
+        frac = 0
+        div = 1
+        seen_dot = False
+        for i in range(start, end):
+            c = f[i]
+            if c == 46:
+                seen_dot = True
+            elif 48 <= c <= 57:
+                if seen_dot:
+                    frac = frac * 10 + (c - 48)
+                    div *= 10
+                else:
+                    ipart = ipart * 10 + (c - 48)
+            else:
+                return None
+        val = ipart + frac / div
+        return -val if neg else val
+
+    def _coord(self, f, n):
+        # ddmm.mmmm / dddmm.mmmm: degrees are everything before the last two integer digits
+        dot = n
+        for i in range(n):
+            if f[i] == 46:
+                dot = i
+                break
+        split = dot - 2
+        if split < 1:
+            return None
+        deg = self._number(f, 0, split)
+        minutes = self._number(f, split, n)
+        if deg is None or minutes is None:
+            return None
+        return deg + minutes / 60.0
+
+    def _commit(self):
+        v = self._vals
+        fix = self.fix
+        t = self._type
+        self.last_type = t
+        if t == NMEA_GGA:
+            fix.time = v[1]
+            quality = int(v[6]) if v[6] is not None else 0
+            fix.fix_quality = quality
+            fix.satellites = int(v[7]) if v[7] is not None else 0
+            fix.hdop = v[8]
+            fix.valid = quality > 0
+            if fix.valid and v[2] is not None and v[4] is not None:
+                fix.lat = -v[2] if v[3] == 83 else v[2]  # 'S'
+                fix.lon = -v[4] if v[5] == 87 else v[4]  # 'W'
+                fix.alt = v[9]
+                self.positions += 1
+        elif t == NMEA_RMC:
+            fix.time = v[1]
+            fix.valid = v[2] == 65  # 'A' active, 'V' void
+            if fix.valid and v[3] is not None and v[5] is not None:
+                fix.lat = -v[3] if v[4] == 83 else v[3]
+                fix.lon = -v[5] if v[6] == 87 else v[5]
+                self.positions += 1
+            fix.speed = v[7] * KNOTS_TO_MS if v[7] is not None else None
+            fix.course = v[8]
+            fix.date = int(v[9]) if v[9] is not None else None
+        elif t == NMEA_VTG:
+            fix.course = v[1]
+            if v[7] is not None:
+                fix.speed = v[7] * KMH_TO_MS
+            elif v[5] is not None:
+                fix.speed = v[5] * KNOTS_TO_MS
+        elif t == NMEA_GSA:
+            fix.fix_type = int(v[2]) if v[2] is not None else 1
+            fix.pdop = v[15]
+            fix.hdop = v[16]
+            fix.vdop = v[17]
+        elif t == NMEA_GSV:
+            if v[3] is not None:
+                fix.satellites_in_view = int(v[3])
+        self._clear()
+
+    def _clear(self):
+        v = self._vals
+        for i in range(_NMEA_MAX_FIELDS):
+            v[i] = None
+
+
+def ubx_checksum(data, start=0, end=None):
+    """8-bit Fletcher checksum over class, id, length and payload."""
+    if end is None:
+        end = len(data)
+    ck_a = 0
+    ck_b = 0
+    for i in range(start, end):
+        ck_a = (ck_a + data[i]) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return ck_a, ck_b
+
+
+def ubx_frame(cls, msg_id, payload=b''):
+    """Build a complete UBX frame (sync, header, payload, checksum)."""
+    frame = bytearray(8 + len(payload))
+    frame[0] = UBX_SYNC1
+    frame[1] = UBX_SYNC2
+    struct.pack_into('<BBH', frame, 2, cls, msg_id, len(payload))
+    frame[6:6 + len(payload)] = payload
+    frame[-2], frame[-1] = ubx_checksum(frame, 2, 6 + len(payload))
+    return frame
+
+
+class UBXParser:
+    """Byte-level UBX frame decoder for NAV-POSLLH, NAV-VELNED and NAV-SOL.
+
+    Shares the feed()/fix interface with NMEAParser so GPSNEO6M.poll() can use
+    either. Frames are only applied once the Fletcher checksum matches;
+    payloads are decoded with struct.unpack_from from a preallocated buffer.
+    """
+
+    def __init__(self, fix=None):
+        self.fix = fix if fix is not None else GPSFix()
+        self._payload = bytearray(UBX_MAX_PAYLOAD)
+        self._header = bytearray(4)
+        self._state = _UBX_SYNC1
+        self._pos = 0
+        self._len = 0
+        self._ck_a = 0
+        self._ck_b = 0
+        self.last_ack = None  # (cls, id, acked) of the latest ACK-ACK/ACK-NAK
+        self.frames = 0
+        self.positions = 0  # NAV-POSLLH frames applied
+        self.checksum_errors = 0
+        self.oversize = 0
+
+    def feed(self, data):
+        """Consume bytes from any buffer; returns the number of NAV frames applied."""
+        done = 0
+        for b in data:
+            state = self._state
+            if state == _UBX_SYNC1:
+                if b == UBX_SYNC1:
+                    self._state = _UBX_SYNC2
+            elif state == _UBX_SYNC2:
+                if b == UBX_SYNC2:
+                    self._state = _UBX_HEADER
+                    self._pos = 0
+                    self._ck_a = 0
+                    self._ck_b = 0
+                else:
+                    self._state = _UBX_SYNC2 if b == UBX_SYNC1 else _UBX_SYNC1
+            elif state == _UBX_HEADER or state == _UBX_PAYLOAD:
+                self._ck_a = (self._ck_a + b) & 0xFF
+                self._ck_b = (self._ck_b + self._ck_a) & 0xFF
+                pos = self._pos
+                if state == _UBX_HEADER:
+                    self._header[pos] = b
+                    pos += 1
+                    if pos == 4:
+                        self._len = self._header[2] | (self._header[3] << 8)
+                        pos = 0
+                        if self._len > UBX_MAX_PAYLOAD:
+                            self.oversize += 1
+                            self._state = _UBX_SYNC1
+                        elif self._len == 0:
+                            self._state = _UBX_CK_A
+                        else:
+                            self._state = _UBX_PAYLOAD
+                else:
+                    self._payload[pos] = b
+                    pos += 1
+                    if pos == self._len:
+                        self._state = _UBX_CK_A
+                self._pos = pos
+            elif state == _UBX_CK_A:
+                if b == self._ck_a:
+                    self._state = _UBX_CK_B
+                else:
+                    self.checksum_errors += 1
+                    self._state = _UBX_SYNC1
+            else:
+                self._state = _UBX_SYNC1
+                if b == self._ck_b:
+                    self.frames += 1
+                    done += self._dispatch()
+                else:
+                    self.checksum_errors += 1
+        return done
+
+    def _dispatch(self):
+        cls = self._header[0]
+        msg_id = self._header[1]
+        n = self._len
+        buf = self._payload
+        fix = self.fix
+        if cls == UBX_CLS_NAV:
+            if msg_id == UBX_NAV_POSLLH and n == 28:
+                itow, lon, lat, _, h_msl, h_acc, v_acc = struct.unpack_from('<IiiiiII', buf)
+                fix.itow = itow
+                fix.lon = lon * 1e-7
+                fix.lat = lat * 1e-7
+                fix.alt = h_msl * 0.001
+                fix.h_acc = h_acc * 0.001
+                fix.v_acc = v_acc * 0.001
+                self.positions += 1
+                return 1
+            if msg_id == UBX_NAV_VELNED and n == 36:
+                itow, vn, ve, vd, _, g_speed, heading, _, _ = struct.unpack_from('<IiiiIIiII', buf)
+                fix.itow = itow
+                fix.vel_n = vn * 0.01
+                fix.vel_e = ve * 0.01
+                fix.vel_d = vd * 0.01
+                fix.speed = g_speed * 0.01
+                fix.course = heading * 1e-5
+                return 1
+            if msg_id == UBX_NAV_SOL and n == 52:
+                gps_fix, flags = struct.unpack_from('<BB', buf, 10)
+                p_dop, = struct.unpack_from('<H', buf, 44)
+                fix.fix_type = gps_fix
+                fix.valid = bool(flags & 0x01) and 2 <= gps_fix <= 4
+                fix.fix_quality = 1 if fix.valid else 0
+                fix.satellites = buf[47]
+                fix.pdop = p_dop * 0.01
+                return 1
+        elif cls == UBX_CLS_ACK and n == 2:
+            self.last_ack = (buf[0], buf[1], msg_id == UBX_ACK_ACK)
+        return 0
+
 
 class GPSNEO6M:
-    def __init__(self, uart):
+    def __init__(self, uart, rx_size=RX_BUF_SIZE):
         self.uart = uart
-        self.buffer = b''
+        # Fixed-size ring buffer for UART bytes; no per-byte allocations
+        self._rx = bytearray(rx_size)
+        self._rx_mv = memoryview(self._rx)
+        self._rx_head = 0      # index of the oldest unread byte
+        self._rx_count = 0     # bytes currently held
+        self._rx_scanned = 0   # bytes after head already checked for '\n'
+        self.rx_overflows = 0  # lines dropped because they did not fit
+        self._rx_discard = False  # skip up to the next newline after an overflow
+        self.fix = GPSFix()
+        self.parser = NMEAParser(self.fix)
+        self._fix_time = None
 
-    def read_sentence(self):
-        while self.uart.any():
-            self.buffer += self.uart.read(1)
-            if b'\n' in self.buffer:
-                line, self.buffer = self.buffer.split(b'\n', 1)
-                return line.decode('utf-8').strip()
+    def _fill(self):
+        """
+        Pull what the UART has into the ring in as few reads as possible,
+        stopping when the ring is full; the caller drains it and calls again.
+        Returns the number of bytes read.
+        """
+        uart = self.uart
+        size = len(self._rx)
+        total = 0
+        pending = uart.any()
+        while pending and self._rx_count < size:
+            tail = (self._rx_head + self._rx_count) % size
+            chunk = min(pending, size - self._rx_count, size - tail)
+            got = self._readinto(self._rx_mv[tail:tail + chunk], chunk)
+            if not got:
+                break
+            self._rx_count += got
+            total += got
+            pending = uart.any()
+        return total
+
+    def _drop(self):
+        # Full without a newline: the partial line is garbage, drop it and
+        # skip its tail up to the next newline or '$'
+        self.rx_overflows += 1
+        self._rx_head = 0
+        self._rx_count = 0
+        self._rx_scanned = 0
+        self._rx_discard = True
+
+    def _readinto(self, mv, n):
+        readinto = getattr(self.uart, 'readinto', None)
+        if readinto is not None:
+            return readinto(mv, n) or 0
+        data = self.uart.read(n)
+        if not data:
+            return 0
+        mv[:len(data)] = data
+        return len(data)
+
+    def _take_line(self):
+        """Return the next complete line as bytes (without newline), or None."""
+        rx = self._rx_mv
+        size = len(self._rx)
+        i = self._rx_scanned
+        while i < self._rx_count:
+            head = self._rx_head
+            b = rx[(head + i) % size]
+            if b == 36 and self._rx_discard:
+                # '$' starts a new sentence: the dropped line ends before it
+                self._rx_head = (head + i) % size
+                self._rx_count -= i
+                self._rx_discard = False
+                i = 0
+                continue
+            if b != 10:
+                i += 1
+                continue
+            end = head + i
+            self._rx_head = (end + 1) % size
+            self._rx_count -= i + 1
+            self._rx_scanned = 0
+            if self._rx_discard:
+                self._rx_discard = False
+                i = 0
+                continue
+            if end < size:
+                return bytes(rx[head:end])
+            return bytes(rx[head:size]) + bytes(rx[0:end - size])
+        self._rx_scanned = self._rx_count
         return None
 
+    def read_sentence(self):
+        line = self._take_line()
+        while line is None:
+            if self._rx_count == len(self._rx):
+                self._drop()
+            if not self._fill():
+                return None
+            line = self._take_line()
+        return line.decode('utf-8').strip()
+
+    def sentences(self):
+        """Yield every complete sentence currently available on the UART."""
+        while True:
+            sentence = self.read_sentence()
+            if sentence is None:
+                return
+            yield sentence
+
+    def enable_ubx(self, baudrate=115200, rate_ms=200, nav_rate=1):
+        """
+        Switch the receiver to binary UBX output.
+
+        Enables NAV-POSLLH/VELNED/SOL, disables the NMEA sentences, sets the
+        measurement period (200 ms = 5 Hz, 100 ms = 10 Hz) and finally raises
+        the port baud rate with CFG-PRT and re-inits the local UART to match.
+        poll()/run() then decode UBX instead of NMEA.
+        """
+        uart = self.uart
+        for msg_id in (UBX_NAV_POSLLH, UBX_NAV_VELNED, UBX_NAV_SOL):
+            uart.write(ubx_frame(UBX_CLS_CFG, UBX_CFG_MSG, bytes((UBX_CLS_NAV, msg_id, 1))))
+        for msg_id in range(6):  # GGA, GLL, GSA, GSV, RMC, VTG
+            uart.write(ubx_frame(UBX_CLS_CFG, UBX_CFG_MSG, bytes((UBX_CLS_NMEA, msg_id, 0))))
+        uart.write(ubx_frame(UBX_CLS_CFG, UBX_CFG_RATE, struct.pack('<HHH', rate_ms, nav_rate, 1)))
+        # UART1, 8N1, UBX+NMEA in, UBX out; sent last because the link changes speed
+        prt = struct.pack('<BBHIIHHHH', 1, 0, 0, 0x000008D0, baudrate, 0x0003, 0x0001, 0, 0)
+        uart.write(ubx_frame(UBX_CLS_CFG, UBX_CFG_PRT, prt))
+        flush = getattr(uart, 'flush', None)
+        if flush is not None:
+            flush()
+        init = getattr(uart, 'init', None)
+        if init is not None:
+            init(baudrate=baudrate)
+        self.parser = UBXParser(self.fix)
+        self._rx_head = 0
+        self._rx_count = 0
+        self._rx_scanned = 0
+        self._rx_discard = False
+
     def parse_gpgga(self, sentence):
         # Example: $GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47
         parts = sentence.split(',')
@@ -72,3 +654,63 @@ class GPSNEO6M:
         if logger:
             logger(f"GPS: No valid location after {max_attempts} attempts.")
         return None
+
+    def poll(self, logger=None):
+        """
+        Drain whatever the UART currently holds without blocking and run it
+        through the active parser (NMEA, or UBX after enable_ubx()). Returns
+        True if a valid position fix was applied.
+        """
+        size = len(self._rx)
+        parser = self.parser
+        positions = parser.positions
+        while True:
+            try:
+                self._fill()
+            except Exception as e:
+                if logger:
+                    logger(f"GPS read error: {e}")
+                break
+            count = self._rx_count
+            if not count:
+                break
+            head = self._rx_head
+            end = head + count
+            if end <= size:
+                parser.feed(self._rx_mv[head:end])
+            else:
+                parser.feed(self._rx_mv[head:size])
+                parser.feed(self._rx_mv[0:end - size])
+            # The parser resynchronises on its own; no line state to keep
+            self._rx_head = end % size
+            self._rx_count = 0
+            self._rx_scanned = 0
+            self._rx_discard = False
+            if count < size:
+                break
+        # Only a new position refreshes the fix time; GSV/GSA/VTG do not
+        if parser.positions != positions and self.fix.valid:
+            self._fix_time = _ticks_ms()
+            return True
+        return False
+
+    def latest(self):
+        """Return the in-place GPSFix once a position is known, else None. Never touches the UART."""
+        if self._fix_time is None:
+            return None
+        return self.fix
+
+    def fix_age(self):
+        """Seconds since the latest fix was parsed, or None if there is none."""
+        if self._fix_time is None:
+            return None
+        return _ticks_diff(_ticks_ms(), self._fix_time) / 1000.0
+
+    async def run(self, interval=0.05, logger=None):
+        """
+        Background task: continuously drain the UART so the control loop can
+        read the latest fix with latest() instead of waiting on get_location().
+        """
+        while True:
+            self.poll(logger)
+            await asyncio.sleep(interval)
@@ -6,22 +6,21 @@ from machine import I2C, Pin
 import time
 from imu_gy91 import IMUGY91
 from mag_gy273 import MagnetometerGY273
+import calibration
 
 def calibrate_mag(mag, samples=100):
+    # Prefer the ellipsoid fit from calibration.py; fall back to min/max
+    ellipsoid = calibration.load_mag()
+    if ellipsoid is not None:
+        print("Using magnetometer ellipsoid calibration from", calibration.MAG_FILE)
+        mag.set_ellipsoid(*ellipsoid)
+        return
     print("Calibrating magnetometer... Move the device in all directions.")
-    min_x = min_y = min_z = 32767
-    max_x = max_y = max_z = -32768
-    for _ in range(samples):
-        x, y, z = mag.read_raw()
-        min_x = min(min_x, x)
-        max_x = max(max_x, x)
-        min_y = min(min_y, y)
-        max_y = max(max_y, y)
-        min_z = min(min_z, z)
-        max_z = max(max_z, z)
-        time.sleep(0.02)
+    cal = calibration.Calibration()
+    calibration.calibrate_mag(mag.read_raw, cal, samples, wait=lambda: time.sleep(0.02),
+                              sensor=calibration.CAL_MAG_QMC5883L)
+    mag.set_calibration(cal.mag_offset, cal.mag_scale)
     print("Magnetometer calibration complete.")
-    return (min_x, max_x, min_y, max_y, min_z, max_z)
 
 def calibrate_baro(imu, samples=50):
     print("Calibrating barometer... Keep the device still.")
@@ -40,16 +39,13 @@ def main():
     mag = MagnetometerGY273(i2c)
 
     # Calibrate sensors
-    mag_cal = calibrate_mag(mag)
+    calibrate_mag(mag)
     baro_base = calibrate_baro(imu)
 
     print("\nLive heading, altitude, and orientation (Ctrl+C to stop):")
     while True:
         # Magnetometer heading with calibration
-        x, y, z = mag.read_raw()
-        x_corr = x - (mag_cal[0] + mag_cal[1]) / 2
-        y_corr = y - (mag_cal[2] + mag_cal[3]) / 2
-        heading = mag.calculate_heading(x_corr, y_corr)
+        heading = mag.read_heading()
         # Altitude
         _, alt = imu.read_bmp280()
         rel_alt = alt - baro_base
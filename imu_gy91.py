@@ -7,58 +7,598 @@ try:
 except ImportError:
     from mock_machine import I2C, Pin
 import math
+import struct
+import time
+from array import array
+from bmp280 import BMP280, AltitudeLUT, exact_altitude
+import fastmath
+from calibration import CAL_ACCEL, CAL_GYRO, CAL_MAG_AK8963
 
 MPU_ADDR = 0x68
 MPU_PWR_MGMT_1 = 0x6B
-BMP_ADDR = 0x76
-BMP_TEMP_MSB = 0xFA
-BMP_PRESS_MSB = 0xF7
-BMP_CTRL_MEAS = 0xF4
-BMP_CONFIG = 0xF5
+MPU_ACCEL_XOUT_H = 0x3B
+MPU_GYRO_XOUT_H = 0x43
+MPU_BURST_LEN = 14  # ACCEL_XOUT_H..GYRO_ZOUT_L (0x3B-0x48), includes temperature
+ACCEL_SCALE = 16384.0  # LSB/g at +/-2 g
+GYRO_SCALE = 131.0  # LSB/(deg/s) at +/-250 deg/s
+
+# Full-scale ranges and digital low-pass filter (register map rev 1.6, 4.5-4.7)
+MPU_GYRO_CONFIG = 0x1B
+MPU_ACCEL_CONFIG = 0x1C
+MPU_ACCEL_CONFIG2 = 0x1D
+ACCEL_RANGES = (2, 4, 8, 16)          # g, index is ACCEL_FS_SEL
+ACCEL_LSB = (16384.0, 8192.0, 4096.0, 2048.0)
+GYRO_RANGES = (250, 500, 1000, 2000)  # deg/s, index is GYRO_FS_SEL
+GYRO_LSB = (131.0, 65.5, 32.8, 16.4)
+# (bandwidth Hz, delay ms) for DLPF_CFG 0-7; 0 and 7 run the gyro at 8 kHz
+GYRO_DLPF = ((250, 0.97), (184, 2.9), (92, 3.9), (41, 5.9), (20, 9.9), (10, 17.85),
+             (5, 33.48), (3600, 0.17))
+# (bandwidth Hz, delay ms) for A_DLPF_CFG 0-7 at the 1 kHz accelerometer rate
+ACCEL_DLPF = ((218.1, 1.88), (218.1, 1.88), (99.0, 2.88), (44.8, 4.88), (21.2, 8.87),
+              (10.2, 16.83), (5.05, 32.48), (420.0, 1.38))
+
+# Sample rate divider and FIFO
+MPU_SMPLRT_DIV = 0x19
+MPU_CONFIG = 0x1A
+MPU_FIFO_EN = 0x23
+MPU_FIFO_COUNTH = 0x72
+MPU_FIFO_R_W = 0x74
+MPU_FIFO_SIZE = 512
+MPU_FIFO_FRAME = 12  # accel + gyro; temperature is not queued
+MPU_CONFIG_FIFO_MODE = 0x40  # keep the oldest data when the FIFO is full
+MPU_USER_FIFO_EN = 0x40
+MPU_USER_FIFO_RST = 0x04
+MPU_USER_I2C_MST_EN = 0x20
+
+# MPU-9250 auxiliary I2C master, used to slave the AK8963 magnetometer
+MPU_I2C_MST_CTRL = 0x24
+MPU_I2C_SLV0_ADDR = 0x25
+MPU_I2C_SLV0_REG = 0x26
+MPU_I2C_SLV0_CTRL = 0x27
+MPU_I2C_SLV4_ADDR = 0x31
+MPU_I2C_SLV4_REG = 0x32
+MPU_I2C_SLV4_DO = 0x33
+MPU_I2C_SLV4_CTRL = 0x34
+MPU_I2C_SLV4_DI = 0x35
+MPU_I2C_MST_STATUS = 0x36
+MPU_EXT_SENS_DATA_00 = 0x49
+MPU_USER_CTRL = 0x6A
+MPU_BURST9_LEN = 21  # MPU_BURST_LEN + AK8963 HXL..ST2 mirrored at EXT_SENS_DATA_00 (0x49-0x4F)
+AK_ADDR = 0x0C
+AK_WIA = 0x00
+AK_HXL = 0x03
+AK_CNTL1 = 0x0A
+AK_CNTL2 = 0x0B
+AK_ASAX = 0x10
+AK_MODE_FUSE_ROM = 0x0F
+AK_MODE_CONT2_16BIT = 0x16  # 100 Hz continuous, 16-bit output
+AK_ST2_HOFL = 0x08
+MAG_SCALE = 0.15  # uT/LSB in 16-bit mode
+
+try:
+    _sleep_ms = time.sleep_ms
+    _ticks_us = time.ticks_us
+    _ticks_diff = time.ticks_diff
+    _ticks_add = time.ticks_add
+except AttributeError:  # CPython
+    def _sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+    def _ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def _ticks_diff(a, b):
+        return a - b
+
+    def _ticks_add(a, b):
+        return a + b
+
+# Keys of the dict returned by IMUGY91.read_all() when no IMUSample is passed
+READ_ALL_KEYS = ('ax', 'ay', 'az', 'gx', 'gy', 'gz', 'temp', 'press', 'alt', 'pitch', 'roll')
+READ_ALL_KEYS_MAG = READ_ALL_KEYS + ('mx', 'my', 'mz', 'yaw')
+
+DEG_TO_RAD = math.pi / 180.0
+RAD_TO_DEG = 180.0 / math.pi
+
 
 class Madgwick:
-    def __init__(self, beta=0.1):
+    """
+    Madgwick gradient-descent orientation filter.
+
+    update() fuses gyro (deg/s) and accel (any unit) for 6-DoF attitude;
+    update_marg() adds a magnetometer for drift-free yaw. beta is the
+    gradient-descent gain. The quaternion lives in four slot floats and is
+    updated in place, so an update does not build lists or tuples.
+
+    euler_into() (or update_tilt()) also leaves sin/cos of roll and pitch in
+    sin_roll, cos_roll, sin_pitch and cos_pitch, taken from the quaternion
+    products it already has, for consumers such as tilt-compensated heading.
+
+    With fast_math the Euler angles come from the fastmath polynomials
+    (within 0.004 deg) instead of math.atan2/asin.
+    """
+    __slots__ = ('beta', 'q0', 'q1', 'q2', 'q3', 'sin_roll', 'cos_roll', 'sin_pitch',
+                 'cos_pitch', 'fast_math')
+
+    def __init__(self, beta=0.1, fast_math=False):
         self.beta = beta
-        self.q = [1.0, 0.0, 0.0, 0.0]
+        self.fast_math = fast_math
+        self.q0 = 1.0
+        self.q1 = 0.0
+        self.q2 = 0.0
+        self.q3 = 0.0
+        self.sin_roll = self.sin_pitch = 0.0
+        self.cos_roll = self.cos_pitch = 1.0
+
+    @property
+    def q(self):
+        return (self.q0, self.q1, self.q2, self.q3)
+
+    def reset(self):
+        self.q0 = 1.0
+        self.q1 = 0.0
+        self.q2 = 0.0
+        self.q3 = 0.0
 
     def update(self, gx, gy, gz, ax, ay, az, dt):
-        q1, q2, q3, q4 = self.q
-        norm = math.sqrt(ax * ax + ay * ay + az * az)
-        if norm == 0:
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        gx *= DEG_TO_RAD
+        gy *= DEG_TO_RAD
+        gz *= DEG_TO_RAD
+        # Rate of change of quaternion from gyroscope
+        qDot1 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qDot2 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qDot3 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qDot4 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+        norm = ax * ax + ay * ay + az * az
+        if norm > 0.0:
+            norm = 1.0 / math.sqrt(norm)
+            ax *= norm
+            ay *= norm
+            az *= norm
+            _2q0 = 2.0 * q0
+            _2q1 = 2.0 * q1
+            _2q2 = 2.0 * q2
+            _2q3 = 2.0 * q3
+            _4q0 = 4.0 * q0
+            _4q1 = 4.0 * q1
+            _4q2 = 4.0 * q2
+            _8q1 = 8.0 * q1
+            _8q2 = 8.0 * q2
+            q0q0 = q0 * q0
+            q1q1 = q1 * q1
+            q2q2 = q2 * q2
+            q3q3 = q3 * q3
+            # Gradient of the accelerometer objective function
+            s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+            s1 = (_4q1 * q3q3 - _2q3 * ax + 4.0 * q0q0 * q1 - _2q0 * ay - _4q1
+                  + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az)
+            s2 = (4.0 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2
+                  + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az)
+            s3 = 4.0 * q1q1 * q3 - _2q1 * ax + 4.0 * q2q2 * q3 - _2q2 * ay
+            norm = s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3
+            if norm > 0.0:
+                norm = self.beta / math.sqrt(norm)
+                qDot1 -= norm * s0
+                qDot2 -= norm * s1
+                qDot3 -= norm * s2
+                qDot4 -= norm * s3
+        self._integrate(q0 + qDot1 * dt, q1 + qDot2 * dt, q2 + qDot3 * dt, q3 + qDot4 * dt)
+
+    def update_marg(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        """9-DoF update; falls back to update() when the magnetometer reads zero."""
+        mnorm = mx * mx + my * my + mz * mz
+        anorm = ax * ax + ay * ay + az * az
+        if mnorm == 0.0 or anorm == 0.0:
+            self.update(gx, gy, gz, ax, ay, az, dt)
             return
-        ax /= norm
-        ay /= norm
-        az /= norm
-        gx = math.radians(gx)
-        gy = math.radians(gy)
-        gz = math.radians(gz)
-        qDot1 = 0.5 * (-q2 * gx - q3 * gy - q4 * gz)
-        qDot2 = 0.5 * (q1 * gx + q3 * gz - q4 * gy)
-        qDot3 = 0.5 * (q1 * gy - q2 * gz + q4 * gx)
-        qDot4 = 0.5 * (q1 * gz + q2 * gy - q3 * gx)
-        q1 += qDot1 * dt
-        q2 += qDot2 * dt
-        q3 += qDot3 * dt
-        q4 += qDot4 * dt
-        norm = math.sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)
-        self.q = [q1 / norm, q2 / norm, q3 / norm, q4 / norm]
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        gx *= DEG_TO_RAD
+        gy *= DEG_TO_RAD
+        gz *= DEG_TO_RAD
+        qDot1 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qDot2 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qDot3 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qDot4 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+        anorm = 1.0 / math.sqrt(anorm)
+        ax *= anorm
+        ay *= anorm
+        az *= anorm
+        mnorm = 1.0 / math.sqrt(mnorm)
+        mx *= mnorm
+        my *= mnorm
+        mz *= mnorm
+        _2q0mx = 2.0 * q0 * mx
+        _2q0my = 2.0 * q0 * my
+        _2q0mz = 2.0 * q0 * mz
+        _2q1mx = 2.0 * q1 * mx
+        _2q0 = 2.0 * q0
+        _2q1 = 2.0 * q1
+        _2q2 = 2.0 * q2
+        _2q3 = 2.0 * q3
+        _2q0q2 = 2.0 * q0 * q2
+        _2q2q3 = 2.0 * q2 * q3
+        q0q0 = q0 * q0
+        q0q1 = q0 * q1
+        q0q2 = q0 * q2
+        q0q3 = q0 * q3
+        q1q1 = q1 * q1
+        q1q2 = q1 * q2
+        q1q3 = q1 * q3
+        q2q2 = q2 * q2
+        q2q3 = q2 * q3
+        q3q3 = q3 * q3
+        # Reference direction of Earth's magnetic field
+        hx = (mx * q0q0 - _2q0my * q3 + _2q0mz * q2 + mx * q1q1 + _2q1 * my * q2
+              + _2q1 * mz * q3 - mx * q2q2 - mx * q3q3)
+        hy = (_2q0mx * q3 + my * q0q0 - _2q0mz * q1 + _2q1mx * q2 - my * q1q1
+              + my * q2q2 + _2q2 * mz * q3 - my * q3q3)
+        _2bx = math.sqrt(hx * hx + hy * hy)
+        _2bz = (-_2q0mx * q2 + _2q0my * q1 + mz * q0q0 + _2q1mx * q3 - mz * q1q1
+                + _2q2 * my * q3 - mz * q2q2 + mz * q3q3)
+        _4bx = 2.0 * _2bx
+        _4bz = 2.0 * _2bz
+        # Objective function residuals shared by the gradient terms
+        fa = 2.0 * q1q3 - _2q0q2 - ax
+        fb = 2.0 * q0q1 + _2q2q3 - ay
+        fc = 1.0 - 2.0 * q1q1 - 2.0 * q2q2 - az
+        fx = _2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx
+        fy = _2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my
+        fz = _2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz
+        s0 = -_2q2 * fa + _2q1 * fb - _2bz * q2 * fx + (-_2bx * q3 + _2bz * q1) * fy + _2bx * q2 * fz
+        s1 = (_2q3 * fa + _2q0 * fb - 4.0 * q1 * fc + _2bz * q3 * fx
+              + (_2bx * q2 + _2bz * q0) * fy + (_2bx * q3 - _4bz * q1) * fz)
+        s2 = (-_2q0 * fa + _2q3 * fb - 4.0 * q2 * fc + (-_4bx * q2 - _2bz * q0) * fx
+              + (_2bx * q1 + _2bz * q3) * fy + (_2bx * q0 - _4bz * q2) * fz)
+        s3 = (_2q1 * fa + _2q2 * fb + (-_4bx * q3 + _2bz * q1) * fx
+              + (-_2bx * q0 + _2bz * q2) * fy + _2bx * q1 * fz)
+        norm = s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3
+        if norm > 0.0:
+            norm = self.beta / math.sqrt(norm)
+            qDot1 -= norm * s0
+            qDot2 -= norm * s1
+            qDot3 -= norm * s2
+            qDot4 -= norm * s3
+        self._integrate(q0 + qDot1 * dt, q1 + qDot2 * dt, q2 + qDot3 * dt, q3 + qDot4 * dt)
+
+    def _integrate(self, q0, q1, q2, q3):
+        norm = 1.0 / math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        self.q0 = q0 * norm
+        self.q1 = q1 * norm
+        self.q2 = q2 * norm
+        self.q3 = q3 * norm
 
     def get_euler(self):
-        q1, q2, q3, q4 = self.q
-        roll = math.atan2(2.0 * (q1 * q2 + q3 * q4), 1.0 - 2.0 * (q2 * q2 + q3 * q3))
-        pitch = math.asin(2.0 * (q1 * q3 - q4 * q2))
-        return math.degrees(pitch), math.degrees(roll)
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        gy = 2.0 * (q0 * q1 + q2 * q3)
+        gz = 1.0 - 2.0 * (q1 * q1 + q2 * q2)
+        sinp = 2.0 * (q0 * q2 - q3 * q1)
+        if sinp > 1.0:
+            sinp = 1.0
+        elif sinp < -1.0:
+            sinp = -1.0
+        if self.fast_math:
+            return fastmath.asin_deg(sinp), fastmath.atan2_deg(gy, gz)
+        pitch = math.asin(sinp)
+        return pitch * RAD_TO_DEG, math.atan2(gy, gz) * RAD_TO_DEG
+
+    def get_yaw(self):
+        """Yaw in degrees (counter-clockwise about z, meaningful with update_marg())."""
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        if self.fast_math:
+            return fastmath.atan2_deg(2.0 * (q0 * q3 + q1 * q2), 1.0 - 2.0 * (q2 * q2 + q3 * q3))
+        return math.atan2(2.0 * (q0 * q3 + q1 * q2), 1.0 - 2.0 * (q2 * q2 + q3 * q3)) * RAD_TO_DEG
+
+    def update_tilt(self):
+        """
+        Refresh sin/cos of roll and pitch from the quaternion. The gravity
+        direction in body axes is (-sin(pitch), cos(pitch) sin(roll),
+        cos(pitch) cos(roll)), so this costs one sqrt and no trig.
+        """
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        self._tilt(2.0 * (q0 * q1 + q2 * q3), 1.0 - 2.0 * (q1 * q1 + q2 * q2),
+                   2.0 * (q0 * q2 - q3 * q1))
+
+    def _tilt(self, gy, gz, sinp):
+        if sinp > 1.0:
+            sinp = 1.0
+        elif sinp < -1.0:
+            sinp = -1.0
+        self.sin_pitch = sinp
+        cp = math.sqrt(gy * gy + gz * gz)
+        self.cos_pitch = cp
+        if cp > 0.0:
+            self.sin_roll = gy / cp
+            self.cos_roll = gz / cp
+        return sinp
+
+    def euler_into(self, out):
+        """Write pitch, roll and yaw (degrees) into out's attributes without building a tuple."""
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        gy = 2.0 * (q0 * q1 + q2 * q3)
+        gz = 1.0 - 2.0 * (q1 * q1 + q2 * q2)
+        sinp = self._tilt(gy, gz, 2.0 * (q0 * q2 - q3 * q1))
+        yy = 2.0 * (q0 * q3 + q1 * q2)
+        yx = 1.0 - 2.0 * (q2 * q2 + q3 * q3)
+        if self.fast_math:
+            out.roll = fastmath.atan2_deg(gy, gz)
+            out.pitch = fastmath.asin_deg(sinp)
+            out.yaw = fastmath.atan2_deg(yy, yx)
+        else:
+            out.roll = math.atan2(gy, gz) * RAD_TO_DEG
+            out.pitch = math.asin(sinp) * RAD_TO_DEG
+            out.yaw = math.atan2(yy, yx) * RAD_TO_DEG
+
+
+def _be16(buf, i):
+    v = (buf[i] << 8) | buf[i + 1]
+    return v - 0x10000 if v & 0x8000 else v
+
+
+def _le16(buf, i):
+    v = buf[i] | (buf[i + 1] << 8)
+    return v - 0x10000 if v & 0x8000 else v
+
+
+class IMUSample:
+    """
+    One tick of flight state, reused in place: accel (g), gyro (deg/s), field
+    (uT, 9-DoF mode only), barometer temperature (deg C), pressure (Pa) and
+    altitude (m), attitude and heading (deg) and the latest GPS position.
+    Pass the same instance to IMUGY91.read_all() / update_attitude() every
+    tick so the loop builds no dicts or tuples.
+
+    gps_valid is the one place consumers (telemetry, navigation) check for a
+    current fix; lat/lon/alt_gps keep the last known position after it is lost.
+    """
+    __slots__ = ('ax', 'ay', 'az', 'gx', 'gy', 'gz', 'mx', 'my', 'mz',
+                 'temp', 'press', 'alt', 'pitch', 'roll', 'yaw', 'heading',
+                 'lat', 'lon', 'alt_gps', 'gps_valid')
+
+    def __init__(self):
+        self.ax = self.ay = self.az = 0.0
+        self.gx = self.gy = self.gz = 0.0
+        self.mx = self.my = self.mz = 0.0
+        self.temp = self.press = self.alt = 0.0
+        self.pitch = self.roll = self.yaw = self.heading = 0.0
+        self.set_gps(None)
+
+    def set_gps(self, fix):
+        """
+        Copy position from a gps_neo6m.GPSFix. With None, or a fix that has no
+        position yet, lat/lon/alt_gps become NaN; gps_valid is fix.valid only
+        when a position is present.
+        """
+        if fix is None or fix.lat is None or fix.lon is None:
+            self.lat = self.lon = self.alt_gps = float('nan')
+            self.gps_valid = False
+        else:
+            self.lat = fix.lat
+            self.lon = fix.lon
+            self.alt_gps = fix.alt if fix.alt is not None else float('nan')
+            self.gps_valid = fix.valid
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
 
 class IMUGY91:
-    def __init__(self, i2c):
+    """
+    GY-91 driver. With mag=True the MPU-9250 auxiliary I2C master is set up to
+    copy the AK8963 magnetometer into EXT_SENS_DATA every sample, so
+    read_burst9() gets accel, temperature, gyro and mag in one transaction and
+    the attitude filter runs in 9-DoF (MARG) mode.
+
+    configure() sets the full-scale ranges, DLPF and output data rate; the
+    constructor applies +/-2 g, +/-250 deg/s and the 184 Hz filter at 1 kHz.
+
+    enable_fifo() switches to batch mode: the MPU samples at a fixed rate into
+    its FIFO and update_attitude_fifo() drains every queued frame in one
+    transfer, so the Python loop can run slower than the sensor without
+    missing or repeating samples.
+
+    `clock` is a ticks_us-style function used for FIFO timestamps and
+    barometer scheduling; inject one for tests.
+
+    gyro_filter, if set to a filters.FilterBank, filters the rates on the
+    update_attitude paths before the attitude filter sees them.
+    """
+
+    def __init__(self, i2c, mag=False, clock=None):
         self.i2c = i2c
+        self.clock = clock
         self.madgwick = Madgwick()
+        self.gyro_filter = None
+        # Preallocated buffers so the hot path does not allocate per read
+        self._burst = bytearray(MPU_BURST_LEN)
+        self._buf6 = bytearray(6)
+        self._reg = bytearray(1)
+        self.mag = mag
+        self._burst9 = bytearray(MPU_BURST9_LEN) if mag else None
+        # Latest valid field in uT; held over samples where the AK8963 overflows
+        self.mx = self.my = self.mz = 0.0
+        self.mag_overflows = 0
+        self._mag_asa = (MAG_SCALE, MAG_SCALE, MAG_SCALE)
+        self.accel_lsb = ACCEL_SCALE
+        self.gyro_lsb = GYRO_SCALE
+        self._buf2 = bytearray(2)
+        self.fifo = False
+        self.fifo_overflows = 0
+        self._alt = float('nan')
+        # Height above the first good barometer reading; shared with the flight loop
+        self.baro_alt = AltitudeLUT()
+        self.calibration = None
+        self.set_calibration(None)
         self._init_sensors()
 
     def _init_sensors(self):
         self.i2c.writeto_mem(MPU_ADDR, MPU_PWR_MGMT_1, b'\x00')
-        self.i2c.writeto_mem(BMP_ADDR, BMP_CTRL_MEAS, b'\x27')
-        self.i2c.writeto_mem(BMP_ADDR, BMP_CONFIG, b'\xA0')
+        self.configure()
+        self.bmp = BMP280(self.i2c, clock=self.clock)
+        if self.mag:
+            self._init_ak8963()
+
+    def configure(self, accel_range=2, gyro_range=250, dlpf=1, rate_div=0, accel_dlpf=None):
+        """
+        Set the full-scale ranges (g, deg/s), gyro DLPF_CFG (0-7), sample rate
+        divider and accelerometer A_DLPF_CFG (default: the closest match to
+        the gyro filter). The output rate is 1 kHz / (1 + rate_div) for dlpf
+        1-6; dlpf 0 and 7 bypass the divider at 8 kHz. Raises ValueError for
+        settings outside the datasheet or where the filter bandwidth is above
+        half the output rate (the samples would alias), and for dlpf 0/7 while
+        the FIFO is enabled (8 kHz fills it in 5 ms).
+
+        Wider bandwidth means less filter delay (see GYRO_DLPF) but more
+        noise. The scale factors are recomputed here, once.
+        """
+        if accel_range not in ACCEL_RANGES:
+            raise ValueError("accel_range must be one of %r g" % (ACCEL_RANGES,))
+        if gyro_range not in GYRO_RANGES:
+            raise ValueError("gyro_range must be one of %r deg/s" % (GYRO_RANGES,))
+        if not 0 <= dlpf <= 7:
+            raise ValueError("dlpf must be 0-7")
+        if not 0 <= rate_div <= 255:
+            raise ValueError("rate_div must be 0-255")
+        if accel_dlpf is None:
+            accel_dlpf = dlpf
+        elif not 0 <= accel_dlpf <= 7:
+            raise ValueError("accel_dlpf must be 0-7")
+        if dlpf in (0, 7):
+            if self.fifo:
+                raise ValueError("dlpf must be 1-6 while the FIFO is enabled")
+            if rate_div:
+                raise ValueError("rate_div needs dlpf 1-6 (the 1 kHz internal rate)")
+            period_us = 125
+        else:
+            period_us = 1000 * (1 + rate_div)
+        rate = 1000000 / period_us
+        if 2 * GYRO_DLPF[dlpf][0] > rate or 2 * ACCEL_DLPF[accel_dlpf][0] > min(rate, 1000):
+            raise ValueError("filter bandwidth above half the %g Hz output rate" % rate)
+        a_fs = ACCEL_RANGES.index(accel_range)
+        g_fs = GYRO_RANGES.index(gyro_range)
+        self._mpu_write(MPU_GYRO_CONFIG, g_fs << 3)    # FCHOICE_B = 0: DLPF in use
+        self._mpu_write(MPU_ACCEL_CONFIG, a_fs << 3)
+        self._mpu_write(MPU_ACCEL_CONFIG2, accel_dlpf)
+        # FIFO_MODE only matters once the FIFO is enabled
+        self._mpu_write(MPU_CONFIG, MPU_CONFIG_FIFO_MODE | dlpf)
+        self._mpu_write(MPU_SMPLRT_DIV, rate_div)
+        self.accel_range = accel_range
+        self.gyro_range = gyro_range
+        self.dlpf = dlpf
+        self.accel_dlpf = accel_dlpf
+        self.rate_div = rate_div
+        self.sample_period_us = period_us
+        self.sample_rate = rate
+        self.bandwidth, self.delay_ms = GYRO_DLPF[dlpf]
+        self.accel_lsb = ACCEL_LSB[a_fs]
+        self.gyro_lsb = GYRO_LSB[g_fs]
+        self.set_calibration(self.calibration)
+        if self.fifo:
+            self.fifo_period_us = period_us
+            self.fifo_dt = period_us / 1000000
+            self.fifo_reset()
+
+    def _mpu_write(self, reg, value):
+        self._reg[0] = value
+        self.i2c.writeto_mem(MPU_ADDR, reg, self._reg)
+
+    def _mpu_read(self, reg):
+        self.i2c.readfrom_mem_into(MPU_ADDR, reg, self._reg)
+        return self._reg[0]
+
+    def _ak_transfer(self, reg, value=None, retries=20):
+        """
+        Single AK8963 register access through I2C_SLV4. Writes when `value` is
+        given, otherwise reads. Polls I2C_MST_STATUS for SLV4_DONE and raises
+        OSError if the magnetometer does not answer.
+        """
+        if value is None:
+            self._mpu_write(MPU_I2C_SLV4_ADDR, AK_ADDR | 0x80)
+        else:
+            self._mpu_write(MPU_I2C_SLV4_ADDR, AK_ADDR)
+            self._mpu_write(MPU_I2C_SLV4_DO, value)
+        self._mpu_write(MPU_I2C_SLV4_REG, reg)
+        self._mpu_write(MPU_I2C_SLV4_CTRL, 0x80)
+        for _ in range(retries):
+            status = self._mpu_read(MPU_I2C_MST_STATUS)
+            if status & 0x10:  # SLV4_NACK
+                break
+            if status & 0x40:  # SLV4_DONE
+                return self._mpu_read(MPU_I2C_SLV4_DI) if value is None else value
+            _sleep_ms(1)
+        raise OSError("AK8963 not responding on the MPU-9250 auxiliary bus")
+
+    def _init_ak8963(self):
+        self._mpu_write(MPU_USER_CTRL, MPU_USER_I2C_MST_EN)
+        self._mpu_write(MPU_I2C_MST_CTRL, 0x0D)   # 400 kHz auxiliary bus
+        self._ak_transfer(AK_CNTL2, 0x01)         # soft reset
+        if self._ak_transfer(AK_WIA) != 0x48:
+            raise OSError("AK8963 not found (WIA mismatch)")
+        # Factory sensitivity adjustment, folded into the per-axis scale
+        self._ak_transfer(AK_CNTL1, AK_MODE_FUSE_ROM)
+        asa = [self._ak_transfer(AK_ASAX + i) for i in range(3)]
+        self._ak_transfer(AK_CNTL1, 0x00)
+        _sleep_ms(1)
+        self._ak_transfer(AK_CNTL1, AK_MODE_CONT2_16BIT)
+        # AK8963 axes are x = accel y, y = accel x, z = -accel z; store the
+        # scales in accel axis order so read_burst9 only multiplies
+        ax_, ay_, az_ = [MAG_SCALE * ((a - 128) / 256.0 + 1.0) for a in asa]
+        self._mag_asa = (ay_, ax_, -az_)
+        self.set_calibration(self.calibration)
+        # SLV0 copies HXL..ST2 into EXT_SENS_DATA_00 on every sample; reading
+        # ST2 last releases the AK8963 data latch
+        self._mpu_write(MPU_I2C_SLV0_ADDR, AK_ADDR | 0x80)
+        self._mpu_write(MPU_I2C_SLV0_REG, AK_HXL)
+        self._mpu_write(MPU_I2C_SLV0_CTRL, 0x87)  # enable, 7 bytes
+
+    def set_calibration(self, cal):
+        """
+        Apply a calibration.Calibration: gyro bias, accel offset/scale and, in
+        mag mode, the magnetometer offset/scale (in uT) if it was taken on the
+        AK8963 (CAL_MAG_AK8963); a GY-273 one is ignored. None restores plain
+        datasheet scaling. Everything is folded into per-axis gain and offset
+        tuples so a reading costs one multiply-add per axis.
+        """
+        self.calibration = cal
+        acc_k = [1.0 / self.accel_lsb] * 3
+        acc_c = [0.0] * 3
+        gyro_c = [0.0] * 3
+        mag_k = list(self._mag_asa)
+        mag_c = [0.0] * 3
+        if cal is not None:
+            if cal.flags & CAL_ACCEL:
+                for i in range(3):
+                    acc_k[i] = 1.0 / (self.accel_lsb * cal.accel_scale[i])
+                    acc_c[i] = -cal.accel_offset[i] / cal.accel_scale[i]
+            if cal.flags & CAL_GYRO:
+                gyro_c = [-b for b in cal.gyro_bias]
+            if self.mag and cal.has_mag(CAL_MAG_AK8963):
+                for i in range(3):
+                    mag_k[i] *= cal.mag_scale[i]
+                    mag_c[i] = -cal.mag_offset[i] * cal.mag_scale[i]
+        self._acc_k = tuple(acc_k)
+        self._acc_c = tuple(acc_c)
+        self._gyro_k = 1.0 / self.gyro_lsb
+        self._gyro_c = tuple(gyro_c)
+        self._mag_adj = tuple(mag_k)
+        self._mag_c = tuple(mag_c)
 
     def read_word(self, addr, reg):
         data = self.i2c.readfrom_mem(addr, reg, 2)
@@ -66,44 +606,269 @@ class IMUGY91:
         return val - 65536 if val > 32767 else val
 
     def read_accel(self):
-        ax = self.read_word(MPU_ADDR, 0x3B) / 16384.0
-        ay = self.read_word(MPU_ADDR, 0x3D) / 16384.0
-        az = self.read_word(MPU_ADDR, 0x3F) / 16384.0
-        return ax, ay, az
+        buf = self._buf6
+        self.i2c.readfrom_mem_into(MPU_ADDR, MPU_ACCEL_XOUT_H, buf)
+        ax, ay, az = struct.unpack_from('>hhh', buf)
+        k = self._acc_k
+        c = self._acc_c
+        return ax * k[0] + c[0], ay * k[1] + c[1], az * k[2] + c[2]
 
     def read_gyro(self):
-        gx = self.read_word(MPU_ADDR, 0x43) / 131.0
-        gy = self.read_word(MPU_ADDR, 0x45) / 131.0
-        gz = self.read_word(MPU_ADDR, 0x47) / 131.0
-        return gx, gy, gz
+        buf = self._buf6
+        self.i2c.readfrom_mem_into(MPU_ADDR, MPU_GYRO_XOUT_H, buf)
+        gx, gy, gz = struct.unpack_from('>hhh', buf)
+        k = self._gyro_k
+        c = self._gyro_c
+        return gx * k + c[0], gy * k + c[1], gz * k + c[2]
+
+    def read_burst(self):
+        """
+        Read accel, temperature and gyro in a single 14-byte I2C transaction.
+        Returns (ax, ay, az, gx, gy, gz, temp_c) in g, deg/s and deg C.
+        """
+        buf = self._burst
+        self.i2c.readfrom_mem_into(MPU_ADDR, MPU_ACCEL_XOUT_H, buf)
+        ax, ay, az, t, gx, gy, gz = struct.unpack_from('>7h', buf)
+        k = self._acc_k
+        c = self._acc_c
+        gk = self._gyro_k
+        gc = self._gyro_c
+        return (ax * k[0] + c[0], ay * k[1] + c[1], az * k[2] + c[2],
+                gx * gk + gc[0], gy * gk + gc[1], gz * gk + gc[2],
+                t / 333.87 + 21.0)
+
+    def read_burst9(self):
+        """
+        Read accel, temperature, gyro and the slaved AK8963 in a single 21-byte
+        transaction (mag=True only). Returns (ax, ay, az, gx, gy, gz, temp_c,
+        mx, my, mz) with the field in uT on the accel/gyro axes. If the
+        magnetometer reports an overflow the previous field is returned.
+        """
+        buf = self._burst9
+        self.i2c.readfrom_mem_into(MPU_ADDR, MPU_ACCEL_XOUT_H, buf)
+        ax, ay, az, t, gx, gy, gz = struct.unpack_from('>7h', buf)
+        self._decode_mag(buf, MPU_BURST_LEN)
+        k = self._acc_k
+        c = self._acc_c
+        gk = self._gyro_k
+        gc = self._gyro_c
+        return (ax * k[0] + c[0], ay * k[1] + c[1], az * k[2] + c[2],
+                gx * gk + gc[0], gy * gk + gc[1], gz * gk + gc[2],
+                t / 333.87 + 21.0, self.mx, self.my, self.mz)
+
+    def _decode_mag(self, buf, offset):
+        # HXL..HZH, ST2 as copied by SLV0; keep the previous field on overflow
+        if buf[offset + 6] & AK_ST2_HOFL:
+            self.mag_overflows += 1
+            return
+        adj = self._mag_adj
+        c = self._mag_c
+        self.mx = _le16(buf, offset + 2) * adj[0] + c[0]
+        self.my = _le16(buf, offset) * adj[1] + c[1]
+        self.mz = _le16(buf, offset + 4) * adj[2] + c[2]
+
+    def update_attitude(self, dt, sample=None):
+        """
+        Read the IMU once and step the attitude filter (9-DoF when mag=True).
+        With an IMUSample, accel, gyro and field are written into it and it
+        is returned; otherwise returns the tuple from read_burst or read_burst9.
+        """
+        if sample is not None:
+            buf = self._burst9 if self.mag else self._burst
+            self.i2c.readfrom_mem_into(MPU_ADDR, MPU_ACCEL_XOUT_H, buf)
+            k = self._acc_k
+            c = self._acc_c
+            gk = self._gyro_k
+            gc = self._gyro_c
+            sample.ax = ax = _be16(buf, 0) * k[0] + c[0]
+            sample.ay = ay = _be16(buf, 2) * k[1] + c[1]
+            sample.az = az = _be16(buf, 4) * k[2] + c[2]
+            gx = _be16(buf, 8) * gk + gc[0]
+            gy = _be16(buf, 10) * gk + gc[1]
+            gz = _be16(buf, 12) * gk + gc[2]
+            f = self.gyro_filter
+            if f is not None:
+                gx = f.update(0, gx)
+                gy = f.update(1, gy)
+                gz = f.update(2, gz)
+            sample.gx = gx
+            sample.gy = gy
+            sample.gz = gz
+            if self.mag:
+                self._decode_mag(buf, MPU_BURST_LEN)
+                sample.mx = self.mx
+                sample.my = self.my
+                sample.mz = self.mz
+                self.madgwick.update_marg(gx, gy, gz, ax, ay, az, self.mx, self.my, self.mz, dt)
+            else:
+                self.madgwick.update(gx, gy, gz, ax, ay, az, dt)
+            return sample
+        sample = self.read_burst9() if self.mag else self.read_burst()
+        ax, ay, az, gx, gy, gz = sample[:6]
+        f = self.gyro_filter
+        if f is not None:
+            gx = f.update(0, gx)
+            gy = f.update(1, gy)
+            gz = f.update(2, gz)
+            sample = sample[:3] + (gx, gy, gz) + sample[6:]
+        if self.mag:
+            self.madgwick.update_marg(gx, gy, gz, ax, ay, az, sample[7], sample[8], sample[9], dt)
+        else:
+            self.madgwick.update(gx, gy, gz, ax, ay, az, dt)
+        return sample
+
+    def enable_fifo(self, rate_div=None, dlpf=None):
+        """
+        Queue accel and gyro (plus the AK8963 block in mag mode) in the MPU
+        FIFO at the configured output rate. `rate_div` and `dlpf` (1-6), if
+        given, reconfigure it first, keeping the ranges and accelerometer
+        filter; see configure(). The
+        512-byte FIFO holds 42 frames (26 with the magnetometer), so drain it
+        at least that often. Buffers for a full FIFO are allocated here.
+        """
+        if rate_div is None:
+            rate_div = self.rate_div
+        if dlpf is None:
+            dlpf = self.dlpf
+        if not 1 <= dlpf <= 6:
+            raise ValueError("dlpf must be 1-6 (the 8 kHz rates fill the FIFO in 5 ms)")
+        if rate_div != self.rate_div or dlpf != self.dlpf:
+            self.configure(self.accel_range, self.gyro_range, dlpf, rate_div, self.accel_dlpf)
+        frame = MPU_FIFO_FRAME + (MPU_BURST9_LEN - MPU_BURST_LEN if self.mag else 0)
+        frames = MPU_FIFO_SIZE // frame
+        self._fifo_frame = frame
+        self._fifo_buf = bytearray(frame * frames)
+        self._fifo_mv = memoryview(self._fifo_buf)
+        self.fifo_period_us = self.sample_period_us
+        self.fifo_dt = self.fifo_period_us / 1000000
+        # Frame i of the last drain: fifo_data[6*i:6*i+6] = ax, ay, az, gx, gy, gz
+        # (g, deg/s) and fifo_t[i] = reconstructed ticks_us sample time
+        self.fifo_data = array('f', [0.0] * (6 * frames))
+        self.fifo_t = array('l', [0] * frames)
+        self.fifo_count = 0
+        self._fifo_last = None
+        self._mpu_write(MPU_FIFO_EN, 0x79 if self.mag else 0x78)  # +SLV0 in mag mode
+        self.fifo = True
+        self.fifo_reset()
+
+    def fifo_reset(self):
+        """Discard queued samples and restart the timestamp reconstruction."""
+        ctrl = MPU_USER_FIFO_EN | (MPU_USER_I2C_MST_EN if self.mag else 0)
+        self._mpu_write(MPU_USER_CTRL, ctrl | MPU_USER_FIFO_RST)
+        self._fifo_last = None
+
+    def read_fifo(self, now=None):
+        """
+        Drain all complete frames from the FIFO in one transfer into fifo_data
+        and fifo_t. Returns the number of frames. Timestamps continue the
+        previous drain at the nominal sample period and are re-anchored to
+        `now` (ticks_us, default the current time) when they drift more than
+        one period from it. A FIFO that filled up is read and then reset,
+        counting an overflow.
+        """
+        buf2 = self._buf2
+        self.i2c.readfrom_mem_into(MPU_ADDR, MPU_FIFO_COUNTH, buf2)
+        count = ((buf2[0] & 0x1F) << 8) | buf2[1]
+        frame = self._fifo_frame
+        n = count // frame
+        if n > len(self.fifo_t):
+            n = len(self.fifo_t)
+        if n:
+            self.i2c.readfrom_mem_into(MPU_ADDR, MPU_FIFO_R_W, self._fifo_mv[:n * frame])
+        overflow = count > MPU_FIFO_SIZE - frame
+        if overflow:
+            # Samples were lost, so the next drain starts a new time base
+            self.fifo_overflows += 1
+            self.fifo_reset()
+        if now is None:
+            now = (self.clock or _ticks_us)()
+        period = self.fifo_period_us
+        last = self._fifo_last
+        if last is None or abs(_ticks_diff(_ticks_add(last, n * period), now)) > period:
+            last = _ticks_add(now, -n * period)
+        buf = self._fifo_buf
+        data = self.fifo_data
+        ts = self.fifo_t
+        k = self._acc_k
+        c = self._acc_c
+        gk = self._gyro_k
+        gc = self._gyro_c
+        for i in range(n):
+            ax, ay, az, gx, gy, gz = struct.unpack_from('>6h', buf, i * frame)
+            j = 6 * i
+            data[j] = ax * k[0] + c[0]
+            data[j + 1] = ay * k[1] + c[1]
+            data[j + 2] = az * k[2] + c[2]
+            data[j + 3] = gx * gk + gc[0]
+            data[j + 4] = gy * gk + gc[1]
+            data[j + 5] = gz * gk + gc[2]
+            last = _ticks_add(last, period)
+            ts[i] = last
+        if n and self.mag:
+            self._decode_mag(buf, (n - 1) * frame + MPU_FIFO_FRAME)
+        self._fifo_last = None if overflow else last
+        self.fifo_count = n
+        return n
+
+    def update_attitude_fifo(self, now=None):
+        """
+        Drain the FIFO and step the attitude filter once per queued sample with
+        the sensor's own sample period. Returns the number of samples used.
+        With a gyro_filter the rates in fifo_data are filtered in place first.
+        In mag mode the newest magnetometer reading is used for the whole batch.
+        """
+        n = self.read_fifo(now)
+        data = self.fifo_data
+        if self.gyro_filter is not None:
+            self.gyro_filter.process(data, n)
+        dt = self.fifo_dt
+        f = self.madgwick
+        if self.mag:
+            mx, my, mz = self.mx, self.my, self.mz
+            for j in range(0, 6 * n, 6):
+                f.update_marg(data[j + 3], data[j + 4], data[j + 5],
+                              data[j], data[j + 1], data[j + 2], mx, my, mz, dt)
+        else:
+            for j in range(0, 6 * n, 6):
+                f.update(data[j + 3], data[j + 4], data[j + 5],
+                         data[j], data[j + 1], data[j + 2], dt)
+        return n
 
     def read_bmp280(self):
-        data = self.i2c.readfrom_mem(BMP_ADDR, BMP_TEMP_MSB, 3)
-        temp_raw = ((data[0] << 16) | (data[1] << 8) | data[2]) >> 4
-        data = self.i2c.readfrom_mem(BMP_ADDR, BMP_PRESS_MSB, 3)
-        press_raw = ((data[0] << 16) | (data[1] << 8) | data[2]) >> 4
-        temperature = temp_raw / 5120.0
-        pressure = press_raw / 256.0
-        return temperature, pressure
+        """Synchronous compensated barometer reading: (temp_c, press_pa). See BMP280.poll()."""
+        return self.bmp.read()
 
     def pressure_to_altitude(self, pressure_pa, sea_level_pa=101325.0):
-        return 44330.0 * (1.0 - (pressure_pa / sea_level_pa) ** 0.1903)
+        """Exact barometric formula (one float pow), metres above sea_level_pa; reference only."""
+        return exact_altitude(pressure_pa, sea_level_pa)
 
     def get_orientation(self, dt):
-        ax, ay, az = self.read_accel()
-        gx, gy, gz = self.read_gyro()
-        self.madgwick.update(gx, gy, gz, ax, ay, az, dt)
+        self.update_attitude(dt)
         return self.madgwick.get_euler()
 
-    def read_all(self, dt):
-        ax, ay, az = self.read_accel()
-        gx, gy, gz = self.read_gyro()
-        temp, press = self.read_bmp280()
-        alt = self.pressure_to_altitude(press)
-        pitch, roll = self.get_orientation(dt)
-        return {
-            'ax': ax, 'ay': ay, 'az': az,
-            'gx': gx, 'gy': gy, 'gz': gz,
-            'temp': temp, 'press': press, 'alt': alt,
-            'pitch': pitch, 'roll': roll
-        }
+    def read_all(self, dt, sample=None):
+        """
+        One IMU burst feeds the attitude filter; the barometer is only read
+        when a new conversion has finished, and alt is the height above the
+        first good reading, interpolated in baro_alt (no float pow per
+        conversion; see bmp280.AltitudeLUT). With an IMUSample the results are
+        written into it (accel, gyro, field, temp, press, alt, pitch, roll,
+        yaw) and it is returned without allocating. Without one a new dict is
+        returned, as before.
+        """
+        out = sample if sample is not None else IMUSample()
+        self.update_attitude(dt, out)
+        bmp = self.bmp
+        if bmp.poll() and bmp.pressure > 0:
+            lut = self.baro_alt
+            if lut.ground is None:
+                lut.set_ground(bmp.pressure)
+            self._alt = lut.altitude(bmp.pressure)
+        out.temp = bmp.temperature
+        out.press = bmp.pressure
+        out.alt = self._alt
+        self.madgwick.euler_into(out)
+        if sample is not None:
+            return sample
+        keys = READ_ALL_KEYS_MAG if self.mag else READ_ALL_KEYS
+        return {name: getattr(out, name) for name in keys}
@@ -0,0 +1,102 @@
+# instrumentation.py
+"""
+Lightweight loop timing and jitter instrumentation for the Pico Drone flight loop.
+
+LoopStats keeps one TaskStats per scheduler rate group: execution time, start
+latency against the deadline, period jitter, overruns and missed ticks, plus
+fixed-size power-of-two histograms. Nothing is allocated per sample. Pass a
+LoopStats to Scheduler(stats=...) to enable it; with stats=None (or
+enabled=False) the scheduler does a single attribute check per task.
+Uses time.ticks_us on MicroPython and perf_counter_ns on CPython.
+"""
+from array import array
+from scheduler import ticks_diff
+
+HIST_BINS = 16  # bin k counts values in [2**(k-1), 2**k) us; the last bin is open-ended
+
+
+def _bucket(us):
+    b = 0
+    while us > 0 and b < HIST_BINS - 1:
+        us >>= 1
+        b += 1
+    return b
+
+
+class TaskStats:
+    """Timing statistics for one periodic task, all in microseconds."""
+    __slots__ = ('name', 'period_us', 'count', 'exec_total', 'exec_max', 'late_max',
+                 'jitter_max', 'overruns', 'missed', 'exec_hist', 'jitter_hist', '_last_start')
+
+    def __init__(self, name, period_us):
+        self.name = name
+        self.period_us = period_us
+        self.exec_hist = array('L', [0] * HIST_BINS)
+        self.jitter_hist = array('L', [0] * HIST_BINS)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.exec_total = 0
+        self.exec_max = 0
+        self.late_max = 0
+        self.jitter_max = 0
+        self.overruns = 0
+        self.missed = 0
+        self._last_start = None
+        for i in range(HIST_BINS):
+            self.exec_hist[i] = 0
+            self.jitter_hist[i] = 0
+
+    def record(self, start, late_us, exec_us, missed=0):
+        """Record one run that started `late_us` after its deadline and took `exec_us`."""
+        self.count += 1
+        self.exec_total += exec_us
+        if exec_us > self.exec_max:
+            self.exec_max = exec_us
+        if late_us > self.late_max:
+            self.late_max = late_us
+        self.exec_hist[_bucket(exec_us)] += 1
+        if self._last_start is not None:
+            jitter = ticks_diff(start, self._last_start) - self.period_us
+            if jitter < 0:
+                jitter = -jitter
+            if jitter > self.jitter_max:
+                self.jitter_max = jitter
+            self.jitter_hist[_bucket(jitter)] += 1
+        self._last_start = start
+        if missed or exec_us > self.period_us:
+            self.overruns += 1
+        self.missed += missed
+
+    def exec_avg(self):
+        return self.exec_total / self.count if self.count else 0.0
+
+
+class LoopStats:
+    """Collection of TaskStats keyed by task name. Timestamps come from the Scheduler's clock."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.tasks = {}
+
+    def task(self, name, period_us):
+        st = self.tasks.get(name)
+        if st is None:
+            st = TaskStats(name, period_us)
+            self.tasks[name] = st
+        return st
+
+    def reset(self):
+        for st in self.tasks.values():
+            st.reset()
+
+    def dump(self, out=print):
+        """Write a human-readable report, one line per task plus histograms."""
+        out("task,n,exec_avg_us,exec_max_us,late_max_us,jitter_max_us,overruns,missed")
+        for st in self.tasks.values():
+            out(f"{st.name},{st.count},{st.exec_avg():.1f},{st.exec_max},{st.late_max},"
+                f"{st.jitter_max},{st.overruns},{st.missed}")
+        for st in self.tasks.values():
+            out(f"{st.name} exec_hist " + " ".join(str(n) for n in st.exec_hist))
+            out(f"{st.name} jitter_hist " + " ".join(str(n) for n in st.jitter_hist))
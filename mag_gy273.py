@@ -7,12 +7,44 @@ try:
     from machine import I2C
 except ImportError:
     from mock_machine import I2C
+import math
+import struct
+import fastmath
 
 MAG_ADDR = 0x0D  # QMC5883L default address
+MAG_DATA = 0x00
+MAG_STATUS = 0x06
+MAG_STATUS_DRDY = 0x01  # new data since the last data read
+MAG_STATUS_OVL = 0x02   # an axis exceeded the selected range
+MAG_STATUS_DOR = 0x04   # a sample was skipped because the loop did not read it
 
 class MagnetometerGY273:
-    def __init__(self, i2c):
+    """
+    QMC5883L driver. update() reads the 1-byte status register and only
+    transfers the 6 data bytes when DRDY is set, so polling faster than the
+    200 Hz output rate costs one short transaction and repeats nothing. The
+    latest good sample is kept in x, y, z; `stale` is True when the last
+    read_raw() returned it again (no new data, or the new data overflowed).
+
+    tilt_heading() levels the field with the attitude filter's roll and
+    pitch; the GY-273 must be mounted with its axes along the IMU's (x
+    forward, y left, z up). `declination` (degrees, east positive) turns
+    magnetic into true heading there. With fast_math both headings use
+    fastmath.atan2_deg (within 0.001 deg) instead of math.atan2.
+    """
+    def __init__(self, i2c, declination=0.0, fast_math=False):
         self.i2c = i2c
+        self.declination = declination
+        self.fast_math = fast_math
+        self._buf = bytearray(6)
+        self._status = bytearray(1)
+        self.x = self.y = self.z = 0
+        self.stale = True
+        self.overflows = 0  # samples dropped because OVL was set
+        self.overruns = 0   # reads that found DOR: samples were missed
+        # Correction m = K @ raw + c, K row-major; identity until calibrated
+        self._k = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+        self._c = (0.0, 0.0, 0.0)
         self._init_sensor()
 
     def _init_sensor(self):
@@ -21,27 +53,83 @@ class MagnetometerGY273:
         # 0b00011101 = 0x1D: OSR=512, RNG=8G, ODR=200Hz, MODE=Continuous
         self.i2c.writeto_mem(MAG_ADDR, 0x09, bytearray([0x1D]))  # Use bytearray for MicroPython compatibility
 
+    def update(self):
+        """Fetch a new sample if one is ready. Returns True if x, y, z changed."""
+        self.i2c.readfrom_mem_into(MAG_ADDR, MAG_STATUS, self._status)
+        status = self._status[0]
+        if not status & MAG_STATUS_DRDY:
+            self.stale = True
+            return False
+        # Reading the data clears DRDY and DOR, also when it is discarded
+        self.i2c.readfrom_mem_into(MAG_ADDR, MAG_DATA, self._buf)
+        if status & MAG_STATUS_DOR:
+            self.overruns += 1
+        if status & MAG_STATUS_OVL:
+            self.overflows += 1
+            self.stale = True
+            return False
+        self.x, self.y, self.z = struct.unpack_from('<hhh', self._buf)
+        self.stale = False
+        return True
+
     def read_raw(self):
-        data = self.i2c.readfrom_mem(MAG_ADDR, 0x00, 6)  # All positional args
-        x = int.from_bytes(data[0:2], 'little')
-        if x >= 32768:
-            x -= 65536
-        y = int.from_bytes(data[2:4], 'little')
-        if y >= 32768:
-            y -= 65536
-        z = int.from_bytes(data[4:6], 'little')
-        if z >= 32768:
-            z -= 65536
-        return x, y, z
+        """Latest raw (x, y, z); see `stale` for whether it is new."""
+        self.update()
+        return self.x, self.y, self.z
+
+    def set_calibration(self, offset, scale):
+        """Hard-iron offset and per-axis scale, e.g. from calibration.calibrate_mag()."""
+        self.set_ellipsoid(offset, ((scale[0], 0.0, 0.0), (0.0, scale[1], 0.0),
+                                    (0.0, 0.0, scale[2])))
+
+    def set_ellipsoid(self, offset, matrix):
+        """
+        Hard-iron offset and 3x3 soft-iron matrix (rows), e.g. from
+        calibration.load_mag(): corrected = matrix @ (raw - offset). The offset
+        is folded into a constant here so a reading is 9 multiply-adds.
+        """
+        self._k = tuple(v for row in matrix for v in row)
+        self._c = tuple(-sum(row[j] * offset[j] for j in range(3)) for row in matrix)
+
+    def _apply(self, x, y, z):
+        k = self._k
+        c = self._c
+        return (k[0] * x + k[1] * y + k[2] * z + c[0],
+                k[3] * x + k[4] * y + k[5] * z + c[1],
+                k[6] * x + k[7] * y + k[8] * z + c[2])
+
+    def calibrated(self):
+        """Corrected field of the latest sample, without touching the bus."""
+        return self._apply(self.x, self.y, self.z)
+
+    def read_calibrated(self):
+        return self._apply(*self.read_raw())
 
     def calculate_heading(self, x, y):
-        import math
-        heading = math.atan2(y, x)
-        heading = math.degrees(heading)
+        if self.fast_math:
+            heading = fastmath.atan2_deg(y, x)
+        else:
+            heading = math.degrees(math.atan2(y, x))
         if heading < 0:
             heading += 360
         return heading
 
+    def tilt_heading(self, att):
+        """
+        Tilt-compensated true heading in degrees (0-360, clockwise from north)
+        of the latest sample. `att` supplies sin_roll, cos_roll, sin_pitch and
+        cos_pitch, e.g. imu_gy91.Madgwick after euler_into() or update_tilt().
+        """
+        mx, my, mz = self._apply(self.x, self.y, self.z)
+        sr = att.sin_roll
+        cr = att.cos_roll
+        # Undo roll, then pitch: the horizontal components of the field
+        hx = mx * att.cos_pitch + (my * sr + mz * cr) * att.sin_pitch
+        hy = my * cr - mz * sr
+        if self.fast_math:
+            return (fastmath.atan2_deg(hy, hx) + self.declination) % 360.0
+        return (math.degrees(math.atan2(hy, hx)) + self.declination) % 360.0
+
     def read_heading(self):
-        x, y, z = self.read_raw()
+        x, y, z = self.read_calibrated()
         return self.calculate_heading(x, y)
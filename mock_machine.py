@@ -1,24 +1,806 @@
 # mock_machine.py
 """
 Mock machine module for testing MicroPython code on standard Python.
-Provides dummy I2C, Pin, and UART classes.
+Provides dummy I2C, Pin, PWM and UART classes. Pin and PWM remember their
+level/duty so simulators can read motor commands back.
+
+I2C can also host simulated devices with real register maps so the drivers
+see realistic data off-hardware:
+
+    clock = SimClock()
+    i2c = sim_i2c(Trajectory(roll_amp=0.3, freq=0.5), clock)
+    imu = IMUGY91(i2c)
+    clock.advance(0.002)
+
+SimMPU9250 (0x68), SimBMP280 (0x76) and SimQMC5883L (0x0D) follow the
+datasheet registers, scale settings, data-ready flags and conversion timing,
+and add configurable noise. All three read their true motion from a
+`source` object with a state(t) method returning a MotionState.
+
+Frames: earth is x = magnetic north, y = west, z = up. The body attitude is
+yaw about z, then pitch about y, then roll about x, so a level board reads
++1 g on accel z (MPU convention). Yaw is counter-clockwise seen from above,
+so a level magnetometer heading (clockwise from north) is -yaw.
 """
+import math
+import random
+import time
+
+
 class I2C:
     def __init__(self, *args, **kwargs):
-        pass
-    def writeto_mem(self, *args, **kwargs):
-        pass
-    def readfrom_mem(self, *args, **kwargs):
-        return bytes([0, 0])
+        self.devices = {}
+    def attach(self, device):
+        """Attach a simulated device at its address."""
+        self.devices[device.addr] = device
+        return device
+    def scan(self):
+        return sorted(self.devices)
+    def writeto_mem(self, addr, reg, buf, **kwargs):
+        dev = self.devices.get(addr)
+        if dev is not None:
+            dev.write(reg, buf)
+    def readfrom_mem(self, addr, reg, nbytes, **kwargs):
+        dev = self.devices.get(addr)
+        if dev is None:
+            return bytes(nbytes)
+        return dev.read(reg, nbytes)
+    def readfrom_mem_into(self, addr, reg, buf):
+        data = self.readfrom_mem(addr, reg, len(buf))
+        for i in range(len(buf)):
+            buf[i] = data[i]
 
 class Pin:
-    def __init__(self, *args, **kwargs):
-        pass
+    IN = 0
+    OUT = 1
+    def __init__(self, id=None, mode=-1, *args, **kwargs):
+        self.id = id
+        self._value = 0
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = 1 if v else 0
+    def high(self):
+        self._value = 1
+    def low(self):
+        self._value = 0
+    on = high
+    off = low
+
+class PWM:
+    def __init__(self, pin, freq=1000, duty_u16=0, **kwargs):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty_u16
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        self._freq = f
+    def duty_u16(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
+    def deinit(self):
+        self._duty = 0
 
 class UART:
-    def __init__(self, *args, **kwargs):
-        pass
+    """Silent receiver; everything written is kept in `written`."""
+    def __init__(self, *args, baudrate=9600, **kwargs):
+        self.baudrate = baudrate
+        self.written = bytearray()
+    def init(self, baudrate=9600, **kwargs):
+        self.baudrate = baudrate
     def any(self):
         return False
     def read(self, n):
         return b''
+    def readinto(self, buf, nbytes=None):
+        return None
+    def write(self, buf):
+        self.written += buf
+        return len(buf)
+    def flush(self):
+        pass
+
+
+# ---------------- Simulation support -----------------
+
+class SimClock:
+    """Manually advanced simulation time in seconds; pass as a device clock."""
+    def __init__(self, t=0.0):
+        self.t = t
+    def __call__(self):
+        return self.t
+    def advance(self, dt):
+        self.t += dt
+        return self.t
+
+
+class MotionState:
+    """True motion at one instant: attitude (rad), body rates (rad/s),
+    specific force in body axes (g), altitude (m) and temperature (C)."""
+    __slots__ = ('roll', 'pitch', 'yaw', 'p', 'q', 'r', 'ax', 'ay', 'az', 'alt', 'temp')
+
+    def __init__(self):
+        self.roll = self.pitch = self.yaw = 0.0
+        self.p = self.q = self.r = 0.0
+        self.ax = self.ay = 0.0
+        self.az = 1.0
+        self.alt = 0.0
+        self.temp = 25.0
+
+
+def earth_to_body(roll, pitch, yaw, vx, vy, vz):
+    """Rotate an earth-frame vector into body axes (R^T v for R = Rz Ry Rx)."""
+    sr, cr = math.sin(roll), math.cos(roll)
+    sp, cp = math.sin(pitch), math.cos(pitch)
+    sy, cy = math.sin(yaw), math.cos(yaw)
+    bx = cy * cp * vx + sy * cp * vy - sp * vz
+    by = (cy * sp * sr - sy * cr) * vx + (sy * sp * sr + cy * cr) * vy + cp * sr * vz
+    bz = (cy * sp * cr + sy * sr) * vx + (sy * sp * cr - cy * sr) * vy + cp * cr * vz
+    return bx, by, bz
+
+
+class Trajectory:
+    """
+    Configurable motion source: sinusoidal roll/pitch, constant yaw rate and
+    climb rate. Subclass and override state() for anything else.
+    """
+
+    def __init__(self, roll_amp=0.0, pitch_amp=0.0, freq=0.5, yaw=0.0, yaw_rate=0.0,
+                 alt=0.0, climb_rate=0.0, temp=25.0):
+        self.roll_amp = roll_amp
+        self.pitch_amp = pitch_amp
+        self.freq = freq
+        self.yaw = yaw
+        self.yaw_rate = yaw_rate
+        self.alt = alt
+        self.climb_rate = climb_rate
+        self.temp = temp
+        self._state = MotionState()
+
+    def state(self, t):
+        s = self._state
+        w = 2 * math.pi * self.freq
+        roll = self.roll_amp * math.sin(w * t)
+        pitch = self.pitch_amp * math.sin(w * t)
+        droll = self.roll_amp * w * math.cos(w * t)
+        dpitch = self.pitch_amp * w * math.cos(w * t)
+        dyaw = self.yaw_rate
+        s.roll = roll
+        s.pitch = pitch
+        s.yaw = self.yaw + dyaw * t
+        # Euler angle rates -> body rates
+        s.p = droll - dyaw * math.sin(pitch)
+        s.q = dpitch * math.cos(roll) + dyaw * math.sin(roll) * math.cos(pitch)
+        s.r = -dpitch * math.sin(roll) + dyaw * math.cos(roll) * math.cos(pitch)
+        s.ax, s.ay, s.az = earth_to_body(roll, pitch, s.yaw, 0.0, 0.0, 1.0)
+        s.alt = self.alt + self.climb_rate * t
+        s.temp = self.temp
+        return s
+
+
+class SimDevice:
+    """Byte register file with auto-incrementing burst access."""
+
+    def __init__(self, addr, source=None, clock=None, seed=0):
+        self.addr = addr
+        self.source = source or Trajectory()
+        self.clock = clock or time.perf_counter
+        self.rng = random.Random(seed)
+        self.regs = bytearray(256)
+        self.reset()
+
+    def reset(self):
+        for i in range(256):
+            self.regs[i] = 0
+
+    def sync(self, t):
+        """Bring data registers up to time t. Overridden by each model."""
+
+    def on_read(self, reg, n):
+        """Side effects of reading (flag clearing)."""
+
+    def on_write(self, reg, value, t):
+        self.regs[reg] = value
+
+    def read(self, reg, n):
+        self.sync(self.clock())
+        data = bytes(self.regs[(reg + i) & 0xFF] for i in range(n))
+        self.on_read(reg, n)
+        return data
+
+    def write(self, reg, buf):
+        t = self.clock()
+        self.sync(t)
+        for i, b in enumerate(buf):
+            self.on_write((reg + i) & 0xFF, b, t)
+
+    def _put16_be(self, reg, val):
+        val = max(-32768, min(32767, int(round(val))))
+        self.regs[reg] = (val >> 8) & 0xFF
+        self.regs[reg + 1] = val & 0xFF
+
+    def _put16_le(self, reg, val):
+        self.regs[reg] = val & 0xFF
+        self.regs[reg + 1] = (val >> 8) & 0xFF
+
+
+MPU9250_ADDR = 0x68
+AK8963_ADDR = 0x0C
+BMP280_ADDR = 0x76
+QMC5883L_ADDR = 0x0D
+
+_ACCEL_LSB = (16384.0, 8192.0, 4096.0, 2048.0)
+_GYRO_LSB = (131.0, 65.5, 32.8, 16.4)
+
+
+class SimMPU9250(SimDevice):
+    """
+    MPU-9250 accel/gyro/temperature. Honours SMPLRT_DIV, DLPF_CFG (1 kHz
+    internal rate when enabled, 8 kHz otherwise), GYRO/ACCEL_CONFIG full
+    scale, PWR_MGMT_1 sleep/reset, and sets INT_STATUS RAW_DATA_RDY (cleared
+    on read) for each new sample.
+
+    With an `aux` device (the AK8963 inside the package) the auxiliary I2C
+    master is modelled too: when USER_CTRL.I2C_MST_EN is set, SLV0 runs once
+    per sample (reads land in EXT_SENS_DATA_00..) and a SLV4 transfer runs
+    once when I2C_SLV4_CTRL.EN is written, setting I2C_MST_STATUS.SLV4_DONE.
+    SLV1-3 are not modelled.
+
+    The 512-byte FIFO stores the sources selected in FIFO_EN (accel, temp,
+    gyro, SLV0) in register order for every sample while USER_CTRL.FIFO_EN is
+    set. CONFIG.FIFO_MODE chooses between overwriting the oldest bytes and
+    dropping new ones when full; either sets INT_STATUS.FIFO_OFLOW.
+    FIFO_COUNTH/L track the fill level and FIFO_R_W pops without
+    auto-incrementing.
+    """
+    SMPLRT_DIV = 0x19
+    CONFIG = 0x1A
+    GYRO_CONFIG = 0x1B
+    ACCEL_CONFIG = 0x1C
+    FIFO_EN = 0x23
+    I2C_MST_CTRL = 0x24
+    I2C_SLV0_ADDR = 0x25
+    I2C_SLV0_REG = 0x26
+    I2C_SLV0_CTRL = 0x27
+    I2C_SLV4_ADDR = 0x31
+    I2C_SLV4_REG = 0x32
+    I2C_SLV4_DO = 0x33
+    I2C_SLV4_CTRL = 0x34
+    I2C_SLV4_DI = 0x35
+    I2C_MST_STATUS = 0x36
+    INT_STATUS = 0x3A
+    ACCEL_XOUT_H = 0x3B
+    TEMP_OUT_H = 0x41
+    GYRO_XOUT_H = 0x43
+    EXT_SENS_DATA_00 = 0x49
+    I2C_SLV0_DO = 0x63
+    USER_CTRL = 0x6A
+    PWR_MGMT_1 = 0x6B
+    FIFO_COUNTH = 0x72
+    FIFO_R_W = 0x74
+    WHO_AM_I = 0x75
+    FIFO_SIZE = 512
+
+    def __init__(self, source=None, clock=None, seed=0, addr=MPU9250_ADDR,
+                 accel_noise=0.003, gyro_noise=0.05, gyro_bias=(0.0, 0.0, 0.0),
+                 accel_bias=(0.0, 0.0, 0.0), aux=None):
+        self.aux = aux                  # device behind the auxiliary I2C master
+        self.accel_noise = accel_noise  # g RMS
+        self.gyro_noise = gyro_noise    # deg/s RMS
+        self.gyro_bias = gyro_bias      # deg/s
+        self.accel_bias = accel_bias    # g
+        self.samples = 0
+        self.fifo = bytearray()
+        super().__init__(addr, source, clock, seed)
+
+    def reset(self):
+        super().reset()
+        self.regs[self.PWR_MGMT_1] = 0x01
+        self.regs[self.WHO_AM_I] = 0x71
+        self._t0 = self.clock()
+        self._index = -1
+        self.fifo = bytearray()
+
+    def sample_rate(self):
+        dlpf = self.regs[self.CONFIG] & 0x07
+        internal = 1000.0 if 1 <= dlpf <= 6 else 8000.0
+        return internal / (1 + self.regs[self.SMPLRT_DIV])
+
+    def on_write(self, reg, value, t):
+        if reg == self.PWR_MGMT_1 and value & 0x80:
+            self.reset()
+            return
+        self.regs[reg] = value
+        if reg in (self.SMPLRT_DIV, self.CONFIG, self.PWR_MGMT_1):
+            # Restart the sample clock on rate or power changes
+            self._t0 = t
+            self._index = -1
+        elif reg == self.USER_CTRL and value & 0x04:  # FIFO_RST, self-clearing
+            self.fifo = bytearray()
+            self._set_fifo_count()
+            self.regs[reg] = value & ~0x04
+        elif reg == self.I2C_SLV4_CTRL and value & 0x80 and self.regs[self.USER_CTRL] & 0x20:
+            data = self._aux_transfer(self.regs[self.I2C_SLV4_ADDR], self.regs[self.I2C_SLV4_REG],
+                                      self.regs[self.I2C_SLV4_DO], 1)
+            if data is None:
+                self.regs[self.I2C_MST_STATUS] |= 0x10  # SLV4_NACK
+            elif data:
+                self.regs[self.I2C_SLV4_DI] = data[0]
+            self.regs[self.I2C_MST_STATUS] |= 0x40  # SLV4_DONE
+            self.regs[reg] = value & 0x7F
+
+    def _aux_transfer(self, addr, reg, do, n):
+        """One auxiliary bus transaction. Returns the bytes read, b'' for a write, None on NACK."""
+        aux = self.aux
+        if aux is None or addr & 0x7F != aux.addr:
+            return None
+        if addr & 0x80:
+            return aux.read(reg, n)
+        aux.write(reg, bytes((do,)))
+        return b''
+
+    def sync(self, t):
+        if self.regs[self.PWR_MGMT_1] & 0x40:  # SLEEP
+            return
+        rate = self.sample_rate()
+        index = int((t - self._t0) * rate)
+        if index <= self._index:
+            return
+        first = index
+        if self.regs[self.USER_CTRL] & 0x40:
+            # Every sample lands in the FIFO, but no more than it could hold
+            first = max(self._index + 1, index - self.FIFO_SIZE)
+        self._index = index
+        for i in range(first, index + 1):
+            self._sample(self._t0 + i / rate)
+
+    def _sample(self, t):
+        self.samples += 1
+        self._generate(t)
+        self.regs[self.INT_STATUS] |= 0x01
+        ctrl = self.regs[self.I2C_SLV0_CTRL]
+        if self.regs[self.USER_CTRL] & 0x20 and ctrl & 0x80:
+            data = self._aux_transfer(self.regs[self.I2C_SLV0_ADDR], self.regs[self.I2C_SLV0_REG],
+                                      self.regs[self.I2C_SLV0_DO], ctrl & 0x0F)
+            if data is None:
+                self.regs[self.I2C_MST_STATUS] |= 0x01  # SLV0_NACK
+            for i, b in enumerate(data or b''):
+                self.regs[self.EXT_SENS_DATA_00 + i] = b
+        if self.regs[self.USER_CTRL] & 0x40:
+            self._fifo_push()
+
+    def _fifo_push(self):
+        en = self.regs[self.FIFO_EN]
+        regs = self.regs
+        frame = bytearray()
+        if en & 0x08:
+            frame += regs[self.ACCEL_XOUT_H:self.ACCEL_XOUT_H + 6]
+        if en & 0x80:
+            frame += regs[self.TEMP_OUT_H:self.TEMP_OUT_H + 2]
+        for bit, i in ((0x40, 0), (0x20, 2), (0x10, 4)):
+            if en & bit:
+                frame += regs[self.GYRO_XOUT_H + i:self.GYRO_XOUT_H + i + 2]
+        if en & 0x01:
+            n = regs[self.I2C_SLV0_CTRL] & 0x0F
+            frame += regs[self.EXT_SENS_DATA_00:self.EXT_SENS_DATA_00 + n]
+        fifo = self.fifo
+        room = self.FIFO_SIZE - len(fifo)
+        if len(frame) > room:
+            self.regs[self.INT_STATUS] |= 0x10  # FIFO_OFLOW
+            if self.regs[self.CONFIG] & 0x40:
+                frame = frame[:room]  # FIFO_MODE=1: further writes are lost
+            else:
+                del fifo[:len(frame) - room]
+        fifo += frame
+        self._set_fifo_count()
+
+    def _set_fifo_count(self):
+        n = len(self.fifo)
+        self.regs[self.FIFO_COUNTH] = n >> 8
+        self.regs[self.FIFO_COUNTH + 1] = n & 0xFF
+
+    def read(self, reg, n):
+        if reg != self.FIFO_R_W:
+            return super().read(reg, n)
+        self.sync(self.clock())
+        data = bytes(self.fifo[:n]) + bytes(max(0, n - len(self.fifo)))
+        del self.fifo[:n]
+        self._set_fifo_count()
+        return data
+
+    def _generate(self, t):
+        s = self.source.state(t)
+        rng = self.rng
+        a_lsb = _ACCEL_LSB[(self.regs[self.ACCEL_CONFIG] >> 3) & 0x03]
+        g_lsb = _GYRO_LSB[(self.regs[self.GYRO_CONFIG] >> 3) & 0x03]
+        accel = (s.ax, s.ay, s.az)
+        rates = (s.p, s.q, s.r)
+        for i in range(3):
+            a = accel[i] + self.accel_bias[i] + rng.gauss(0.0, self.accel_noise)
+            self._put16_be(self.ACCEL_XOUT_H + 2 * i, a * a_lsb)
+            g = math.degrees(rates[i]) + self.gyro_bias[i] + rng.gauss(0.0, self.gyro_noise)
+            self._put16_be(self.GYRO_XOUT_H + 2 * i, g * g_lsb)
+        self._put16_be(self.TEMP_OUT_H, (s.temp - 21.0) * 333.87)
+
+    def on_read(self, reg, n):
+        if reg <= self.INT_STATUS < reg + n:
+            self.regs[self.INT_STATUS] &= ~0x11
+        if reg <= self.I2C_MST_STATUS < reg + n:
+            self.regs[self.I2C_MST_STATUS] = 0
+
+
+class SimAK8963(SimDevice):
+    """
+    AK8963 magnetometer as bonded inside the MPU-9250. CNTL1 selects the mode
+    (power-down, single, 8 Hz / 100 Hz continuous, fuse ROM) and 14/16-bit
+    output, CNTL2 soft reset, ST1 DRDY/DOR, little-endian data at 0x03 and ST2
+    HOFL/BITM at 0x09. Reading ST2 ends a read and clears DRDY and DOR. ASA
+    sensitivity adjustment bytes are at 0x10. The field uses the same earth
+    frame and hard/soft iron model as SimQMC5883L; the sensor axes are the
+    AK8963's own (x = accel y, y = accel x, z = -accel z).
+    """
+    WIA = 0x00
+    ST1 = 0x02
+    HXL = 0x03
+    ST2 = 0x09
+    CNTL1 = 0x0A
+    CNTL2 = 0x0B
+    ASAX = 0x10
+    _RATES = {0x02: 8.0, 0x06: 100.0}
+    _UT_PER_LSB = (0.6, 0.15)  # 14-bit, 16-bit
+    _FULL_SCALE_UT = 4912.0
+
+    def __init__(self, source=None, clock=None, seed=0, addr=AK8963_ADDR,
+                 field=(0.2, 0.0, -0.45), hard_iron=(0.0, 0.0, 0.0), soft_iron=None,
+                 noise=0.002, asa=(176, 177, 165)):
+        self.field = field            # earth-frame field in gauss
+        self.hard_iron = hard_iron    # gauss, body axes
+        self.soft_iron = soft_iron
+        self.noise = noise            # gauss RMS
+        self.asa = asa
+        self.samples = 0
+        super().__init__(addr, source, clock, seed)
+
+    def reset(self):
+        super().reset()
+        self.regs[self.WIA] = 0x48
+        self.regs[self.ASAX:self.ASAX + 3] = bytes(self.asa)
+        self._t0 = self.clock()
+        self._index = -1
+
+    def on_write(self, reg, value, t):
+        if reg == self.CNTL2 and value & 0x01:
+            self.reset()
+            return
+        self.regs[reg] = value
+        if reg == self.CNTL1:
+            self._t0 = t
+            self._index = -1
+            if value & 0x0F == 0x01:  # single measurement
+                self._sample(t)
+
+    def sync(self, t):
+        rate = self._RATES.get(self.regs[self.CNTL1] & 0x0F)
+        if rate is None:
+            return
+        index = int((t - self._t0) * rate)
+        if index <= self._index:
+            return
+        if self.regs[self.ST1] & 0x01 or index > self._index + 1:
+            self.regs[self.ST1] |= 0x02  # DOR
+        self._index = index
+        self._sample(self._t0 + index / rate)
+
+    def _sample(self, t):
+        self.samples += 1
+        s = self.source.state(t)
+        bx, by, bz = earth_to_body(s.roll, s.pitch, s.yaw, *self.field)
+        m = [bx + self.hard_iron[0], by + self.hard_iron[1], bz + self.hard_iron[2]]
+        if self.soft_iron is not None:
+            si = self.soft_iron
+            m = [si[i][0] * m[0] + si[i][1] * m[1] + si[i][2] * m[2] for i in range(3)]
+        bit16 = (self.regs[self.CNTL1] >> 4) & 0x01
+        lsb = self._UT_PER_LSB[bit16]
+        limit = int(self._FULL_SCALE_UT / lsb)
+        st2 = bit16 << 4
+        for i, axis in enumerate((1, 0, 2)):
+            ut = (m[axis] + self.rng.gauss(0.0, self.noise)) * 100.0
+            if i == 2:
+                ut = -ut
+            adj = (self.asa[i] - 128) / 256.0 + 1.0
+            raw = int(round(ut / (lsb * adj)))
+            if raw > limit or raw < -limit:
+                st2 |= 0x08  # HOFL
+                raw = max(-limit, min(limit, raw))
+            self._put16_le(self.HXL + 2 * i, raw & 0xFFFF)
+        self.regs[self.ST2] = st2
+        self.regs[self.ST1] |= 0x01
+        if self.regs[self.CNTL1] & 0x0F == 0x01:
+            self.regs[self.CNTL1] &= 0xF0  # single measurement returns to power-down
+
+    def on_read(self, reg, n):
+        if reg <= self.ST2 < reg + n:
+            self.regs[self.ST1] &= ~0x03
+
+
+# Calibration example values from the BMP280 datasheet (section 3.12)
+BMP280_DEFAULT_CALIB = (27504, 26435, -1000,
+                        36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000)
+_BMP_OSRS = (0, 1, 2, 4, 8, 16, 16, 16)
+_BMP_STANDBY_MS = (0.5, 62.5, 125.0, 250.0, 500.0, 1000.0, 2000.0, 4000.0)
+_BMP_IIR = (1, 2, 4, 8, 16, 16, 16, 16)
+
+
+def bmp280_t_fine(adc_t, cal):
+    t1, t2, t3 = cal[0], cal[1], cal[2]
+    var1 = (((adc_t >> 3) - (t1 << 1)) * t2) >> 11
+    var2 = (((((adc_t >> 4) - t1) * ((adc_t >> 4) - t1)) >> 12) * t3) >> 14
+    return var1 + var2
+
+
+def bmp280_pressure_q24_8(adc_p, t_fine, cal):
+    """Datasheet 64-bit integer pressure compensation; Pa in Q24.8."""
+    p1, p2, p3, p4, p5, p6, p7, p8, p9 = cal[3:12]
+    var1 = t_fine - 128000
+    var2 = var1 * var1 * p6
+    var2 = var2 + ((var1 * p5) << 17)
+    var2 = var2 + (p4 << 35)
+    var1 = ((var1 * var1 * p3) >> 8) + ((var1 * p2) << 12)
+    var1 = (((1 << 47) + var1) * p1) >> 33
+    if var1 == 0:
+        return 0
+    p = 1048576 - adc_p
+    p = (((p << 31) - var2) * 3125) // var1
+    var1 = (p9 * (p >> 13) * (p >> 13)) >> 25
+    var2 = (p8 * p) >> 19
+    return ((p + var1 + var2) >> 8) + (p7 << 4)
+
+
+def altitude_to_pressure(alt_m, sea_level_pa=101325.0):
+    """International barometric formula (inverse of IMUGY91.pressure_to_altitude)."""
+    return sea_level_pa * (1.0 - alt_m / 44330.0) ** (1.0 / 0.1903)
+
+
+class SimBMP280(SimDevice):
+    """
+    BMP280 barometer with the calibration PROM at 0x88, chip id 0x58,
+    ctrl_meas/config handling (sleep/forced/normal mode, oversampling,
+    standby, IIR), the status measuring bit and datasheet conversion times.
+    Raw ADC values are found by inverting the datasheet integer compensation
+    so a correct driver reads back the true temperature and pressure.
+    """
+    CALIB = 0x88
+    CHIP_ID = 0xD0
+    RESET = 0xE0
+    STATUS = 0xF3
+    CTRL_MEAS = 0xF4
+    CONFIG = 0xF5
+    PRESS_MSB = 0xF7
+    TEMP_MSB = 0xFA
+
+    def __init__(self, source=None, clock=None, seed=0, addr=BMP280_ADDR,
+                 calib=BMP280_DEFAULT_CALIB, press_noise=2.5, sea_level_pa=101325.0):
+        self.calib = calib
+        self.press_noise = press_noise  # Pa RMS at x1 oversampling
+        self.sea_level_pa = sea_level_pa
+        self.conversions = 0
+        super().__init__(addr, source, clock, seed)
+
+    def reset(self):
+        super().reset()
+        self.regs[self.CHIP_ID] = 0x58
+        c = self.calib
+        self._put16_le(self.CALIB, c[0])
+        for i in range(1, 12):
+            self._put16_le(self.CALIB + 2 * i, c[i] & 0xFFFF)
+        self._put20(self.PRESS_MSB, 0x80000)
+        self._put20(self.TEMP_MSB, 0x80000)
+        self._start = None   # start of the current measurement cycle
+        self._forced = False
+        self._iir_t = None
+        self._iir_p = None
+
+    def _put20(self, reg, raw):
+        self.regs[reg] = (raw >> 12) & 0xFF
+        self.regs[reg + 1] = (raw >> 4) & 0xFF
+        self.regs[reg + 2] = (raw << 4) & 0xF0
+
+    def measure_time(self):
+        """Typical conversion time in seconds (datasheet 3.8.1)."""
+        ctrl = self.regs[self.CTRL_MEAS]
+        os_t = _BMP_OSRS[(ctrl >> 5) & 0x07]
+        os_p = _BMP_OSRS[(ctrl >> 2) & 0x07]
+        ms = 1.0 + 2.0 * os_t + (2.0 * os_p + 0.5 if os_p else 0.0)
+        return ms / 1000.0
+
+    def cycle_time(self):
+        return self.measure_time() + _BMP_STANDBY_MS[(self.regs[self.CONFIG] >> 5) & 0x07] / 1000.0
+
+    def on_write(self, reg, value, t):
+        if reg == self.RESET:
+            if value == 0xB6:
+                self.reset()
+            return
+        if reg == self.STATUS or reg == self.CHIP_ID or self.CALIB <= reg < self.CALIB + 26:
+            return  # read-only
+        self.regs[reg] = value
+        if reg == self.CTRL_MEAS:
+            mode = value & 0x03
+            if mode == 0:
+                self._start = None
+            else:
+                self._start = t
+                self._forced = mode != 0x03
+
+    def sync(self, t):
+        if self._start is None:
+            self.regs[self.STATUS] = 0
+            return
+        meas = self.measure_time()
+        if self._forced:
+            end = self._start + meas
+            if t < end:
+                self.regs[self.STATUS] = 0x08
+                return
+            self._convert(end)
+            self._start = None
+            self.regs[self.CTRL_MEAS] &= ~0x03  # back to sleep
+            self.regs[self.STATUS] = 0
+            return
+        cycle = self.cycle_time()
+        # Complete every conversion that has finished since the last sync
+        while self._start + meas <= t:
+            self._convert(self._start + meas)
+            self._start += cycle
+        self.regs[self.STATUS] = 0x08 if t >= self._start else 0
+
+    def _convert(self, t):
+        self.conversions += 1
+        s = self.source.state(t)
+        ctrl = self.regs[self.CTRL_MEAS]
+        os_t = _BMP_OSRS[(ctrl >> 5) & 0x07]
+        os_p = _BMP_OSRS[(ctrl >> 2) & 0x07]
+        coeff = _BMP_IIR[(self.regs[self.CONFIG] >> 2) & 0x07]
+        temp = s.temp
+        press = altitude_to_pressure(s.alt, self.sea_level_pa)
+        if os_p:
+            press += self.rng.gauss(0.0, self.press_noise / math.sqrt(os_p))
+        if coeff > 1 and self._iir_p is not None:
+            press = self._iir_p + (press - self._iir_p) / coeff
+            temp = self._iir_t + (temp - self._iir_t) / coeff
+        self._iir_p = press
+        self._iir_t = temp
+        if not os_t:
+            self._put20(self.TEMP_MSB, 0x80000)
+            self._put20(self.PRESS_MSB, 0x80000)
+            return
+        adc_t = self._invert_temp(temp)
+        self._put20(self.TEMP_MSB, adc_t)
+        if os_p:
+            self._put20(self.PRESS_MSB, self._invert_press(press, bmp280_t_fine(adc_t, self.calib)))
+        else:
+            self._put20(self.PRESS_MSB, 0x80000)
+
+    def _invert_temp(self, temp_c):
+        target = temp_c * 5120.0  # t_fine units
+        lo, hi = 0, (1 << 20) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bmp280_t_fine(mid, self.calib) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _invert_press(self, press_pa, t_fine):
+        target = press_pa * 256.0
+        lo, hi = 0, (1 << 20) - 1
+        # Compensated pressure falls as adc_P rises
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bmp280_pressure_q24_8(mid, t_fine, self.calib) > target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+class SimQMC5883L(SimDevice):
+    """
+    QMC5883L magnetometer: control register 0x09 (mode, ODR, range, OSR),
+    soft reset in 0x0A, status 0x06 with DRDY/OVL/DOR, little-endian data at
+    0x00 and chip id 0xFF at 0x0D. Reading any data register clears DRDY and
+    DOR. The true field is distorted by a hard-iron offset and soft-iron
+    matrix (both in gauss) before noise and quantisation.
+    """
+    DATA = 0x00
+    STATUS = 0x06
+    TEMP = 0x07
+    CTRL1 = 0x09
+    CTRL2 = 0x0A
+    CHIP_ID = 0x0D
+    _ODR = (10.0, 50.0, 100.0, 200.0)
+    _LSB_PER_GAUSS = (12000.0, 3000.0)
+
+    def __init__(self, source=None, clock=None, seed=0, addr=QMC5883L_ADDR,
+                 field=(0.2, 0.0, -0.45), hard_iron=(0.0, 0.0, 0.0), soft_iron=None,
+                 noise=0.002):
+        self.field = field            # earth-frame field in gauss
+        self.hard_iron = hard_iron
+        self.soft_iron = soft_iron    # 3x3 rows, or None for identity
+        self.noise = noise            # gauss RMS
+        self.samples = 0
+        super().__init__(addr, source, clock, seed)
+
+    def reset(self):
+        super().reset()
+        self.regs[self.CHIP_ID] = 0xFF
+        self._t0 = self.clock()
+        self._index = -1
+
+    def sample_rate(self):
+        return self._ODR[(self.regs[self.CTRL1] >> 2) & 0x03]
+
+    def on_write(self, reg, value, t):
+        if reg == self.CTRL2 and value & 0x80:
+            self.reset()
+            return
+        self.regs[reg] = value
+        if reg == self.CTRL1:
+            self._t0 = t
+            self._index = -1
+
+    def sync(self, t):
+        if self.regs[self.CTRL1] & 0x03 != 0x01:  # continuous mode only
+            return
+        rate = self.sample_rate()
+        index = int((t - self._t0) * rate)
+        if index <= self._index:
+            return
+        status = self.regs[self.STATUS]
+        if status & 0x01 or index > self._index + 1:
+            status |= 0x04  # DOR: previous data was never read
+        self._index = index
+        self.samples += 1
+        if self._generate(self._t0 + index / rate):
+            status |= 0x02
+        else:
+            status &= ~0x02
+        self.regs[self.STATUS] = status | 0x01
+
+    def _generate(self, t):
+        s = self.source.state(t)
+        bx, by, bz = earth_to_body(s.roll, s.pitch, s.yaw, *self.field)
+        m = [bx + self.hard_iron[0], by + self.hard_iron[1], bz + self.hard_iron[2]]
+        if self.soft_iron is not None:
+            si = self.soft_iron
+            m = [si[i][0] * m[0] + si[i][1] * m[1] + si[i][2] * m[2] for i in range(3)]
+        lsb = self._LSB_PER_GAUSS[(self.regs[self.CTRL1] >> 4) & 0x01]
+        overflow = False
+        for i in range(3):
+            raw = int(round((m[i] + self.rng.gauss(0.0, self.noise)) * lsb))
+            if raw > 32767 or raw < -32768:
+                overflow = True
+                raw = max(-32768, min(32767, raw))
+            self._put16_le(self.DATA + 2 * i, raw & 0xFFFF)
+        self._put16_le(self.TEMP, int(s.temp * 100) & 0xFFFF)
+        return overflow
+
+    def on_read(self, reg, n):
+        if reg < self.DATA + 6 and reg + n > self.DATA:
+            self.regs[self.STATUS] &= ~0x05
+
+
+def sim_i2c(source=None, clock=None, seed=0):
+    """
+    I2C bus with an MPU-9250 (AK8963 on its auxiliary bus), BMP280 and
+    QMC5883L driven by one motion source.
+    """
+    source = source or Trajectory()
+    i2c = I2C()
+    i2c.attach(SimMPU9250(source, clock, seed, aux=SimAK8963(source, clock, seed + 3)))
+    i2c.attach(SimBMP280(source, clock, seed + 1))
+    i2c.attach(SimQMC5883L(source, clock, seed + 2))
+    return i2c
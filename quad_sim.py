@@ -0,0 +1,320 @@
+# quad_sim.py
+"""
+Rigid-body quadcopter simulator for hardware-free closed-loop runs (CPython).
+
+QuadSim reads the PWM duty cycles the DRV8833 drivers set on the four motors
+in motor_takeoff_test.MOTOR_PINS, models brushed motor lag, thrust, reaction
+torque and battery sag, and integrates the 6-DoF body. It is also the motion
+source for the simulated MPU-9250, BMP280 and QMC5883L in mock_machine and
+for a simulated NEO-6M UART, so the real driver classes read the simulated
+flight:
+
+    sim = QuadSim()
+    imu = IMUGY91(sim.i2c)
+    sim.motors['top_left'].forward(40000)
+    sim.step(0.001)
+
+Frames follow mock_machine: earth x = north, y = west, z = up; body x =
+forward, y = left, z = up. Runs much faster than real time.
+"""
+import math
+from mock_machine import (I2C, SimClock, MotionState, SimMPU9250, SimAK8963, SimBMP280,
+                          SimQMC5883L, earth_to_body)
+from motor_takeoff_test import MOTOR_PINS, MotorGroup
+
+GRAVITY = 9.80665
+EARTH_RADIUS = 6371000.0
+
+
+class QuadParams:
+    """Physical constants for a ~50 g brushed micro quad (SI units)."""
+
+    def __init__(self):
+        self.mass = 0.050
+        self.inertia = (2.0e-5, 2.0e-5, 3.8e-5)
+        self.arm = 0.045              # centre to motor, m
+        self.max_thrust = 0.35        # per motor at full duty and nominal voltage, N
+        self.torque_ratio = 0.006     # reaction torque per newton of thrust, N*m/N
+        self.motor_tau = 0.03         # first-order motor spin-up time constant, s
+        self.drag = 0.06              # linear translational drag, N/(m/s)
+        self.ang_drag = 2.0e-6        # rotational damping, N*m/(rad/s)
+        self.v_full = 4.2             # battery open-circuit voltage, full
+        self.v_empty = 3.3
+        self.v_nominal = 3.7          # voltage at which max_thrust is specified
+        self.r_internal = 0.15        # ohm
+        self.capacity_as = 300 * 3.6  # 300 mAh in ampere-seconds
+        self.i_max = 2.5              # current per motor at full duty, A
+        # Body-frame motor positions (x forward, y left) and spin (+1 = CCW from above)
+        d = self.arm / math.sqrt(2)
+        self.layout = {
+            'top_left': (d, d, -1),
+            'top_right': (d, -d, 1),
+            'bottom_left': (-d, d, 1),
+            'bottom_right': (-d, -d, -1),
+        }
+
+
+def motor_drive(motor):
+    """Signed drive fraction (-1..1) a DRV8833 motor or channel is commanding."""
+    if motor.pwm:
+        a = getattr(motor, 'pwm1', None) or motor.p1
+        b = getattr(motor, 'pwm2', None) or motor.p2
+        da = a.duty_u16()
+        db = b.duty_u16()
+    else:
+        da = motor.in1.value() * 65535
+        db = motor.in2.value() * 65535
+    if da and db:
+        return 0.0  # brake
+    return (da - db) / 65535.0
+
+
+class QuadSim:
+    """Quadcopter physics plus the simulated sensor bus and GPS UART."""
+
+    def __init__(self, motors=None, params=None, clock=None, seed=0,
+                 home=(51.5, -0.12), ground_alt=50.0, temp=25.0):
+        self.params = params or QuadParams()
+        self.clock = clock or SimClock()
+        if motors is None:
+            motors = MotorGroup(MOTOR_PINS, use_pwm=True).motors
+        self.motors = motors
+        self.home = home
+        self.ground_alt = ground_alt
+        self.temp = temp
+        # Rigid-body state: earth position/velocity, attitude quaternion, body rates
+        self.pos = [0.0, 0.0, 0.0]
+        self.vel = [0.0, 0.0, 0.0]
+        self.acc = [0.0, 0.0, 0.0]
+        self.q = [1.0, 0.0, 0.0, 0.0]
+        self.omega = [0.0, 0.0, 0.0]
+        self.thrust = {name: 0.0 for name in self.motors}
+        self.soc = 1.0
+        self.voltage = self.params.v_full
+        self.current = 0.0
+        self.on_ground = True
+        self._state = MotionState()
+        self.i2c = I2C()
+        self.i2c.attach(SimMPU9250(self, self.clock, seed,
+                                   aux=SimAK8963(self, self.clock, seed + 3)))
+        self.i2c.attach(SimBMP280(self, self.clock, seed + 1))
+        self.i2c.attach(SimQMC5883L(self, self.clock, seed + 2))
+        self.uart = SimGPSUART(self, self.clock)
+
+    @property
+    def t(self):
+        return self.clock()
+
+    # ---- motion source interface for the simulated sensors ----
+
+    def euler(self):
+        w, x, y, z = self.q
+        roll = math.atan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+        pitch = math.asin(max(-1.0, min(1.0, 2 * (w * y - z * x))))
+        yaw = math.atan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+        return roll, pitch, yaw
+
+    def state(self, t=None):
+        s = self._state
+        s.roll, s.pitch, s.yaw = self.euler()
+        s.p, s.q, s.r = self.omega
+        # Specific force: what an accelerometer measures, in g
+        fx, fy, fz = earth_to_body(s.roll, s.pitch, s.yaw, self.acc[0] / GRAVITY,
+                                   self.acc[1] / GRAVITY, self.acc[2] / GRAVITY + 1.0)
+        s.ax, s.ay, s.az = fx, fy, fz
+        s.alt = self.ground_alt + self.pos[2]
+        s.temp = self.temp
+        return s
+
+    def lat_lon(self):
+        lat0, lon0 = self.home
+        lat = lat0 + math.degrees(self.pos[0] / EARTH_RADIUS)
+        lon = lon0 - math.degrees(self.pos[1] / (EARTH_RADIUS * math.cos(math.radians(lat0))))
+        return lat, lon
+
+    # ---- physics ----
+
+    def step(self, dt=0.001):
+        """Advance physics and the shared clock by dt seconds."""
+        p = self.params
+        # Battery: open-circuit voltage falls with charge, sags under load
+        v_oc = p.v_empty + (p.v_full - p.v_empty) * self.soc
+        current = 0.0
+        fz = 0.0
+        tx = ty = tz = 0.0
+        alpha = dt / (p.motor_tau + dt)
+        for name, motor in self.motors.items():
+            u = motor_drive(motor)
+            v_ratio = self.voltage / p.v_nominal
+            target = p.max_thrust * u * abs(u) * v_ratio * v_ratio
+            thrust = self.thrust[name] + (target - self.thrust[name]) * alpha
+            self.thrust[name] = thrust
+            current += p.i_max * u * u
+            x, y, spin = p.layout.get(name, (0.0, 0.0, 1))
+            fz += thrust
+            tx += y * thrust
+            ty -= x * thrust
+            tz -= spin * p.torque_ratio * thrust
+        self.current = current
+        self.voltage = max(0.0, v_oc - current * p.r_internal)
+        self.soc = max(0.0, self.soc - current * dt / p.capacity_as)
+
+        # Rotational dynamics in body axes
+        ix, iy, iz = p.inertia
+        wx, wy, wz = self.omega
+        tx -= p.ang_drag * wx
+        ty -= p.ang_drag * wy
+        tz -= p.ang_drag * wz
+        dwx = (tx - (iz - iy) * wy * wz) / ix
+        dwy = (ty - (ix - iz) * wz * wx) / iy
+        dwz = (tz - (iy - ix) * wx * wy) / iz
+
+        # Translational dynamics in earth axes
+        qw, qx, qy, qz = self.q
+        # Third column of R: body z axis in earth frame
+        bzx = 2 * (qx * qz + qw * qy)
+        bzy = 2 * (qy * qz - qw * qx)
+        bzz = 1 - 2 * (qx * qx + qy * qy)
+        m = p.mass
+        ax = (fz * bzx - p.drag * self.vel[0]) / m
+        ay = (fz * bzy - p.drag * self.vel[1]) / m
+        az = (fz * bzz - p.drag * self.vel[2]) / m - GRAVITY
+
+        if self.on_ground and az <= 0.0:
+            # Resting on the ground: the ground reaction cancels gravity and spin
+            self.acc = [0.0, 0.0, 0.0]
+            self.vel = [0.0, 0.0, 0.0]
+            self.omega = [0.0, 0.0, 0.0]
+        else:
+            self.on_ground = False
+            self.acc = [ax, ay, az]
+            for i in range(3):
+                self.vel[i] += self.acc[i] * dt
+                self.pos[i] += self.vel[i] * dt
+            self.omega = [wx + dwx * dt, wy + dwy * dt, wz + dwz * dt]
+            wx, wy, wz = self.omega
+            # q_dot = 0.5 * q (x) (0, omega)
+            dq0 = 0.5 * (-qx * wx - qy * wy - qz * wz)
+            dq1 = 0.5 * (qw * wx + qy * wz - qz * wy)
+            dq2 = 0.5 * (qw * wy - qx * wz + qz * wx)
+            dq3 = 0.5 * (qw * wz + qx * wy - qy * wx)
+            qw += dq0 * dt
+            qx += dq1 * dt
+            qy += dq2 * dt
+            qz += dq3 * dt
+            n = math.sqrt(qw * qw + qx * qx + qy * qy + qz * qz)
+            self.q = [qw / n, qx / n, qy / n, qz / n]
+            if self.pos[2] <= 0.0 and self.vel[2] <= 0.0:
+                self.pos[2] = 0.0
+                self.on_ground = True
+        self.clock.advance(dt)
+        self.uart.update()
+
+    def run(self, duration, controller=None, dt=0.001):
+        """
+        Step for `duration` simulated seconds. controller(sim) is called
+        before every step and may read sensors and set motor duties.
+        """
+        steps = int(round(duration / dt))
+        for _ in range(steps):
+            if controller is not None:
+                controller(self)
+            self.step(dt)
+
+
+def _nmea(body):
+    ck = 0
+    for c in body:
+        ck ^= ord(c)
+    return "$%s*%02X\r\n" % (body, ck)
+
+
+def _nmea_coord(value, deg_digits, pos, neg):
+    hemi = pos if value >= 0 else neg
+    value = abs(value)
+    deg = int(value)
+    minutes = (value - deg) * 60.0
+    return "%0*d%07.4f" % (deg_digits, deg, minutes), hemi
+
+
+class SimGPSUART:
+    """UART stand-in emitting NMEA GGA/RMC for the simulated position at `rate` Hz."""
+
+    def __init__(self, sim, clock, rate=5.0, satellites=9):
+        self.sim = sim
+        self.clock = clock
+        self.period = 1.0 / rate
+        self.satellites = satellites
+        self._next = clock() + self.period
+        self._data = bytearray()
+
+    def update(self):
+        t = self.clock()
+        if t < self._next:
+            return
+        self._next += self.period
+        sim = self.sim
+        lat, lon = sim.lat_lon()
+        lat_s, ns = _nmea_coord(lat, 2, 'N', 'S')
+        lon_s, ew = _nmea_coord(lon, 3, 'E', 'W')
+        secs = t % 86400
+        hms = "%02d%02d%05.2f" % (secs // 3600, (secs % 3600) // 60, secs % 60)
+        alt = sim.ground_alt + sim.pos[2]
+        speed_kn = math.sqrt(sim.vel[0] ** 2 + sim.vel[1] ** 2) / 0.514444
+        course = math.degrees(math.atan2(-sim.vel[1], sim.vel[0])) % 360
+        self._data += _nmea("GPGGA,%s,%s,%s,%s,%s,1,%02d,0.9,%.1f,M,46.9,M,,"
+                            % (hms, lat_s, ns, lon_s, ew, self.satellites, alt)).encode()
+        self._data += _nmea("GPRMC,%s,A,%s,%s,%s,%s,%.2f,%.1f,010125,,"
+                            % (hms, lat_s, ns, lon_s, ew, speed_kn, course)).encode()
+
+    def any(self):
+        return len(self._data)
+
+    def read(self, n=None):
+        n = len(self._data) if n is None else n
+        d = bytes(self._data[:n])
+        del self._data[:n]
+        return d
+
+    def readinto(self, buf, nbytes=None):
+        n = min(len(buf), len(self._data) if nbytes is None else nbytes, len(self._data))
+        buf[:n] = self._data[:n]
+        del self._data[:n]
+        return n
+
+    def write(self, buf):
+        return len(buf)
+
+
+def takeoff_demo(duration=4.0):
+    """Replay the motor_takeoff_test ramp profile in simulation and report the result."""
+    import time
+    from motor_takeoff_test import SPIN_CHECK_SPEED, TARGET_SPEED, RAMP_UP_TIME, HOLD_TIME
+    sim = QuadSim()
+
+    def profile(s):
+        t = s.t
+        if t < RAMP_UP_TIME:
+            duty = SPIN_CHECK_SPEED + (TARGET_SPEED - SPIN_CHECK_SPEED) * t / RAMP_UP_TIME
+        elif t < RAMP_UP_TIME + HOLD_TIME:
+            duty = TARGET_SPEED
+        else:
+            duty = 0
+        for m in s.motors.values():
+            m.forward(int(duty))
+
+    start = time.perf_counter()
+    max_alt = 0.0
+    steps = int(duration / 0.001)
+    for _ in range(steps):
+        profile(sim)
+        sim.step(0.001)
+        max_alt = max(max_alt, sim.pos[2])
+    wall = time.perf_counter() - start
+    print(f"max_alt={max_alt:.2f} m, battery={sim.voltage:.2f} V, "
+          f"sim {duration:.1f}s in {wall:.2f}s ({duration / wall:.1f}x real time)")
+    return sim
+
+
+if __name__ == "__main__":
+    takeoff_demo()
@@ -0,0 +1,105 @@
+# scheduler.py
+"""
+Fixed-rate, multi-rate cooperative scheduler for the Pico Drone flight computer.
+
+Each rate group runs against its own monotonic deadline in microseconds. When a
+group falls behind it skips the missed ticks (counted in `skipped`) instead of
+running back-to-back to catch up, and every callback receives the exact time
+since its previous run. Runs on MicroPython (time.ticks_us) and CPython.
+"""
+import time
+import asyncio
+
+try:
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+    ticks_add = time.ticks_add
+except AttributeError:  # CPython: perf_counter never wraps
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+    def ticks_add(a, b):
+        return a + b
+
+
+class RateTask:
+    """One rate group: callback(dt) is called every `period_us` microseconds."""
+    __slots__ = ('name', 'period_us', 'callback', 'deadline', 'last', 'runs', 'skipped', 'stats')
+
+    def __init__(self, name, hz, callback, now):
+        if hz <= 0:
+            raise ValueError("rate must be positive")
+        self.name = name
+        self.period_us = int(1000000 / hz)
+        self.callback = callback
+        self.deadline = now
+        self.last = None
+        self.runs = 0
+        self.skipped = 0
+        self.stats = None
+
+
+class Scheduler:
+    """
+    Run rate groups in registration order (register the highest priority
+    first). `clock` is a ticks_us-style function; inject one for tests.
+    `stats` is an optional instrumentation.LoopStats.
+    """
+
+    def __init__(self, clock=None, stats=None):
+        self.clock = clock or ticks_us
+        self.stats = stats
+        self.tasks = []
+
+    def add(self, name, hz, callback):
+        task = RateTask(name, hz, callback, self.clock())
+        if self.stats is not None:
+            task.stats = self.stats.task(name, task.period_us)
+        self.tasks.append(task)
+        return task
+
+    def run_once(self):
+        """Run every task whose deadline has passed. Returns the number run."""
+        ran = 0
+        for task in self.tasks:
+            now = self.clock()
+            late = ticks_diff(now, task.deadline)
+            if late < 0:
+                continue
+            if task.last is None:
+                dt = task.period_us / 1000000
+            else:
+                dt = ticks_diff(now, task.last) / 1000000
+            task.last = now
+            task.callback(dt)
+            task.runs += 1
+            # Advance on the fixed grid; drop whole periods we were too late for
+            missed = late // task.period_us
+            if missed:
+                task.skipped += missed
+            if task.stats is not None and self.stats.enabled:
+                task.stats.record(now, late, ticks_diff(self.clock(), now), missed)
+            task.deadline = ticks_add(task.deadline, (missed + 1) * task.period_us)
+            ran += 1
+        return ran
+
+    def next_wait_us(self):
+        """Microseconds until the earliest deadline (0 if something is due)."""
+        now = self.clock()
+        wait = None
+        for task in self.tasks:
+            d = ticks_diff(task.deadline, now)
+            if wait is None or d < wait:
+                wait = d
+        if wait is None or wait < 0:
+            return 0
+        return wait
+
+    async def run(self):
+        """Run forever, yielding to other asyncio tasks between deadlines."""
+        while True:
+            self.run_once()
+            await asyncio.sleep(self.next_wait_us() / 1000000)
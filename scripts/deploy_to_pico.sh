@@ -5,7 +5,7 @@
 
 PICO_MOUNT=${1:-/media/$USER/RPI-RP2}
 
-FILES="flight_computer.py imu_gy91.py mag_gy273.py gps_neo6m.py gamepad.py ssd1306.py"
+FILES="flight_computer.py scheduler.py instrumentation.py telemetry.py imu_gy91.py filters.py fastmath.py bmp280.py calibration.py mag_gy273.py gps_neo6m.py gamepad.py ssd1306.py"
 
 for file in $FILES; do
     echo "Copying $file to $PICO_MOUNT..."
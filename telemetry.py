@@ -0,0 +1,191 @@
+# telemetry.py
+"""
+Binary telemetry logger for the Pico Drone flight computer.
+
+Each sample is packed into a fixed 64-byte little-endian record inside a
+preallocated ring buffer. A low-priority task flushes the ring to a sink (a
+file on flash or a serial stream) in large blocks. When the sink cannot keep
+up the newest samples are dropped and counted instead of blocking the loop.
+With max_bytes set the sink stops growing at that size, and a sink that
+raises OSError (flash full) loses the pending bytes; both are counted in
+`lost` rather than raised.
+
+The decode helpers at the bottom run on CPython:
+    python telemetry.py telemetry.bin > telemetry.csv
+"""
+import struct
+import time
+import asyncio
+
+try:
+    _ticks_ms = time.ticks_ms
+except AttributeError:  # CPython
+    def _ticks_ms():
+        return (time.monotonic_ns() // 1000000) & 0x3FFFFFFF
+
+# magic, seq, flags, time_ms, ax, ay, az, gx, gy, gz, temp, alt, pitch, roll, heading,
+# lat (1e-7 deg), lon (1e-7 deg), alt_gps
+RECORD_FMT = '<HBBI11fiif'
+RECORD_SIZE = struct.calcsize(RECORD_FMT)  # 64 bytes
+RECORD_MAGIC = 0x5AA5
+FLAG_GPS_VALID = 0x01
+FIELDS = ('seq', 'flags', 'time_ms', 'ax', 'ay', 'az', 'gx', 'gy', 'gz', 'temp', 'alt',
+          'pitch', 'roll', 'heading', 'lat', 'lon', 'alt_gps')
+DEFAULT_CAPACITY = 64  # records held between flushes (4 KB)
+
+
+class TelemetryLog:
+    """Preallocated ring of packed telemetry records with a non-blocking writer side."""
+
+    def __init__(self, sink=None, capacity=DEFAULT_CAPACITY, max_bytes=None):
+        self.sink = sink
+        self.max_bytes = max_bytes
+        self._buf = bytearray(RECORD_SIZE * capacity)
+        self._mv = memoryview(self._buf)
+        self._rec = bytearray(RECORD_SIZE)  # scratch for records that wrap the ring
+        self._head = 0   # byte offset of the oldest unflushed data
+        self._count = 0  # unflushed bytes
+        self._seq = 0
+        self.written = 0  # records accepted into the ring
+        self.dropped = 0  # records discarded because the ring was full
+        self.flushed = 0  # bytes handed to the sink
+        self.lost = 0     # bytes discarded at max_bytes or on a sink error
+
+    def log(self, ax, ay, az, gx, gy, gz, temp, alt, pitch, roll, heading,
+            lat=None, lon=None, alt_gps=None, gps_valid=None):
+        """
+        Pack one sample. Returns False (and counts a drop) if the ring is full.
+        FLAG_GPS_VALID follows gps_valid (e.g. IMUSample.gps_valid), so a
+        last-known position is not logged as current; with gps_valid=None it
+        is set whenever lat/lon are given.
+        """
+        size = len(self._buf)
+        if self._count + RECORD_SIZE > size:
+            self.dropped += 1
+            return False
+        flags = 0
+        ilat = ilon = 0
+        if gps_valid is None:
+            gps_valid = True
+        if gps_valid and lat is not None and lon is not None and lat == lat and lon == lon:
+            flags |= FLAG_GPS_VALID
+            ilat = int(lat * 1e7)
+            ilon = int(lon * 1e7)
+        if alt_gps is None:
+            alt_gps = 0.0
+        tail = (self._head + self._count) % size
+        # A short sink write can leave the ring unaligned; split those records
+        wraps = tail + RECORD_SIZE > size
+        struct.pack_into(RECORD_FMT, self._rec if wraps else self._buf, 0 if wraps else tail,
+                         RECORD_MAGIC, self._seq, flags, _ticks_ms(), ax, ay, az, gx, gy, gz,
+                         temp, alt, pitch, roll, heading, ilat, ilon, alt_gps)
+        if wraps:
+            first = size - tail
+            self._buf[tail:] = self._rec[:first]
+            self._buf[:RECORD_SIZE - first] = self._rec[first:]
+        self._seq = (self._seq + 1) & 0xFF
+        self._count += RECORD_SIZE
+        self.written += 1
+        return True
+
+    def pending(self):
+        """Bytes waiting to be flushed."""
+        return self._count
+
+    def flush(self):
+        """
+        Hand buffered records to the sink in at most two contiguous writes.
+        Honours short writes from non-blocking streams. Returns bytes written.
+        """
+        sink = self.sink
+        if sink is None or not self._count:
+            return 0
+        if self.max_bytes is not None and self.flushed + self._count > self.max_bytes:
+            self._discard()
+            return 0
+        size = len(self._buf)
+        total = 0
+        while self._count:
+            end = min(self._head + self._count, size)
+            chunk = end - self._head
+            try:
+                n = sink.write(self._mv[self._head:end])
+            except OSError:
+                self._discard()
+                break
+            if n is None:
+                n = chunk
+            if n <= 0:
+                break
+            self._head = (self._head + n) % size
+            self._count -= n
+            total += n
+            if n < chunk:
+                break
+        if not self._count:
+            self._head = 0
+        self.flushed += total
+        return total
+
+    def _discard(self):
+        self.lost += self._count
+        self._head = 0
+        self._count = 0
+
+    async def run(self, interval=0.5):
+        """Low-priority background flusher."""
+        while True:
+            self.flush()
+            f = getattr(self.sink, 'flush', None)
+            if f is not None:
+                try:
+                    f()
+                except OSError:
+                    pass  # the next write fails too and is counted there
+            await asyncio.sleep(interval)
+
+
+def decode(data):
+    """
+    Decode a telemetry byte stream into a list of tuples ordered as FIELDS.
+    Resynchronises on the record magic if the stream is corrupt or truncated.
+    lat/lon/alt_gps are NaN for records without a GPS fix.
+    """
+    records = []
+    nan = float('nan')
+    pos = 0
+    end = len(data) - RECORD_SIZE
+    while pos <= end:
+        rec = struct.unpack_from(RECORD_FMT, data, pos)
+        if rec[0] != RECORD_MAGIC:
+            pos += 1
+            continue
+        rec = list(rec[1:])
+        if rec[1] & FLAG_GPS_VALID:
+            rec[14] *= 1e-7
+            rec[15] *= 1e-7
+        else:
+            rec[14] = rec[15] = rec[16] = nan
+        records.append(tuple(rec))
+        pos += RECORD_SIZE
+    return records
+
+
+def to_csv(data, out):
+    """Write decoded records as CSV lines to a text stream."""
+    out.write(",".join(FIELDS) + "\n")
+    for rec in decode(data):
+        out.write(",".join(repr(v) for v in rec) + "\n")
+
+
+def to_numpy(data):
+    """Decode into a NumPy structured array (CPython only; needs numpy)."""
+    import numpy as np
+    dtype = [(name, np.float64) for name in FIELDS]
+    return np.array(decode(data), dtype=dtype)
+
+
+if __name__ == "__main__":
+    import sys
+    with open(sys.argv[1], 'rb') as f:
+        to_csv(f.read(), sys.stdout)
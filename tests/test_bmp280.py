@@ -0,0 +1,163 @@
+# Test for the BMP280 barometer driver
+import struct
+import unittest
+from bmp280 import BMP280, AltitudeLUT, MODE_FORCED, exact_altitude
+from mock_machine import I2C, SimClock, Trajectory, SimBMP280, altitude_to_pressure
+
+# Calibration and ADC example from the BMP280 datasheet (section 3.12)
+CALIB = (27504, 26435, -1000, 36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000)
+ADC_T = 519888
+ADC_P = 415148
+
+
+class CalibI2C:
+    """Serves the datasheet calibration PROM and one fixed conversion."""
+    def __init__(self):
+        self.regs = bytearray(256)
+        self.regs[0x88:0x88 + 24] = struct.pack('<HhhHhhhhhhhh', *CALIB)
+        d = bytes(((ADC_P >> 12) & 0xFF, (ADC_P >> 4) & 0xFF, (ADC_P & 0x0F) << 4,
+                   (ADC_T >> 12) & 0xFF, (ADC_T >> 4) & 0xFF, (ADC_T & 0x0F) << 4))
+        self.regs[0xF7:0xF7 + 6] = d
+        self.reads = []
+    def writeto_mem(self, addr, reg, buf):
+        self.regs[reg] = buf[0]
+    def readfrom_mem(self, addr, reg, n):
+        self.reads.append((reg, n))
+        return bytes(self.regs[reg:reg + n])
+    def readfrom_mem_into(self, addr, reg, buf):
+        self.reads.append((reg, len(buf)))
+        buf[:] = self.regs[reg:reg + len(buf)]
+
+
+class TestBMP280(unittest.TestCase):
+    def setUp(self):
+        self.i2c = CalibI2C()
+        self.bmp = BMP280(self.i2c)
+
+    def test_calibration_cached(self):
+        self.assertEqual(self.bmp.dig_T1, 27504)
+        self.assertEqual(self.bmp.dig_P9, 6000)
+        self.assertEqual(self.i2c.regs[0xF4], 0x27)
+        self.bmp.read()
+        self.bmp.read()
+        self.assertEqual(self.i2c.reads, [(0x88, 24), (0xF7, 6), (0xF7, 6)])
+
+    def test_datasheet_example(self):
+        self.assertEqual(self.bmp.read_raw(), (ADC_T, ADC_P))
+        self.assertEqual(self.bmp.compensate_temperature(ADC_T), 2508)
+        self.assertEqual(self.bmp.t_fine, 128422)
+        self.assertAlmostEqual(self.bmp.compensate_pressure(ADC_P) / 256.0, 100653.27, delta=0.05)
+        temp, press = self.bmp.compensate_float(ADC_T, ADC_P)
+        self.assertAlmostEqual(temp, 25.08, delta=0.01)
+        self.assertAlmostEqual(press, 100653.27, delta=0.1)
+
+    def test_against_simulator(self):
+        clock = SimClock()
+        i2c = I2C()
+        i2c.attach(SimBMP280(Trajectory(alt=120.0, temp=12.0), clock, press_noise=0.0))
+        bmp = BMP280(i2c)
+        clock.advance(0.1)
+        temp, press = bmp.read()
+        self.assertAlmostEqual(temp, 12.0, delta=0.02)
+        self.assertAlmostEqual(press, altitude_to_pressure(120.0), delta=1.0)
+
+    def test_configure(self):
+        self.bmp.configure(osrs_t=2, osrs_p=16, iir=16, standby_ms=0.5)
+        self.assertEqual(self.i2c.regs[0xF4], (2 << 5) | (5 << 2) | 3)
+        self.assertEqual(self.i2c.regs[0xF5], (0 << 5) | (4 << 2))
+        self.assertEqual(self.bmp.measure_us, 1250 + 4600 + 36800 + 575)
+        self.assertEqual(self.bmp.period_us, self.bmp.measure_us + 500)
+        self.bmp.configure(mode=MODE_FORCED)
+        self.assertEqual(self.i2c.regs[0xF4] & 0x03, 0)  # sleeps until a conversion is started
+        for bad in ({'osrs_p': 3}, {'iir': 5}, {'standby_ms': 100}, {'mode': 2}):
+            with self.assertRaises(ValueError):
+                self.bmp.configure(**bad)
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            self.bmp.extra = 1
+
+class TestBMP280Poll(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        self.i2c = I2C()
+        self.sim = self.i2c.attach(SimBMP280(Trajectory(alt=50.0), self.clock, press_noise=0.0))
+        self.transfers = 0
+        read = self.i2c.readfrom_mem_into
+        def counting(addr, reg, buf):
+            self.transfers += 1
+            read(addr, reg, buf)
+        self.i2c.readfrom_mem_into = counting
+
+    def make(self, **kw):
+        return BMP280(self.i2c, clock=lambda: int(self.clock() * 1000000), **kw)
+
+    def test_normal_mode_gating(self):
+        bmp = self.make(osrs_t=2, osrs_p=16, iir=0, standby_ms=0.5)
+        transfers = self.transfers
+        self.assertFalse(bmp.poll())  # first conversion still running
+        self.assertEqual(self.transfers, transfers)
+        self.clock.advance(0.045)
+        self.assertTrue(bmp.poll())
+        self.assertAlmostEqual(bmp.pressure, altitude_to_pressure(50.0), delta=1.0)
+        self.clock.advance(0.010)
+        transfers = self.transfers
+        self.assertFalse(bmp.poll())  # too soon for another result: no bus traffic
+        self.assertEqual(self.transfers, transfers)
+        self.clock.advance(0.040)
+        self.assertTrue(bmp.poll())
+        self.assertEqual(bmp.conversions, 2)
+
+    def test_forced_mode_pipeline(self):
+        bmp = self.make(mode=MODE_FORCED)
+        self.assertFalse(bmp.poll())  # starts the first conversion
+        self.assertEqual(self.i2c.readfrom_mem(0x76, 0xF3, 1)[0] & 0x08, 0x08)
+        self.clock.advance(0.003)
+        self.assertFalse(bmp.poll())
+        self.clock.advance(0.005)
+        self.assertTrue(bmp.poll())
+        self.assertEqual(self.sim.conversions, 1)
+        # The next conversion is already running
+        self.clock.advance(0.010)
+        self.assertTrue(bmp.poll())
+        self.assertEqual(self.sim.conversions, 2)
+        self.assertAlmostEqual(bmp.temperature, 25.0, delta=0.02)
+        # A conversion still flagged as measuring is not read
+        self.clock.advance(0.010)
+        self.i2c.writeto_mem(0x76, 0xF4, bytes([bmp.ctrl_meas | MODE_FORCED]))
+        self.assertFalse(bmp.poll())
+        self.assertEqual(bmp.busy_polls, 1)
+
+class TestAltitudeLUT(unittest.TestCase):
+    def test_rejects_non_positive_ground(self):
+        lut = AltitudeLUT()
+        for p in (0, 0.0, -5.0, float('nan')):
+            with self.assertRaises(ValueError):
+                lut.set_ground(p)
+        self.assertIsNone(lut.ground)
+
+    def test_error_within_bound(self):
+        lut = AltitudeLUT()
+        lut.set_ground(97000.0)
+        self.assertEqual(lut.altitude(97000.0), 0.0)
+        bound = lut.max_error()
+        self.assertLess(bound, 0.03)
+        ground = exact_altitude(97000.0)
+        p = 97000.0 * lut.ratio_min
+        while p < 97000.0 * lut.ratio_max:
+            self.assertAlmostEqual(lut.altitude(p), exact_altitude(p) - ground, delta=bound + 1e-3)
+            p += 17.0
+
+    def test_outside_table_uses_exact_formula(self):
+        lut = AltitudeLUT()
+        lut.set_ground(100000.0)
+        ref = exact_altitude(40000.0) - exact_altitude(100000.0)
+        self.assertAlmostEqual(lut.altitude(40000.0), ref, places=6)
+
+    def test_without_ground_is_above_sea_level(self):
+        lut = AltitudeLUT()
+        self.assertIsNone(lut.ground)
+        self.assertAlmostEqual(lut.altitude(altitude_to_pressure(500.0)), 500.0, delta=0.05)
+
+if __name__ == "__main__":
+    unittest.main()
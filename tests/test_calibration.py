@@ -0,0 +1,323 @@
+# Test for sensor calibration and the flash calibration cache
+import contextlib
+import io
+import math
+import os
+import tempfile
+import unittest
+import calibration
+from calibration import (Calibration, AccelSixPosition, MagCalibrator, CAL_GYRO, CAL_ACCEL,
+                         CAL_MAG, CAL_BARO, CAL_SIZE, CAL_MAG_AK8963, CAL_MAG_QMC5883L,
+                         calibrate_gyro, calibrate_mag, calibrate_baro)
+from imu_gy91 import IMUGY91, MPU_ADDR
+from bmp280 import BMP280
+from mag_gy273 import MagnetometerGY273
+from mock_machine import I2C, sim_i2c, SimClock, SimQMC5883L, Trajectory
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestCalibrationRecord(unittest.TestCase):
+    def setUp(self):
+        self.cal = Calibration()
+        self.cal.flags = CAL_GYRO | CAL_MAG
+        self.cal.gyro_bias = (1.5, -0.25, 3.0)
+        self.cal.mag_offset = (12.0, -7.5, 40.0)
+        self.cal.mag_scale = (1.25, 0.75, 1.0)
+        self.cal.baro_baseline = 101325.0
+        self.cal.temp = 24.5
+
+    def test_pack_round_trip(self):
+        data = self.cal.pack()
+        self.assertEqual(len(data), CAL_SIZE)
+        cal = Calibration.unpack(data)
+        self.assertEqual(cal.flags, CAL_GYRO | CAL_MAG)
+        self.assertEqual(cal.gyro_bias, (1.5, -0.25, 3.0))
+        self.assertEqual(cal.mag_scale, (1.25, 0.75, 1.0))
+        self.assertEqual(cal.baro_baseline, 101325.0)
+        self.assertEqual(cal.temp, 24.5)
+
+    def test_corrupt_record_rejected(self):
+        data = bytearray(self.cal.pack())
+        data[10] ^= 0x01
+        with self.assertRaises(ValueError):
+            Calibration.unpack(data)
+        with self.assertRaises(ValueError):
+            Calibration.unpack(b'XXXX' + bytes(data[4:]))
+        with self.assertRaises(ValueError):
+            Calibration.unpack(data[:20])
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'cal.bin')
+            self.assertIsNone(calibration.load(path))
+            self.cal.save(path)
+            self.assertFalse(os.path.exists(path + '.tmp'))
+            self.assertEqual(calibration.load(path).gyro_bias, (1.5, -0.25, 3.0))
+            with open(path, 'wb') as f:
+                f.write(b'\x00' * CAL_SIZE)
+            self.assertIsNone(calibration.load(path))
+
+    def test_stale(self):
+        self.assertFalse(self.cal.stale(28.0))
+        self.assertTrue(self.cal.stale(35.0))
+        self.assertTrue(self.cal.stale(14.0))
+        self.assertTrue(Calibration().stale(24.5))  # no gyro bias yet
+
+
+class TestCalibrateIMU(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        self.i2c = sim_i2c(Trajectory(), self.clock)
+        self.i2c.devices[MPU_ADDR].gyro_bias = (2.0, -1.0, 0.5)
+        self.imu = IMUGY91(self.i2c)
+        self.wait = lambda: self.clock.advance(0.002)
+
+    def test_gyro_bias_removed(self):
+        cal = Calibration()
+        bias = calibrate_gyro(self.imu, cal, wait=self.wait)
+        for b, want in zip(bias, (2.0, -1.0, 0.5)):
+            self.assertAlmostEqual(b, want, delta=0.05)
+        self.assertTrue(cal.flags & CAL_GYRO)
+        self.assertFalse(cal.stale(self.imu.read_burst()[6]))
+        self.assertIsNone(self.imu.calibration)
+        self.imu.set_calibration(cal)
+        self.clock.advance(0.01)
+        for g in self.imu.read_gyro():
+            self.assertAlmostEqual(g, 0.0, delta=0.3)
+
+    def test_recalibrate_ignores_current_bias(self):
+        cal = Calibration()
+        calibrate_gyro(self.imu, cal, wait=self.wait)
+        self.imu.set_calibration(cal)
+        again = Calibration()
+        calibrate_gyro(self.imu, again, wait=self.wait)
+        self.assertAlmostEqual(again.gyro_bias[0], 2.0, delta=0.05)
+        self.assertIs(self.imu.calibration, cal)
+
+    def test_moving_board_rejected(self):
+        clock = SimClock()
+        imu = IMUGY91(sim_i2c(Trajectory(roll_amp=0.5, freq=2.0), clock))
+        with self.assertRaises(ValueError):
+            calibrate_gyro(imu, Calibration(), wait=lambda: clock.advance(0.002))
+
+    def test_six_position_face(self):
+        six = AccelSixPosition()
+        self.assertEqual(six.capture(self.imu, samples=20, wait=self.wait), 4)  # z up
+        self.assertFalse(six.done())
+
+
+class TestAccelSixPosition(unittest.TestCase):
+    def test_solve(self):
+        six = AccelSixPosition()
+        six.faces = [1.02, -0.98, 0.99, -1.01, 1.05, -0.95]
+        cal = Calibration()
+        offset, scale = six.solve(cal)
+        for got, want in zip(offset, (0.02, -0.01, 0.05)):
+            self.assertAlmostEqual(got, want)
+        for got, want in zip(scale, (1.0, 1.0, 1.0)):
+            self.assertAlmostEqual(got, want)
+        self.assertTrue(cal.flags & CAL_ACCEL)
+
+    def test_applied_to_readings(self):
+        clock = SimClock()
+        imu = IMUGY91(sim_i2c(Trajectory(), clock))
+        cal = Calibration()
+        cal.flags = CAL_ACCEL
+        cal.accel_offset = (0.0, 0.0, 0.1)
+        cal.accel_scale = (1.0, 1.0, 0.5)
+        raw = imu.read_accel()[2]
+        imu.set_calibration(cal)
+        self.assertAlmostEqual(imu.read_accel()[2], (raw - 0.1) / 0.5, places=4)
+
+    def test_incomplete(self):
+        with self.assertRaises(ValueError):
+            AccelSixPosition().solve(Calibration())
+
+
+class TestCalibrateMagBaro(unittest.TestCase):
+    def test_mag_min_max(self):
+        points = [(130, 20, -40), (-70, 20, -40), (30, 180, -40),
+                  (30, -140, -40), (30, 20, 10), (30, 20, -90)]
+        it = iter(points)
+        cal = Calibration()
+        offset, scale = calibrate_mag(lambda: next(it), cal, samples=len(points),
+                                      wait=lambda: None)
+        self.assertEqual(offset, (30.0, 20.0, -40.0))
+        radius = (100.0, 160.0, 50.0)
+        for s, r in zip(scale, radius):
+            self.assertAlmostEqual(s * r, sum(radius) / 3)
+        self.assertTrue(cal.has_mag(CAL_MAG_QMC5883L))
+        self.assertFalse(cal.has_mag(CAL_MAG_AK8963))
+
+    def test_mag_applies_to_its_own_sensor_only(self):
+        imu = IMUGY91(sim_i2c(Trajectory(), SimClock()), mag=True)
+        cal = Calibration()
+        cal.set_mag((120.0, -80.0, 300.0), (1.1, 0.9, 1.0), CAL_MAG_QMC5883L)  # GY-273 counts
+        imu.set_calibration(cal)
+        self.assertEqual(imu._mag_c, (0.0, 0.0, 0.0))
+        cal.set_mag((12.0, -8.0, 30.0), (1.1, 0.9, 1.0), CAL_MAG_AK8963)
+        self.assertEqual(cal.flags & (CAL_MAG_AK8963 | CAL_MAG_QMC5883L), CAL_MAG_AK8963)
+        imu.set_calibration(Calibration.unpack(cal.pack()))
+        self.assertAlmostEqual(imu._mag_c[0], -12.0 * 1.1, places=4)
+        untagged = Calibration()
+        untagged.flags = CAL_MAG  # no sensor recorded: applied to neither
+        self.assertFalse(untagged.has_mag(CAL_MAG_AK8963) or untagged.has_mag(CAL_MAG_QMC5883L))
+
+    def test_baro_baseline(self):
+        clock = SimClock()
+        i2c = sim_i2c(Trajectory(), clock)
+        ticks = lambda: int(clock() * 1000000)
+        bmp = BMP280(i2c, standby_ms=62.5, clock=ticks)
+        cal = Calibration()
+        base = calibrate_baro(bmp, cal, samples=5, wait=lambda: clock.advance(0.002))
+        self.assertAlmostEqual(base, 101325.0, delta=50.0)
+        self.assertGreaterEqual(bmp.conversions, 5)
+        self.assertTrue(cal.flags & CAL_BARO)
+
+    def test_baro_timeout(self):
+        clock = SimClock()
+        bmp = BMP280(sim_i2c(Trajectory(), clock), clock=lambda: int(clock() * 1000000))
+        with self.assertRaises(OSError):
+            calibrate_baro(bmp, Calibration(), max_polls=5, wait=lambda: None)
+
+
+class Tumble(Trajectory):
+    """Slow roll, pitch and yaw at unrelated rates, covering most orientations."""
+    def state(self, t):
+        s = super().state(t)
+        s.roll = 2.5 * math.sin(0.37 * t)
+        s.pitch = 1.4 * math.sin(0.23 * t + 1.0)
+        s.yaw = 0.9 * t
+        return s
+
+
+class TestEllipsoid(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        self.i2c = I2C()
+        self.sim = SimQMC5883L(Tumble(), self.clock, seed=5, hard_iron=(0.12, -0.05, 0.08),
+                               soft_iron=((1.15, 0.06, 0.0), (0.06, 0.88, 0.03),
+                                          (0.0, 0.03, 1.04)))
+        self.i2c.attach(self.sim)
+        self.mag = MagnetometerGY273(self.i2c)
+        self.wait = lambda: self.clock.advance(0.1)
+
+    def spread(self):
+        """Relative spread of the corrected field magnitude over a tumble."""
+        r = []
+        for _ in range(200):
+            self.clock.advance(0.13)
+            x, y, z = self.mag.read_calibrated()
+            r.append(math.sqrt(x * x + y * y + z * z))
+        return (max(r) - min(r)) / (sum(r) / len(r))
+
+    def test_record_round_trip(self):
+        matrix = ((1.0, 0.1, 0.0), (0.1, 0.9, 0.0), (0.0, 0.0, 1.1))
+        data = calibration.pack_mag((10.0, -20.0, 5.0), matrix)
+        self.assertEqual(len(data), calibration.MAG_SIZE)
+        offset, m = calibration.unpack_mag(data)
+        self.assertEqual(offset, (10.0, -20.0, 5.0))
+        self.assertAlmostEqual(m[1][1], 0.9, places=6)
+        with self.assertRaises(ValueError):
+            calibration.unpack_mag(data[:-1] + bytes((data[-1] ^ 1,)))
+
+    def test_apply_matrix(self):
+        self.mag.set_ellipsoid((100.0, 0.0, -50.0), ((2.0, 0.0, 0.0), (0.0, 1.0, 0.5),
+                                                      (0.0, 0.0, 1.0)))
+        self.mag.read_raw = lambda: (110, 20, -40)
+        self.assertEqual(self.mag.read_calibrated(), (20.0, 25.0, 10.0))
+
+    @unittest.skipIf(numpy is None, "needs numpy")
+    def test_capture_fit_apply(self):
+        before = self.spread()
+        with tempfile.TemporaryDirectory() as d:
+            samples = os.path.join(d, 'mag.csv')
+            out = os.path.join(d, 'mag_cal.bin')
+            calibration.capture_mag(self.mag.read_raw, samples, 600, self.wait)
+            with contextlib.redirect_stdout(io.StringIO()):
+                calibration.fit_file(samples, out)
+            ellipsoid = calibration.load_mag(out)
+        self.mag.set_ellipsoid(*ellipsoid)
+        self.assertGreater(before, 0.3)
+        self.assertLess(self.spread(), 0.04)
+
+    @unittest.skipIf(numpy is None, "needs numpy")
+    def test_fit_synthetic(self):
+        rng = numpy.random.default_rng(1)
+        u = rng.normal(size=(500, 3))
+        u /= numpy.linalg.norm(u, axis=1)[:, None]
+        distort = numpy.array([[1.3, 0.2, 0.0], [0.2, 0.8, 0.1], [0.0, 0.1, 1.0]])
+        p = 1000.0 * u @ distort.T + (300.0, -120.0, 40.0)
+        offset, matrix = calibration.fit_ellipsoid(p)
+        numpy.testing.assert_allclose(offset, (300.0, -120.0, 40.0), atol=1e-6)
+        r = numpy.linalg.norm((p - offset) @ numpy.array(matrix).T, axis=1)
+        self.assertLess(r.std() / r.mean(), 1e-9)
+        with self.assertRaises(ValueError):
+            calibration.fit_ellipsoid(p[:5])
+
+
+class TestMagCalibrator(unittest.TestCase):
+    def run_tumble(self, calib, soft_iron=None, steps=1500):
+        clock = SimClock()
+        i2c = I2C()
+        i2c.attach(SimQMC5883L(Tumble(), clock, seed=5, hard_iron=(0.12, -0.05, 0.08),
+                               soft_iron=soft_iron))
+        mag = MagnetometerGY273(i2c)
+        for _ in range(steps):
+            clock.advance(0.1)
+            if mag.update():
+                calib.update(mag.x, mag.y, mag.z)
+                if calib.improved():
+                    break
+        return mag
+
+    def test_sphere_converges(self):
+        calib = MagCalibrator()
+        self.run_tumble(calib)
+        self.assertTrue(calib.converged())
+        self.assertTrue(calib.improved())
+        for got, want in zip(calib.offset(), (360.0, -150.0, 240.0)):  # gauss * 3000
+            self.assertAlmostEqual(got, want, delta=10.0)
+        self.assertEqual(calib.scale(), (1.0, 1.0, 1.0))
+        self.assertGreaterEqual(calib.coverage(), 0.75)
+
+    def test_diagonal_scale(self):
+        calib = MagCalibrator(diagonal=True)
+        self.run_tumble(calib, soft_iron=((1.15, 0.0, 0.0), (0.0, 0.88, 0.0), (0.0, 0.0, 1.04)))
+        self.assertTrue(calib.improved())
+        for got, want in zip(calib.offset(), (414.0, -132.0, 249.6)):
+            self.assertAlmostEqual(got, want, delta=10.0)
+        g = (1.15 * 0.88 * 1.04) ** (1.0 / 3.0)
+        for got, s in zip(calib.scale(), (1.15, 0.88, 1.04)):
+            self.assertAlmostEqual(got, g / s, delta=0.01)
+
+    def test_needs_coverage(self):
+        calib = MagCalibrator()
+        for i in range(500):  # level, slowly turning: one band of directions only
+            a = i * 0.05
+            calib.update(600 * math.cos(a) + 300, -600 * math.sin(a), -1350)
+        self.assertFalse(calib.converged())
+        self.assertLess(calib.coverage(), 0.75)
+
+    def test_commit_saves_once(self):
+        calib = MagCalibrator()
+        self.run_tumble(calib)
+        cal = Calibration()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'cal.bin')
+            offset, scale = calib.commit(cal, path)
+            saved = calibration.load(path)
+        self.assertTrue(saved.has_mag(CAL_MAG_QMC5883L))
+        for got, want in zip(saved.mag_offset, offset):
+            self.assertAlmostEqual(got, want, places=2)
+        self.assertFalse(calib.improved())  # the fit is now the reference
+        calib.reset()
+        self.assertEqual((calib.samples, calib.coverage()), (0, 0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,10 +21,14 @@ class TestDRV8833(unittest.TestCase):
     def setUp(self):
         # Patch Pin and PWM for local test
         import drv8833
+        self._orig = (drv8833.Pin, drv8833.PWM)
         drv8833.Pin = DummyPin
         drv8833.PWM = DummyPWM
         self.motor = DRV8833(2, 3, pwm=False)
         self.motor_pwm = DRV8833(2, 3, pwm=True)
+    def tearDown(self):
+        import drv8833
+        drv8833.Pin, drv8833.PWM = self._orig
     def test_forward(self):
         self.motor.forward()
         self.assertEqual(self.motor.in1.state, 1)
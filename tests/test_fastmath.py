@@ -0,0 +1,78 @@
+# Test for the fastmath approximations
+import math
+import unittest
+import fastmath
+from imu_gy91 import Madgwick, IMUSample
+from mag_gy273 import MagnetometerGY273
+from mock_machine import SimClock, Trajectory, sim_i2c
+
+
+class TestAtan2(unittest.TestCase):
+    def test_error_bound_full_circle(self):
+        for i in range(1, 3600):
+            t = -math.pi + 2.0 * math.pi * i / 3600
+            for r in (1e-3, 1.0, 1e4):
+                y, x = r * math.sin(t), r * math.cos(t)
+                self.assertLess(abs(fastmath.atan2(y, x) - math.atan2(y, x)), 1.2e-5)
+                self.assertLess(abs(fastmath.atan2_deg(y, x) - math.degrees(math.atan2(y, x))), 7e-4)
+
+    def test_axes_and_origin(self):
+        self.assertEqual(fastmath.atan2_deg(0.0, 1.0), 0.0)
+        self.assertAlmostEqual(fastmath.atan2_deg(1.0, 0.0), 90.0, places=3)
+        self.assertAlmostEqual(fastmath.atan2_deg(-1.0, 0.0), -90.0, places=3)
+        self.assertAlmostEqual(fastmath.atan2_deg(0.0, -1.0), 180.0, places=3)
+        self.assertEqual(fastmath.atan2(0.0, 0.0), 0.0)
+
+
+class TestAsin(unittest.TestCase):
+    def test_error_bound(self):
+        for i in range(2001):
+            x = -1.0 + i / 1000.0
+            self.assertLess(abs(fastmath.asin(x) - math.asin(x)), 7e-5)
+            self.assertLess(abs(fastmath.asin_deg(x) - math.degrees(math.asin(x))), 4e-3)
+
+    def test_clamped(self):
+        self.assertAlmostEqual(fastmath.asin_deg(1.0000001), 90.0, delta=4e-3)
+        self.assertAlmostEqual(fastmath.asin_deg(-1.5), -90.0, delta=4e-3)
+
+
+class TestInvSqrt(unittest.TestCase):
+    def test_relative_error(self):
+        for e in range(-60, 61):
+            x = 10.0 ** (e / 10.0)
+            self.assertLess(abs(fastmath.inv_sqrt(x) * math.sqrt(x) - 1.0), 5e-6)
+
+
+class TestCallSites(unittest.TestCase):
+    def test_madgwick_fast_matches_exact(self):
+        exact = Madgwick()
+        fast = Madgwick(fast_math=True)
+        a, b = IMUSample(), IMUSample()
+        for f in (exact, fast):
+            f.q0, f.q1, f.q2, f.q3 = 0.8, 0.3, -0.4, 0.33
+            f._integrate(f.q0, f.q1, f.q2, f.q3)
+        exact.euler_into(a)
+        fast.euler_into(b)
+        for name in ('roll', 'pitch', 'yaw'):
+            self.assertAlmostEqual(getattr(a, name), getattr(b, name), delta=4e-3)
+        for x, y in zip(exact.get_euler() + (exact.get_yaw(),), fast.get_euler() + (fast.get_yaw(),)):
+            self.assertAlmostEqual(x, y, delta=4e-3)
+        self.assertEqual(fast.sin_pitch, exact.sin_pitch)
+
+    def test_heading_fast_matches_exact(self):
+        clock = SimClock()
+        i2c = sim_i2c(Trajectory(), clock)
+        exact = MagnetometerGY273(i2c)
+        fast = MagnetometerGY273(i2c, fast_math=True)
+        for x, y in ((1, 1), (-3, 2), (-5, -7), (4, -1)):
+            self.assertAlmostEqual(exact.calculate_heading(x, y), fast.calculate_heading(x, y),
+                                   delta=7e-4)
+        clock.advance(0.006)
+        exact.update()
+        fast.x, fast.y, fast.z = exact.x, exact.y, exact.z
+        att = Madgwick()
+        self.assertAlmostEqual(exact.tilt_heading(att), fast.tilt_heading(att), delta=7e-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# Test for the biquad gyro filter bank
+import math
+import unittest
+from array import array
+from filters import FilterBank, lowpass_coeffs, notch_coeffs
+from imu_gy91 import IMUGY91, IMUSample
+from mock_machine import sim_i2c, SimClock, Trajectory
+
+FS = 1000.0
+
+
+def gain(bank, axis, f, n=2000):
+    """Steady-state amplitude of a unit sine at f Hz through one axis."""
+    bank.reset()
+    peak = 0.0
+    for i in range(n):
+        y = bank.update(axis, math.sin(2 * math.pi * f * i / FS))
+        if i >= n // 2:
+            peak = max(peak, abs(y))
+    return peak
+
+
+class TestCoefficients(unittest.TestCase):
+    def test_unity_dc_gain(self):
+        for b0, b1, b2, a1, a2 in (lowpass_coeffs(50.0, FS), notch_coeffs(150.0, FS)):
+            self.assertAlmostEqual((b0 + b1 + b2) / (1.0 + a1 + a2), 1.0)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            lowpass_coeffs(500.0, FS)
+        with self.assertRaises(ValueError):
+            notch_coeffs(0.0, FS)
+        with self.assertRaises(ValueError):
+            lowpass_coeffs(50.0, FS, q=0.0)
+
+
+class TestFilterBank(unittest.TestCase):
+    def test_lowpass_response(self):
+        bank = FilterBank(1)
+        bank.add_lowpass(50.0, FS)
+        self.assertAlmostEqual(gain(bank, 0, 5.0), 1.0, delta=0.01)
+        self.assertAlmostEqual(gain(bank, 0, 50.0), 0.7071, delta=0.01)
+        self.assertLess(gain(bank, 0, 300.0), 0.05)
+
+    def test_notch_response(self):
+        bank = FilterBank(1)
+        bank.add_notch(150.0, FS, q=3.0)
+        self.assertLess(gain(bank, 0, 150.0), 0.01)
+        self.assertAlmostEqual(gain(bank, 0, 20.0), 1.0, delta=0.02)
+        bank.set_notch(0, 200.0, FS)
+        self.assertLess(gain(bank, 0, 200.0), 0.01)
+
+    def test_per_axis_chains(self):
+        bank = FilterBank(3, max_stages=2)
+        self.assertEqual(bank.add_lowpass(40.0, FS), 0)
+        self.assertEqual(bank.add_notch(150.0, FS, axes=(2,)), 1)
+        self.assertEqual(list(bank.stages), [1, 1, 2])
+        self.assertGreater(gain(bank, 0, 150.0), 0.05)
+        self.assertLess(gain(bank, 2, 150.0), 0.01)
+        with self.assertRaises(ValueError):
+            bank.add_lowpass(40.0, FS)  # axis 2 is full
+        with self.assertRaises(ValueError):
+            bank.set_notch(1, 120.0, FS, axes=(0,))
+        bank.clear()
+        self.assertEqual(bank.update(1, 3.5), 3.5)
+
+    def test_batch_matches_single(self):
+        single = FilterBank(3)
+        batch = FilterBank(3)
+        for bank in (single, batch):
+            bank.add_lowpass(60.0, FS)
+            bank.add_notch(180.0, FS)
+        n = 40
+        data = array('f', [0.0] * (6 * n))
+        for i in range(n):
+            for a in range(3):
+                data[6 * i + a] = 9.0  # accel columns are left alone
+                data[6 * i + 3 + a] = math.sin(0.3 * i + a) * 100.0
+        want = [single.update(a, data[6 * i + 3 + a]) for i in range(n) for a in range(3)]
+        batch.process(data, n)
+        got = [data[6 * i + 3 + a] for i in range(n) for a in range(3)]
+        for g, w in zip(got, want):
+            self.assertAlmostEqual(g, w, places=3)
+        self.assertEqual(data[6 * (n - 1)], 9.0)
+
+
+class TestIMUGyroFilter(unittest.TestCase):
+    def test_sample_and_fifo_paths(self):
+        clock = SimClock()
+        imu = IMUGY91(sim_i2c(Trajectory(yaw_rate=math.radians(30.0)), clock))
+        imu.gyro_filter = FilterBank(3)
+        imu.gyro_filter.add_lowpass(20.0, FS)
+        s = IMUSample()
+        clock.advance(0.001)
+        imu.update_attitude(0.001, s)
+        self.assertLess(s.gz, 5.0)  # first sample is mostly held back by the filter
+        for _ in range(200):
+            clock.advance(0.001)
+            imu.update_attitude(0.001, s)
+        self.assertAlmostEqual(s.gz, 30.0, delta=1.0)
+        imu.enable_fifo()
+        clock.advance(0.0201)
+        n = imu.update_attitude_fifo(int(clock() * 1000000))
+        self.assertAlmostEqual(imu.fifo_data[6 * (n - 1) + 5], 30.0, delta=1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
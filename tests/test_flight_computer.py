@@ -12,6 +12,9 @@ class DummyI2C:
         if n == 3:
             return bytes([0, 0, 0])
         return bytes([0, 0] * (n // 2))
+    def readfrom_mem_into(self, addr, reg, buf):
+        for i in range(len(buf)):
+            buf[i] = 0
 class DummyUART:
     def any(self):
         return False
@@ -28,6 +31,150 @@ class TestFlightComputer(unittest.TestCase):
         heading = self.mag.calculate_heading(1, 1)
         self.assertIsInstance(imu_data, dict)
         self.assertIsInstance(heading, float)
+    def test_scheduler_rate_groups(self):
+        import flight_computer
+        clock = [0]
+        sched = flight_computer.build_scheduler(lambda: clock[0])
+        while clock[0] < 100000:  # 100 ms at 200 us resolution
+            sched.run_once()
+            clock[0] += 200
+        runs = {t.name: t.runs for t in sched.tasks}
+        self.assertEqual(runs['imu'], 50)
+        self.assertEqual(runs['mag'], 10)
+        self.assertEqual(runs['baro'], 5)
+        self.assertEqual(runs['gps'], 1)
+        self.assertEqual(runs['telemetry'], 1)
+
+    def test_telemetry_rotation_and_restart(self):
+        import asyncio
+        import os
+        import tempfile
+        import flight_computer as fc
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as d:
+            os.chdir(d)
+            try:
+                with open(fc.TELEMETRY_FILE, 'wb') as f:
+                    f.write(b'old')
+                sink = fc.open_telemetry()
+                sink.close()
+                with open(fc.TELEMETRY_PREV_FILE, 'rb') as f:
+                    self.assertEqual(f.read(), b'old')
+                self.assertEqual(os.path.getsize(fc.TELEMETRY_FILE), 0)
+            finally:
+                os.chdir(cwd)
+
+        async def run():
+            dead = asyncio.create_task(asyncio.sleep(0))
+            await dead
+            fc.telemetry_task = dead
+            restarts = fc.telemetry_restarts
+            fc.telemetry_step(0.1)
+            self.assertEqual(fc.telemetry_restarts, restarts + 1)
+            self.assertFalse(fc.telemetry_task.done())
+            fc.telemetry_task.cancel()
+        try:
+            asyncio.run(run())
+        finally:
+            fc.telemetry_task = None
+
+    def test_magcal_commit_deferred(self):
+        import os
+        import tempfile
+        import calibration
+        import flight_computer as fc
+
+        class Improved:
+            def update(self, x, y, z):
+                pass
+            def improved(self):
+                return True
+            def commit(self, cal, path, sensor):
+                self.path = path
+                cal.set_mag((1.0, 2.0, 3.0), (1.0, 1.0, 1.0), sensor)
+                return cal.mag_offset, cal.mag_scale
+
+        saved = (fc.magcal, fc.cal, fc.CALIBRATION_FILE)
+        fc.magcal = Improved()
+        fc.cal = calibration.Calibration()
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                fc.CALIBRATION_FILE = os.path.join(d, 'missing', 'cal.bin')
+                fc.mag.stale = False
+                fc.magcal_step(0.1)
+                self.assertIsNone(fc.magcal.path)  # no flash write in the rate group
+                self.assertTrue(fc.magcal_unsaved)
+                self.assertFalse(fc.save_magcal())  # OSError: reported, kept pending
+                self.assertTrue(fc.magcal_unsaved)
+                fc.CALIBRATION_FILE = os.path.join(d, 'cal.bin')
+                self.assertTrue(fc.save_magcal())
+                self.assertFalse(fc.magcal_unsaved)
+                self.assertTrue(calibration.load(fc.CALIBRATION_FILE).has_mag(
+                    calibration.CAL_MAG_QMC5883L))
+        finally:
+            fc.magcal, fc.cal, fc.CALIBRATION_FILE = saved
+            fc.magcal_unsaved = False
+            fc.mag.set_calibration((0.0, 0.0, 0.0), (1.0, 1.0, 1.0))
+
+    def test_baro_step_skips_zero_pressure(self):
+        import flight_computer as fc
+
+        class UncalibratedBMP:
+            temperature = 25.0
+            pressure = 0  # what BMP280 reports without calibration data
+            def poll(self):
+                return True
+
+        fake = UncalibratedBMP()
+        saved = (fc.imu.bmp, fc.baro_alt.ground, fc.state.alt)
+        fc.imu.bmp = fake
+        fc.baro_alt.ground = None
+        try:
+            fc.baro_step(0.02)
+            self.assertIsNone(fc.baro_alt.ground)
+            self.assertEqual(fc.state.alt, saved[2])
+            fake.pressure = 98000.0
+            fc.baro_step(0.02)
+            self.assertEqual(fc.baro_alt.ground, 98000.0)
+            self.assertEqual(fc.state.alt, 0.0)
+        finally:
+            fc.imu.bmp = saved[0]
+            if saved[1] is None:
+                fc.baro_alt.ground = None
+            else:
+                fc.baro_alt.set_ground(saved[1])
+
+    def test_gyro_calibration_survives_movement(self):
+        import os
+        import tempfile
+        import time
+        import calibration
+        import flight_computer as fc
+        from mock_machine import sim_i2c, Trajectory
+        # Real time drives the simulator, so the board rocks during the 2 ms waits
+        moving = IMUGY91(sim_i2c(Trajectory(roll_amp=0.5, freq=2.0), time.perf_counter))
+        saved = (fc.imu, fc.cal, fc.magcal, fc.CALIBRATION_FILE, fc.MAG_CALIBRATION_FILE,
+                 fc.GYRO_CAL_ATTEMPTS)
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                fc.imu = moving
+                fc.CALIBRATION_FILE = os.path.join(d, 'cal.bin')
+                fc.MAG_CALIBRATION_FILE = os.path.join(d, 'mag_cal.bin')
+                fc.GYRO_CAL_ATTEMPTS = 2
+                cal = fc.load_calibration()  # no cache: zero bias, no exception
+                self.assertFalse(cal.flags & calibration.CAL_GYRO)
+                self.assertFalse(os.path.exists(fc.CALIBRATION_FILE))
+                cached = calibration.Calibration()
+                cached.gyro_bias = (0.5, -0.5, 0.25)
+                cached.temp = -40.0  # far from now: stale, so it re-calibrates
+                cached.flags = calibration.CAL_GYRO
+                cached.save(fc.CALIBRATION_FILE)
+                cal = fc.load_calibration()
+                self.assertEqual(cal.gyro_bias, (0.5, -0.5, 0.25))
+                self.assertIs(moving.calibration, cal)
+        finally:
+            (fc.imu, fc.cal, fc.magcal, fc.CALIBRATION_FILE, fc.MAG_CALIBRATION_FILE,
+             fc.GYRO_CAL_ATTEMPTS) = saved
 
 if __name__ == "__main__":
     unittest.main()
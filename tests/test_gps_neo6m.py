@@ -1,6 +1,17 @@
 # Test for GPS NEO-6M module
+import asyncio
+import struct
 import unittest
-from gps_neo6m import GPSNEO6M
+import mock_machine
+from gps_neo6m import (GPSNEO6M, NMEAParser, NMEA_GSV, NMEA_VTG, UBXParser,
+                       ubx_frame, ubx_checksum)
+
+
+def nmea(body):
+    ck = 0
+    for c in body.encode():
+        ck ^= c
+    return b"$%s*%02X\r\n" % (body.encode(), ck)
 
 
 # Dummy UART for normal operation
@@ -30,6 +41,48 @@ class FailingUART:
     def read(self, n):
         raise RuntimeError("UART failure")
 
+# Dummy UART that delivers bursts through readinto() like machine.UART
+class BurstUART:
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+    def any(self):
+        return len(self.data)
+    def read(self, n):
+        raise AssertionError("read() should not be used when readinto() exists")
+    def readinto(self, buf, nbytes):
+        self.reads += 1
+        d, self.data = self.data[:nbytes], self.data[nbytes:]
+        buf[:len(d)] = d
+        return len(d)
+
+# Simulated UART replaying UBX frames and recording configuration writes
+class UBXReplayUART(BurstUART):
+    def __init__(self, data=b""):
+        super().__init__(data)
+        self.written = []
+        self.baudrate = 9600
+    def write(self, buf):
+        self.written.append(bytes(buf))
+    def init(self, baudrate):
+        self.baudrate = baudrate
+
+
+def posllh(lat, lon, h_msl_mm):
+    return ubx_frame(0x01, 0x02, struct.pack('<IiiiiII', 1000, int(lon * 1e7), int(lat * 1e7),
+                                             h_msl_mm + 50000, h_msl_mm, 1500, 2500))
+
+def velned(vn, ve, vd, g_speed, heading):
+    return ubx_frame(0x01, 0x12, struct.pack('<IiiiIIiII', 1000, vn, ve, vd, g_speed, g_speed,
+                                             heading, 10, 100))
+
+def nav_sol(gps_fix, flags, num_sv, p_dop):
+    payload = bytearray(52)
+    struct.pack_into('<IihBB', payload, 0, 1000, 0, 1700, gps_fix, flags)
+    struct.pack_into('<H', payload, 44, p_dop)
+    payload[47] = num_sv
+    return ubx_frame(0x01, 0x06, payload)
+
 
 class TestGPSNEO6M(unittest.TestCase):
     def setUp(self):
@@ -66,6 +119,235 @@ class TestGPSNEO6M(unittest.TestCase):
         self.assertIsNone(result)
         self.assertTrue(any("GPS read error" in log for log in logs))
         self.assertTrue(any("No valid location" in log for log in logs))
+    def test_read_sentence_bulk(self):
+        uart = BurstUART(b"$GPGGA,a*00\r\n$GPVTG,b*00\r\npartial")
+        gps = GPSNEO6M(uart)
+        self.assertEqual(list(gps.sentences()), ["$GPGGA,a*00", "$GPVTG,b*00"])
+        self.assertEqual(uart.reads, 1)
+        uart.data = b",rest\n"
+        self.assertEqual(gps.read_sentence(), "partial,rest")
+
+    def test_read_sentence_wraps_ring(self):
+        gps = GPSNEO6M(BurstUART(b""), rx_size=16)
+        out = []
+        for i in range(5):
+            gps.uart.data = b"$GPXX,%d\n" % i
+            out.append(gps.read_sentence())
+        self.assertEqual(out, ["$GPXX,%d" % i for i in range(5)])
+        self.assertEqual(gps.rx_overflows, 0)
+
+    def test_read_sentence_overflow(self):
+        gps = GPSNEO6M(BurstUART(b"x" * 40 + b"$GPXX\n"), rx_size=16)
+        self.assertEqual(gps.read_sentence(), "$GPXX")
+        self.assertGreater(gps.rx_overflows, 0)
+        gps.uart.data = b"$GPYY\n"
+        self.assertEqual(gps.read_sentence(), "$GPYY")
+
+    def test_backlog_larger_than_ring(self):
+        gga = b"$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n"
+        gps = GPSNEO6M(BurstUART(gga * 10))
+        self.assertGreater(len(gga) * 10, len(gps._rx))
+        self.assertEqual(len(list(gps.sentences())), 10)
+        self.assertEqual(gps.rx_overflows, 0)
+        gps = GPSNEO6M(BurstUART(gga * 10))
+        self.assertTrue(gps.poll())
+        self.assertEqual(gps.parser.sentences, 10)
+        self.assertEqual(gps.rx_overflows, 0)
+
+    def test_parser_gga_checksum(self):
+        p = NMEAParser()
+        good = b"$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n"
+        self.assertEqual(p.feed(good), 1)
+        fix = p.fix
+        self.assertTrue(fix.valid)
+        self.assertAlmostEqual(fix.lat, 48 + 7.038 / 60)
+        self.assertAlmostEqual(fix.lon, 11 + 31.0 / 60)
+        self.assertAlmostEqual(fix.alt, 545.4)
+        self.assertEqual(fix.satellites, 8)
+        self.assertAlmostEqual(fix.hdop, 0.9)
+        bad = good.replace(b"545.4", b"546.4")
+        self.assertEqual(p.feed(bad), 0)
+        self.assertEqual(p.checksum_errors, 1)
+        self.assertAlmostEqual(fix.alt, 545.4)
+
+    def test_parser_split_chunks_and_talkers(self):
+        p = NMEAParser()
+        data = (nmea("GNRMC,081836,A,3751.65,S,14507.36,W,10.0,360.0,130998,011.3,E")
+                + nmea("GPVTG,054.7,T,034.4,M,005.5,N,010.2,K")
+                + nmea("GNGSA,A,3,04,05,,09,12,,,24,,,,,2.5,1.3,2.1")
+                + nmea("GPGSV,2,1,08,01,40,083,46,02,17,308,41,12,07,344,39,14,22,228,45")
+                + nmea("GPXYZ,ignored"))
+        applied = 0
+        for i in range(0, len(data), 7):
+            applied += p.feed(data[i:i + 7])
+        self.assertEqual(applied, 4)
+        self.assertEqual(p.sentences, 5)
+        fix = p.fix
+        self.assertAlmostEqual(fix.lat, -(37 + 51.65 / 60))
+        self.assertAlmostEqual(fix.lon, -(145 + 7.36 / 60))
+        self.assertEqual(fix.date, 130998)
+        self.assertAlmostEqual(fix.course, 54.7)
+        self.assertAlmostEqual(fix.speed, 10.2 / 3.6)
+        self.assertEqual(fix.fix_type, 3)
+        self.assertAlmostEqual(fix.pdop, 2.5)
+        self.assertAlmostEqual(fix.vdop, 2.1)
+        self.assertEqual(fix.satellites_in_view, 8)
+        self.assertEqual(p.last_type, NMEA_GSV)
+
+    def test_parser_no_fix(self):
+        p = NMEAParser()
+        p.feed(nmea("GPGGA,123519,,,,,0,00,,,M,,M,,"))
+        self.assertFalse(p.fix.valid)
+        self.assertIsNone(p.fix.lat)
+        p.feed(nmea("GPVTG,,T,,M,,N,,K"))
+        self.assertEqual(p.last_type, NMEA_VTG)
+        self.assertIsNone(p.fix.course)
+
+    def test_parser_abort_clears_fields(self):
+        p = NMEAParser()
+        p.feed(b"$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M*00\r\n")
+        self.assertEqual(p.checksum_errors, 1)
+        self.assertEqual(p._vals, [None] * len(p._vals))
+        p.feed(b"$GPGGA,123519,4807.038,N,01131.000,E,1,08$GPVTG")
+        self.assertEqual(p._vals, [None] * len(p._vals))
+        self.assertEqual(p.positions, 0)
+
+    def test_ubx_frame_checksum(self):
+        # CFG-RATE 200 ms example from the u-blox protocol spec
+        frame = ubx_frame(0x06, 0x08, struct.pack('<HHH', 200, 1, 1))
+        self.assertEqual(bytes(frame[:6]), b"\xb5\x62\x06\x08\x06\x00")
+        self.assertEqual(tuple(frame[-2:]), (0xDE, 0x6A))
+        self.assertEqual(ubx_checksum(frame, 2, len(frame) - 2), tuple(frame[-2:]))
+
+    def test_ubx_parser_nav_frames(self):
+        p = UBXParser()
+        data = (b"\x00garbage\xb5" + nav_sol(3, 0x0D, 9, 145) + posllh(51.5, -0.12, 35250)
+                + velned(300, -400, 10, 500, 9000000))
+        applied = 0
+        for i in range(0, len(data), 5):
+            applied += p.feed(data[i:i + 5])
+        self.assertEqual(applied, 3)
+        fix = p.fix
+        self.assertTrue(fix.valid)
+        self.assertEqual(fix.fix_type, 3)
+        self.assertEqual(fix.satellites, 9)
+        self.assertAlmostEqual(fix.pdop, 1.45)
+        self.assertAlmostEqual(fix.lat, 51.5, places=6)
+        self.assertAlmostEqual(fix.lon, -0.12, places=6)
+        self.assertAlmostEqual(fix.alt, 35.25)
+        self.assertAlmostEqual(fix.h_acc, 1.5)
+        self.assertAlmostEqual(fix.vel_e, -4.0)
+        self.assertAlmostEqual(fix.speed, 5.0)
+        self.assertAlmostEqual(fix.course, 90.0)
+
+    def test_ubx_parser_rejects_bad_checksum(self):
+        p = UBXParser()
+        frame = bytearray(posllh(10.0, 20.0, 0))
+        frame[10] ^= 0xFF
+        self.assertEqual(p.feed(frame), 0)
+        self.assertEqual(p.checksum_errors, 1)
+        self.assertIsNone(p.fix.lat)
+        p.feed(ubx_frame(0x05, 0x01, b"\x06\x08"))
+        self.assertEqual(p.last_ack, (0x06, 0x08, True))
+
+    def test_enable_ubx_and_poll(self):
+        uart = UBXReplayUART()
+        gps = GPSNEO6M(uart)
+        gps.enable_ubx(baudrate=115200, rate_ms=100)
+        self.assertEqual(uart.baudrate, 115200)
+        classes = [(w[2], w[3]) for w in uart.written]
+        self.assertEqual(classes[-1], (0x06, 0x00))  # CFG-PRT last
+        self.assertIn((0x06, 0x08), classes)
+        rate = [w for w in uart.written if w[3] == 0x08][0]
+        self.assertEqual(struct.unpack_from('<H', rate, 6)[0], 100)
+        uart.data = bytes(nav_sol(3, 0x01, 7, 200) + posllh(-33.9, 151.2, 12000))
+        self.assertTrue(gps.poll())
+        self.assertAlmostEqual(gps.latest().lat, -33.9, places=6)
+
+    def test_enable_ubx_cfg_frames_on_mock_uart(self):
+        uart = mock_machine.UART(1, baudrate=9600)
+        GPSNEO6M(uart).enable_ubx(baudrate=38400, rate_ms=200)
+        self.assertEqual(uart.baudrate, 38400)
+        data = bytes(uart.written)
+        frames = []
+        i = 0
+        while i < len(data):
+            self.assertEqual(data[i:i + 2], b"\xb5\x62")
+            n = struct.unpack_from('<H', data, i + 4)[0]
+            self.assertEqual(ubx_checksum(data, i + 2, i + 6 + n), tuple(data[i + 6 + n:i + 8 + n]))
+            frames.append((data[i + 2], data[i + 3], data[i + 6:i + 6 + n]))
+            i += 8 + n
+        msgs = [bytes(p) for c, m, p in frames if (c, m) == (0x06, 0x01)]
+        self.assertEqual(msgs[:3], [b"\x01\x02\x01", b"\x01\x12\x01", b"\x01\x06\x01"])
+        self.assertEqual(msgs[3:], [bytes((0xF0, k, 0)) for k in range(6)])
+        rate = [p for c, m, p in frames if (c, m) == (0x06, 0x08)]
+        self.assertEqual(struct.unpack('<HHH', rate[0]), (200, 1, 1))
+        cls, msg_id, prt = frames[-1]
+        self.assertEqual((cls, msg_id), (0x06, 0x00))
+        self.assertEqual(struct.unpack_from('<BBHII', prt)[0], 1)
+        self.assertEqual(struct.unpack_from('<I', prt, 8)[0], 38400)
+
+    def test_poll_and_latest(self):
+        gps = GPSNEO6M(DummyUART())
+        self.assertIsNone(gps.latest())
+        self.assertIsNone(gps.fix_age())
+        self.assertTrue(gps.poll())
+        fix = gps.latest()
+        self.assertAlmostEqual(fix.lat, 48.1173)
+        self.assertGreaterEqual(gps.fix_age(), 0.0)
+        # Nothing left on the UART: poll returns immediately, fix is kept
+        self.assertFalse(gps.poll())
+        self.assertIs(gps.latest(), fix)
+
+    def test_fix_time_only_on_position(self):
+        uart = BurstUART(b"")
+        gps = GPSNEO6M(uart)
+        uart.data = nmea("GPGSV,2,1,08,01,40,083,46")
+        self.assertFalse(gps.poll())
+        self.assertIsNone(gps.latest())
+        uart.data = nmea("GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,")
+        self.assertTrue(gps.poll())
+        stamp = gps._fix_time
+        uart.data = (nmea("GPGSV,2,1,08,01,40,083,46") + nmea("GPGSA,A,3,04,05,,,,,,,,,,,2.5,1.3,2.1")
+                     + nmea("GPVTG,054.7,T,034.4,M,005.5,N,010.2,K"))
+        self.assertFalse(gps.poll())
+        self.assertEqual(gps._fix_time, stamp)
+
+    def test_fix_age_across_tick_wrap(self):
+        import gps_neo6m
+        period = 1 << 30  # MicroPython ticks_ms wraps here
+        now = [period - 500]
+
+        def ticks_ms():
+            return now[0] % period
+
+        def ticks_diff(a, b):
+            return ((a - b + period // 2) % period) - period // 2
+
+        saved = (gps_neo6m._ticks_ms, gps_neo6m._ticks_diff)
+        gps_neo6m._ticks_ms, gps_neo6m._ticks_diff = ticks_ms, ticks_diff
+        try:
+            gps = GPSNEO6M(DummyUART())
+            self.assertTrue(gps.poll())
+            now[0] += 1500  # past the wrap
+            self.assertAlmostEqual(gps.fix_age(), 1.5)
+        finally:
+            gps_neo6m._ticks_ms, gps_neo6m._ticks_diff = saved
+
+    def test_poll_uart_failure(self):
+        logs = []
+        gps = GPSNEO6M(FailingUART())
+        self.assertFalse(gps.poll(logger=logs.append))
+        self.assertTrue(any("GPS read error" in log for log in logs))
+
+    def test_run_background_task(self):
+        gps = GPSNEO6M(DummyUART())
+        async def runner():
+            task = asyncio.create_task(gps.run(interval=0.001))
+            await asyncio.sleep(0.01)
+            task.cancel()
+        asyncio.run(runner())
+        self.assertIsNotNone(gps.latest())
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,9 @@
 # Test for IMU GY-91 module
+import math
+import struct
 import unittest
-from imu_gy91 import IMUGY91
+from imu_gy91 import IMUGY91, IMUSample, MPU_ADDR, Madgwick
+from mock_machine import I2C, earth_to_body, sim_i2c, SimClock, Trajectory
 
 class DummyI2C:
     def writeto_mem(self, *args, **kwargs):
@@ -10,6 +13,23 @@ class DummyI2C:
         if n == 3:
             return bytes([0, 0, 0])
         return bytes([0, 0] * (n // 2))
+    def readfrom_mem_into(self, addr, reg, buf):
+        for i in range(len(buf)):
+            buf[i] = 0
+
+class BurstI2C(DummyI2C):
+    """Serves a fixed MPU register image from 0x3B and counts MPU transactions."""
+    def __init__(self, regs):
+        self.regs = regs
+        self.reads = 0
+    def readfrom_mem_into(self, addr, reg, buf):
+        if addr == MPU_ADDR:
+            self.reads += 1
+            start = reg - 0x3B
+            buf[:] = self.regs[start:start + len(buf)]
+        else:
+            for i in range(len(buf)):
+                buf[i] = 0
 
 class TestIMUGY91(unittest.TestCase):
     def setUp(self):
@@ -26,6 +46,290 @@ class TestIMUGY91(unittest.TestCase):
     def test_orientation(self):
         pitch, roll = self.imu.get_orientation(0.01)
         self.assertIsInstance(pitch, float)
+    def test_read_burst(self):
+        # 1 g on z, +250 deg/s on x, raw temp 0 -> 21 C
+        regs = struct.pack('>7h', 0, 0, 16384, 0, 32750, 0, -131)
+        i2c = BurstI2C(regs)
+        imu = IMUGY91(i2c)
+        ax, ay, az, gx, gy, gz, temp = imu.read_burst()
+        self.assertEqual(i2c.reads, 1)
+        self.assertAlmostEqual(az, 1.0)
+        self.assertAlmostEqual(gx, 32750 / 131.0)
+        self.assertAlmostEqual(gz, -1.0)
+        self.assertAlmostEqual(temp, 21.0)
+    def test_read_all_single_mpu_transaction(self):
+        regs = struct.pack('>7h', 0, 0, 16384, 0, 0, 0, 0)
+        i2c = BurstI2C(regs)
+        imu = IMUGY91(i2c)
+        data = imu.read_all(0.01)
+        self.assertAlmostEqual(data['az'], 1.0)
+        self.assertEqual(i2c.reads, 1)
+
+class TestIMUSample(unittest.TestCase):
+    def test_read_all_in_place(self):
+        clock = SimClock()
+        imu = IMUGY91(sim_i2c(Trajectory(roll_amp=0.4, freq=0.25, alt=30.0, climb_rate=5.0),
+                              clock),
+                      clock=lambda: int(clock() * 1000000))
+        imu.bmp.configure(standby_ms=62.5)
+        sample = IMUSample()
+        for _ in range(200):
+            clock.advance(0.005)
+            self.assertIs(imu.read_all(0.005, sample), sample)
+        self.assertAlmostEqual(sample.ay, math.sin(0.4), delta=0.02)
+        # Relative to the first conversion (~30 m ASL); climbed 5 m in 1 s since
+        self.assertAlmostEqual(sample.alt, 5.0, delta=1.0)
+        self.assertAlmostEqual(imu.pressure_to_altitude(imu.baro_alt.ground), 30.0, delta=1.0)
+        self.assertAlmostEqual(sample.temp, 25.0, delta=0.1)
+        self.assertGreater(sample.roll, 15.0)
+        data = imu.read_all(0.0)
+        self.assertEqual(sorted(data), sorted(('ax', 'ay', 'az', 'gx', 'gy', 'gz', 'temp',
+                                               'press', 'alt', 'pitch', 'roll')))
+        self.assertAlmostEqual(data['roll'], sample.roll, delta=0.5)
+
+    def test_matches_tuple_path(self):
+        regs = struct.pack('>7h', 100, -200, 16000, 0, 131, -262, 393)
+        imu = IMUGY91(BurstI2C(regs))
+        sample = imu.update_attitude(0.01, IMUSample())
+        ax, ay, az, gx, gy, gz, _ = imu.read_burst()
+        self.assertEqual((sample.ax, sample.ay, sample.az, sample.gx, sample.gy, sample.gz),
+                         (ax, ay, az, gx, gy, gz))
+
+    def test_gps_and_slots(self):
+        sample = IMUSample()
+        self.assertTrue(math.isnan(sample.lat))
+        self.assertFalse(sample.gps_valid)
+        from gps_neo6m import GPSFix
+        fix = GPSFix()
+        fix.lat, fix.lon, fix.alt, fix.valid = 52.1, -1.2, 80.0, True
+        sample.set_gps(fix)
+        self.assertEqual((sample.lat, sample.lon, sample.alt_gps, sample.gps_valid),
+                         (52.1, -1.2, 80.0, True))
+        fix.valid = False  # lost: position kept, flagged invalid
+        sample.set_gps(fix)
+        self.assertEqual((sample.lat, sample.gps_valid), (52.1, False))
+        fix = GPSFix()
+        fix.valid = True  # no position yet
+        sample.set_gps(fix)
+        self.assertTrue(math.isnan(sample.lat))
+        self.assertFalse(sample.gps_valid)
+        with self.assertRaises(AttributeError):
+            sample.extra = 1
+        self.assertEqual(len(sample.as_dict()), len(IMUSample.__slots__))
+
+
+class TestNineDof(unittest.TestCase):
+    def test_single_burst_marg(self):
+        clock = SimClock()
+        i2c = sim_i2c(Trajectory(yaw=math.radians(40.0)), clock)
+        imu = IMUGY91(i2c, mag=True)
+        reads = []
+        orig = i2c.readfrom_mem_into
+        def counting(addr, reg, buf):
+            reads.append((addr, reg, len(buf)))
+            orig(addr, reg, buf)
+        i2c.readfrom_mem_into = counting
+        clock.advance(0.02)
+        sample = imu.read_burst9()
+        self.assertEqual(reads, [(MPU_ADDR, 0x3B, 21)])
+        ax, ay, az, gx, gy, gz, temp, mx, my, mz = sample
+        self.assertAlmostEqual(az, 1.0, delta=0.02)
+        # Default ASA (176, 177, 165) is folded into the scale
+        self.assertAlmostEqual(mx, 20.0 * math.cos(math.radians(40.0)), delta=0.5)
+        self.assertAlmostEqual(my, -20.0 * math.sin(math.radians(40.0)), delta=0.5)
+        self.assertAlmostEqual(mz, -45.0, delta=0.5)
+        imu.madgwick.beta = 0.5  # fast initial alignment
+        for _ in range(1500):
+            clock.advance(0.002)
+            data = imu.read_all(0.002)
+        self.assertAlmostEqual(data['yaw'], 40.0, delta=1.0)
+        self.assertIn('mz', data)
+
+    def test_overflow_holds_last_field(self):
+        clock = SimClock()
+        i2c = sim_i2c(Trajectory(), clock)
+        imu = IMUGY91(i2c, mag=True)
+        clock.advance(0.02)
+        mx = imu.read_burst9()[7]
+        i2c.devices[MPU_ADDR].aux.hard_iron = (60.0, 0.0, 0.0)
+        clock.advance(0.02)
+        self.assertEqual(imu.read_burst9()[7], mx)
+        self.assertEqual(imu.mag_overflows, 1)
+
+    def test_missing_magnetometer(self):
+        with self.assertRaises(OSError):
+            IMUGY91(I2C(), mag=True)  # MST_STATUS never reports SLV4_DONE
+
+
+class TestFifo(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        self.i2c = sim_i2c(Trajectory(roll_amp=0.3, freq=1.0), self.clock)
+        self.imu = IMUGY91(self.i2c)
+        self.imu.enable_fifo(rate_div=0)
+
+    def now(self):
+        return int(self.clock() * 1000000)
+
+    def test_drain_and_timestamps(self):
+        self.clock.advance(0.0205)
+        n = self.imu.read_fifo(self.now())
+        self.assertEqual(n, 20)
+        ts = self.imu.fifo_t
+        self.assertTrue(all(ts[i + 1] - ts[i] == 1000 for i in range(n - 1)))
+        self.assertLessEqual(self.now() - ts[n - 1], 1000)
+        last = ts[n - 1]
+        # A late drain continues the same time base
+        self.clock.advance(0.0153)
+        n = self.imu.read_fifo(self.now())
+        self.assertEqual(n, 15)
+        self.assertEqual(ts[0], last + 1000)
+        self.assertEqual(self.imu.fifo_overflows, 0)
+
+    def test_batch_matches_trajectory(self):
+        traj = self.i2c.devices[MPU_ADDR].source
+        total = 0
+        for _ in range(50):  # 1 kHz sensor, 50 Hz loop
+            self.clock.advance(0.02)
+            total += self.imu.update_attitude_fifo(self.now())
+        self.assertIn(total, (999, 1000))
+        pitch, roll = self.imu.madgwick.get_euler()
+        self.assertAlmostEqual(roll, math.degrees(traj.state(self.clock()).roll), delta=2.0)
+        self.assertAlmostEqual(pitch, 0.0, delta=1.0)
+
+    def test_overflow_resets(self):
+        self.clock.advance(0.1)
+        n = self.imu.read_fifo(self.now())
+        self.assertEqual(n, 42)
+        self.assertEqual(self.imu.fifo_overflows, 1)
+        self.clock.advance(0.005)
+        self.assertEqual(self.imu.read_fifo(self.now()), 5)
+
+    def test_mag_frames(self):
+        clock = SimClock()
+        imu = IMUGY91(sim_i2c(Trajectory(), clock), mag=True)
+        imu.enable_fifo(rate_div=1)  # 500 Hz, 19-byte frames
+        clock.advance(0.0301)
+        self.assertEqual(imu.read_fifo(), 15)
+        self.assertAlmostEqual(imu.fifo_data[2], 1.0, delta=0.02)
+        self.assertAlmostEqual(imu.mx, 20.0, delta=1.0)
+
+    def test_invalid_config(self):
+        with self.assertRaises(ValueError):
+            self.imu.enable_fifo(dlpf=0)
+
+
+class TestConfigure(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        self.i2c = sim_i2c(Trajectory(yaw_rate=math.radians(200.0)), self.clock)
+        self.imu = IMUGY91(self.i2c)
+        self.mpu = self.i2c.devices[MPU_ADDR]
+
+    def test_ranges_rescale(self):
+        self.imu.configure(accel_range=8, gyro_range=1000)
+        self.assertEqual(self.mpu.regs[0x1B], 0x10)
+        self.assertEqual(self.mpu.regs[0x1C], 0x10)
+        self.assertEqual(self.imu.gyro_lsb, 32.8)
+        self.clock.advance(0.01)
+        ax, ay, az, gx, gy, gz, _ = self.imu.read_burst()
+        self.assertAlmostEqual(az, 1.0, delta=0.02)
+        self.assertAlmostEqual(gz, 200.0, delta=1.0)
+
+    def test_rate_and_filter(self):
+        self.imu.configure(dlpf=3, rate_div=4)
+        self.assertEqual(self.mpu.regs[0x1A] & 0x07, 3)
+        self.assertEqual(self.mpu.regs[0x19], 4)
+        self.assertEqual(self.mpu.regs[0x1D], 3)
+        self.assertEqual(self.imu.sample_period_us, 5000)
+        self.assertEqual((self.imu.bandwidth, self.imu.delay_ms), (41, 5.9))
+        self.imu.configure(dlpf=0)
+        self.assertEqual(self.imu.sample_rate, 8000)
+
+    def test_fifo_follows_rate(self):
+        self.imu.enable_fifo(rate_div=1)
+        self.assertEqual(self.imu.fifo_period_us, 2000)
+        self.imu.configure(dlpf=3, rate_div=3)
+        self.assertEqual(self.imu.fifo_period_us, 4000)
+        self.clock.advance(0.0401)
+        self.assertEqual(self.imu.read_fifo(int(self.clock() * 1000000)), 10)
+
+    def test_fifo_keeps_configuration(self):
+        self.imu.configure(accel_range=8, gyro_range=1000, dlpf=2, accel_dlpf=4)
+        self.imu.enable_fifo(rate_div=1)
+        self.assertEqual((self.imu.accel_range, self.imu.gyro_range, self.imu.dlpf,
+                          self.imu.accel_dlpf, self.imu.rate_div), (8, 1000, 2, 4, 1))
+        for dlpf in (0, 7):
+            with self.assertRaises(ValueError):
+                self.imu.configure(dlpf=dlpf)
+        self.assertEqual(self.imu.fifo_period_us, 2000)
+
+    def test_invalid(self):
+        for kwargs in ({'accel_range': 3}, {'gyro_range': 300}, {'dlpf': 8},
+                       {'rate_div': 256}, {'accel_dlpf': -1},
+                       {'dlpf': 7, 'rate_div': 1},   # divider needs the 1 kHz rate
+                       {'dlpf': 1, 'rate_div': 4}):  # 184 Hz filter at 200 Hz aliases
+            with self.assertRaises(ValueError, msg=kwargs):
+                self.imu.configure(**kwargs)
+
+
+class TestMadgwick(unittest.TestCase):
+    def test_gyro_integration(self):
+        f = Madgwick()
+        for _ in range(100):
+            f.update(0.0, 0.0, 90.0, 0.0, 0.0, 0.0, 0.01)  # no accel: gyro only
+        self.assertAlmostEqual(f.get_yaw(), 90.0, delta=0.01)
+
+    def test_accel_correction_converges(self):
+        f = Madgwick(beta=0.1)
+        roll = math.radians(30)
+        for _ in range(1000):
+            f.update(0.0, 0.0, 0.0, 0.0, math.sin(roll), math.cos(roll), 0.01)
+        pitch, r = f.get_euler()
+        self.assertAlmostEqual(r, 30.0, delta=0.1)
+        self.assertAlmostEqual(pitch, 0.0, delta=0.1)
+
+    def test_beta_bounds_gyro_bias_drift(self):
+        f = Madgwick(beta=0.1)
+        for _ in range(3000):
+            f.update(1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.01)  # 1 deg/s roll bias
+        pitch, roll = f.get_euler()
+        self.assertLess(abs(roll), 5.0)  # pure integration would give 30 deg
+
+    def test_marg_yaw_converges(self):
+        f = Madgwick(beta=0.5)
+        yaw, pitch = math.radians(40), math.radians(-10)
+        ax, ay, az = earth_to_body(0.0, pitch, yaw, 0.0, 0.0, 1.0)
+        mx, my, mz = earth_to_body(0.0, pitch, yaw, 0.2, 0.0, -0.45)
+        for _ in range(2000):
+            f.update_marg(0.0, 0.0, 0.0, ax, ay, az, mx, my, mz, 0.01)
+        p, r = f.get_euler()
+        self.assertAlmostEqual(f.get_yaw(), 40.0, delta=0.2)
+        self.assertAlmostEqual(p, -10.0, delta=0.2)
+        self.assertAlmostEqual(r, 0.0, delta=0.2)
+
+    def test_tilt_sin_cos(self):
+        f = Madgwick()
+        roll, pitch = math.radians(30), math.radians(-50)
+        # q for R = Ry(pitch) Rx(roll)
+        cr, sr = math.cos(roll / 2), math.sin(roll / 2)
+        cp, sp = math.cos(pitch / 2), math.sin(pitch / 2)
+        f.q0, f.q1, f.q2, f.q3 = cp * cr, cp * sr, sp * cr, -sp * sr
+        f.update_tilt()
+        self.assertAlmostEqual(f.sin_roll, math.sin(roll))
+        self.assertAlmostEqual(f.cos_roll, math.cos(roll))
+        self.assertAlmostEqual(f.sin_pitch, math.sin(pitch))
+        self.assertAlmostEqual(f.cos_pitch, math.cos(pitch))
+        s = IMUSample()
+        f.euler_into(s)
+        self.assertAlmostEqual(s.roll, 30.0)
+        self.assertAlmostEqual(s.pitch, -50.0)
+
+    def test_slots(self):
+        f = Madgwick()
+        with self.assertRaises(AttributeError):
+            f.extra = 1
+        self.assertEqual(f.q, (1.0, 0.0, 0.0, 0.0))
 
 if __name__ == "__main__":
     unittest.main()
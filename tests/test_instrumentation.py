@@ -0,0 +1,60 @@
+# Test for loop timing instrumentation
+import unittest
+from instrumentation import LoopStats, TaskStats, _bucket
+from scheduler import Scheduler
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_bucket(self):
+        self.assertEqual(_bucket(0), 0)
+        self.assertEqual(_bucket(1), 1)
+        self.assertEqual(_bucket(3), 2)
+        self.assertEqual(_bucket(1000), 10)
+        self.assertEqual(_bucket(1 << 30), 15)
+
+    def test_task_stats_record(self):
+        st = TaskStats('imu', 1000)
+        st.record(0, 0, 200)
+        st.record(1100, 100, 300)
+        st.record(2000, 0, 1500, missed=1)
+        self.assertEqual(st.count, 3)
+        self.assertEqual(st.exec_max, 1500)
+        self.assertEqual(st.late_max, 100)
+        self.assertEqual(st.jitter_max, 100)
+        self.assertEqual(st.overruns, 1)
+        self.assertEqual(st.missed, 1)
+        self.assertAlmostEqual(st.exec_avg(), 2000 / 3)
+        self.assertEqual(sum(st.exec_hist), 3)
+        self.assertEqual(sum(st.jitter_hist), 2)
+        st.reset()
+        self.assertEqual(st.count, 0)
+        self.assertEqual(sum(st.exec_hist), 0)
+
+    def test_scheduler_integration(self):
+        clock = [0]
+        stats = LoopStats()
+        sched = Scheduler(lambda: clock[0], stats)
+        def work(dt):
+            clock[0] += 250  # each run takes 250 us
+        sched.add('imu', 1000, work)
+        while clock[0] < 10000:
+            sched.run_once()
+            clock[0] += 50
+        st = stats.tasks['imu']
+        self.assertEqual(st.count, sched.tasks[0].runs)
+        self.assertEqual(st.exec_max, 250)
+        self.assertEqual(st.overruns, 0)
+        lines = []
+        stats.dump(lines.append)
+        self.assertTrue(lines[1].startswith('imu,'))
+
+    def test_disabled(self):
+        clock = [0]
+        stats = LoopStats(enabled=False)
+        sched = Scheduler(lambda: clock[0], stats)
+        sched.add('imu', 1000, lambda dt: None)
+        sched.run_once()
+        self.assertEqual(stats.tasks['imu'].count, 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,19 @@
 # Test for Magnetometer GY-273 module
+import math
 import unittest
+from imu_gy91 import IMUGY91, IMUSample
 from mag_gy273 import MagnetometerGY273
+from mock_machine import (I2C, SimClock, SimQMC5883L, Trajectory, sim_i2c, earth_to_body,
+                          QMC5883L_ADDR)
 
 class DummyI2C:
     def writeto_mem(self, *args, **kwargs):
         pass
     def readfrom_mem(self, addr, reg, n):
         return bytes([0, 0, 0, 0, 0, 0])
+    def readfrom_mem_into(self, addr, reg, buf):
+        for i in range(len(buf)):
+            buf[i] = 0
 
 class TestMagnetometerGY273(unittest.TestCase):
     def setUp(self):
@@ -18,5 +25,103 @@ class TestMagnetometerGY273(unittest.TestCase):
         heading = self.mag.calculate_heading(1, 1)
         self.assertIsInstance(heading, float)
 
+class CountingI2C(I2C):
+    def __init__(self):
+        super().__init__()
+        self.reads = []
+    def readfrom_mem_into(self, addr, reg, buf):
+        self.reads.append((reg, len(buf)))
+        super().readfrom_mem_into(addr, reg, buf)
+
+class TestDataReady(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        self.i2c = CountingI2C()
+        self.sim = SimQMC5883L(Trajectory(yaw=math.radians(-30)), self.clock, noise=0.0)
+        self.i2c.attach(self.sim)
+        self.mag = MagnetometerGY273(self.i2c)
+
+    def test_gated_on_drdy(self):
+        self.clock.advance(0.006)
+        x, y, z = self.mag.read_raw()
+        self.assertFalse(self.mag.stale)
+        self.assertAlmostEqual(x, 0.2 * 3000 * math.cos(math.radians(30)), delta=1)
+        self.assertEqual(self.i2c.reads, [(0x06, 1), (0x00, 6)])
+        self.clock.advance(0.001)  # same 200 Hz period
+        self.assertEqual(self.mag.read_raw(), (x, y, z))
+        self.assertTrue(self.mag.stale)
+        self.assertEqual(self.i2c.reads[2:], [(0x06, 1)])  # status only
+        self.clock.advance(0.004)
+        self.assertTrue(self.mag.update())
+
+    def test_overrun_counted(self):
+        self.clock.advance(0.0126)  # two samples, the first never read
+        self.assertTrue(self.mag.update())
+        self.assertEqual(self.mag.overruns, 1)
+        self.clock.advance(0.005)
+        self.assertTrue(self.mag.update())
+        self.assertEqual(self.mag.overruns, 1)
+
+    def test_overflow_keeps_last_sample(self):
+        self.clock.advance(0.006)
+        self.mag.update()
+        good = (self.mag.x, self.mag.y, self.mag.z)
+        self.sim.field = (15.0, 0.0, 0.0)  # beyond the 8 G range
+        self.clock.advance(0.005)
+        self.assertFalse(self.mag.update())
+        self.assertTrue(self.mag.stale)
+        self.assertEqual(self.mag.overflows, 1)
+        self.assertEqual((self.mag.x, self.mag.y, self.mag.z), good)
+        self.assertFalse(self.i2c.readfrom_mem(0x0D, 0x06, 1)[0] & 0x01)  # DRDY cleared
+
+class Tilted(Trajectory):
+    """Holds a fixed roll, pitch and yaw (radians)."""
+    def __init__(self, roll, pitch, yaw):
+        super().__init__(yaw=yaw)
+        self.fixed = (roll, pitch)
+    def state(self, t):
+        s = super().state(t)
+        s.roll, s.pitch = self.fixed
+        s.ax, s.ay, s.az = earth_to_body(s.roll, s.pitch, s.yaw, 0.0, 0.0, 1.0)
+        return s
+
+class Attitude:
+    def __init__(self, roll, pitch):
+        self.sin_roll, self.cos_roll = math.sin(roll), math.cos(roll)
+        self.sin_pitch, self.cos_pitch = math.sin(pitch), math.cos(pitch)
+
+class TestTiltHeading(unittest.TestCase):
+    ROLL = math.radians(25)
+    PITCH = math.radians(-20)
+
+    def setUp(self):
+        self.clock = SimClock()
+        self.i2c = sim_i2c(Tilted(self.ROLL, self.PITCH, math.radians(-40)), self.clock)
+        self.i2c.devices[QMC5883L_ADDR].noise = 0.0
+        self.mag = MagnetometerGY273(self.i2c)
+        self.clock.advance(0.006)
+        self.mag.update()
+
+    def test_true_attitude(self):
+        heading = self.mag.tilt_heading(Attitude(self.ROLL, self.PITCH))
+        self.assertAlmostEqual(heading, 40.0, delta=0.3)
+        level = self.mag.calculate_heading(self.mag.x, self.mag.y)
+        self.assertGreater(abs(level - 40.0), 10.0)  # uncompensated error
+        self.mag.declination = -3.5
+        self.assertAlmostEqual(self.mag.tilt_heading(Attitude(self.ROLL, self.PITCH)),
+                               36.5, delta=0.3)
+
+    def test_madgwick_attitude(self):
+        imu = IMUGY91(self.i2c)
+        imu.madgwick.beta = 0.5
+        s = IMUSample()
+        for _ in range(1500):
+            self.clock.advance(0.002)
+            imu.update_attitude(0.002, s)
+        imu.madgwick.euler_into(s)
+        self.assertAlmostEqual(s.roll, 25.0, delta=1.0)
+        self.mag.update()
+        self.assertAlmostEqual(self.mag.tilt_heading(imu.madgwick), 40.0, delta=1.5)
+
 if __name__ == "__main__":
     unittest.main()
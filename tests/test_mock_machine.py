@@ -0,0 +1,194 @@
+# Test for the simulated I2C devices in mock_machine
+import math
+import struct
+import unittest
+from mock_machine import (I2C, SimClock, Trajectory, SimMPU9250, SimAK8963, SimBMP280, SimQMC5883L,
+                          sim_i2c, bmp280_t_fine, bmp280_pressure_q24_8, altitude_to_pressure)
+from imu_gy91 import IMUGY91
+from mag_gy273 import MagnetometerGY273
+
+
+def bmp_read(i2c):
+    cal = struct.unpack('<HhhHhhhhhhhh', i2c.readfrom_mem(0x76, 0x88, 24))
+    d = i2c.readfrom_mem(0x76, 0xF7, 6)
+    adc_p = (d[0] << 12) | (d[1] << 4) | (d[2] >> 4)
+    adc_t = (d[3] << 12) | (d[4] << 4) | (d[5] >> 4)
+    t_fine = bmp280_t_fine(adc_t, cal)
+    return t_fine / 5120.0, bmp280_pressure_q24_8(adc_p, t_fine, cal) / 256.0
+
+
+class TestSimMPU9250(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        self.i2c = I2C()
+        self.mpu = self.i2c.attach(SimMPU9250(Trajectory(), self.clock, accel_noise=0.0,
+                                              gyro_noise=0.0))
+
+    def test_registers_and_scale(self):
+        self.assertEqual(self.i2c.readfrom_mem(0x68, 0x75, 1)[0], 0x71)
+        self.assertEqual(self.i2c.scan(), [0x68])
+        self.clock.advance(0.001)
+        ax, ay, az = struct.unpack('>hhh', self.i2c.readfrom_mem(0x68, 0x3B, 6))
+        self.assertEqual((ax, ay, az), (0, 0, 16384))
+        self.i2c.writeto_mem(0x68, 0x1C, b'\x18')  # +/-16 g
+        self.clock.advance(0.001)
+        self.assertEqual(struct.unpack('>h', self.i2c.readfrom_mem(0x68, 0x3F, 2))[0], 2048)
+
+    def test_data_ready_and_rate(self):
+        self.i2c.writeto_mem(0x68, 0x1A, b'\x03')  # DLPF on: 1 kHz internal
+        self.i2c.writeto_mem(0x68, 0x19, b'\x09')  # /10 -> 100 Hz
+        self.assertEqual(self.mpu.sample_rate(), 100.0)
+        self.clock.advance(0.011)
+        self.assertEqual(self.i2c.readfrom_mem(0x68, 0x3A, 1)[0] & 0x01, 1)
+        self.assertEqual(self.i2c.readfrom_mem(0x68, 0x3A, 1)[0] & 0x01, 0)
+        self.clock.advance(0.005)
+        self.assertEqual(self.i2c.readfrom_mem(0x68, 0x3A, 1)[0] & 0x01, 0)
+        self.clock.advance(0.005)
+        self.assertEqual(self.i2c.readfrom_mem(0x68, 0x3A, 1)[0] & 0x01, 1)
+
+    def test_sleep_and_reset(self):
+        self.i2c.writeto_mem(0x68, 0x6B, b'\x40')
+        samples = self.mpu.samples
+        self.clock.advance(0.01)
+        self.i2c.readfrom_mem(0x68, 0x3B, 6)
+        self.assertEqual(self.mpu.samples, samples)
+        self.i2c.writeto_mem(0x68, 0x6B, b'\x80')
+        self.assertEqual(self.i2c.readfrom_mem(0x68, 0x6B, 1)[0], 0x01)
+
+    def test_fifo(self):
+        self.i2c.writeto_mem(0x68, 0x1A, b'\x41')  # DLPF 1, FIFO_MODE: drop when full
+        self.i2c.writeto_mem(0x68, 0x23, b'\x78')  # accel + gyro
+        self.i2c.writeto_mem(0x68, 0x6A, b'\x44')  # FIFO_EN | FIFO_RST
+        self.assertEqual(self.i2c.readfrom_mem(0x68, 0x6A, 1)[0], 0x40)
+        self.clock.advance(0.0105)
+        count = struct.unpack('>H', self.i2c.readfrom_mem(0x68, 0x72, 2))[0]
+        self.assertEqual(count, 10 * 12)
+        frame = struct.unpack('>6h', self.i2c.readfrom_mem(0x68, 0x74, 12))
+        self.assertAlmostEqual(frame[2] / 16384.0, 1.0, delta=0.01)
+        self.assertEqual(struct.unpack('>H', self.i2c.readfrom_mem(0x68, 0x72, 2))[0], 108)
+        self.clock.advance(0.1)
+        count = struct.unpack('>H', self.i2c.readfrom_mem(0x68, 0x72, 2))[0]
+        self.assertEqual(count, 512)
+        self.assertEqual(self.i2c.readfrom_mem(0x68, 0x3A, 1)[0] & 0x10, 0x10)
+        # The oldest data was kept: the next frame is still aligned
+        self.i2c.readfrom_mem(0x68, 0x74, 108)
+        self.assertAlmostEqual(struct.unpack('>6h', self.i2c.readfrom_mem(0x68, 0x74, 12))[2],
+                               16384, delta=200)
+        self.i2c.writeto_mem(0x68, 0x6A, b'\x44')
+        self.assertEqual(len(self.mpu.fifo), 0)
+
+    def test_drives_imu_driver(self):
+        clock = SimClock()
+        imu = IMUGY91(sim_i2c(Trajectory(roll_amp=0.5, freq=0.25), clock))
+        clock.advance(1.0)  # peak roll
+        ax, ay, az, gx, gy, gz, temp = imu.read_burst()
+        self.assertAlmostEqual(ay, math.sin(0.5), delta=0.02)
+        self.assertAlmostEqual(az, math.cos(0.5), delta=0.02)
+        self.assertAlmostEqual(temp, 25.0, delta=0.01)
+        self.assertLess(abs(gx), 1.0)
+
+
+class TestSimAK8963(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        self.i2c = I2C()
+        self.ak = SimAK8963(Trajectory(), self.clock, noise=0.0, asa=(128, 128, 128))
+        self.mpu = self.i2c.attach(SimMPU9250(Trajectory(), self.clock, aux=self.ak))
+
+    def slv4(self, addr, reg, do=0):
+        for r, v in ((0x31, addr), (0x32, reg), (0x33, do), (0x34, 0x80)):
+            self.i2c.writeto_mem(0x68, r, bytes([v]))
+        return self.i2c.readfrom_mem(0x68, 0x36, 1)[0], self.i2c.readfrom_mem(0x68, 0x35, 1)[0]
+
+    def test_aux_master(self):
+        self.assertEqual(self.i2c.scan(), [0x68])  # AK8963 is hidden behind the MPU
+        self.assertEqual(self.slv4(0x8C, 0x00)[0], 0)  # master disabled: nothing happens
+        self.i2c.writeto_mem(0x68, 0x6A, b'\x20')
+        self.assertEqual(self.slv4(0x8C, 0x00), (0x40, 0x48))
+        self.assertEqual(self.slv4(0x8D, 0x00)[0], 0x50)  # wrong address NACKs
+        self.slv4(0x0C, 0x0A, 0x16)
+        for r, v in ((0x25, 0x8C), (0x26, 0x03), (0x27, 0x87)):
+            self.i2c.writeto_mem(0x68, r, bytes([v]))
+        self.clock.advance(0.02)
+        ext = self.i2c.readfrom_mem(0x68, 0x49, 7)
+        hx, hy, hz = struct.unpack_from('<hhh', ext)
+        # Level, facing north: 20 uT along accel x (AK y), 45 uT down (AK +z)
+        self.assertAlmostEqual(hy * 0.15, 20.0, delta=0.2)
+        self.assertAlmostEqual(hx * 0.15, 0.0, delta=0.2)
+        self.assertAlmostEqual(hz * 0.15, 45.0, delta=0.2)
+        self.assertEqual(ext[6] & 0x18, 0x10)  # BITM set, no overflow
+
+    def test_overflow(self):
+        self.ak.hard_iron = (60.0, 0.0, 0.0)
+        self.ak.write(0x0A, b'\x16')
+        self.clock.advance(0.02)
+        data = self.ak.read(0x02, 8)
+        self.assertEqual(data[0] & 0x01, 1)
+        self.assertTrue(data[7] & 0x08)
+        self.assertEqual(self.ak.read(0x02, 1)[0] & 0x01, 0)  # ST2 read cleared DRDY
+
+
+class TestSimBMP280(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        self.i2c = I2C()
+        self.bmp = self.i2c.attach(SimBMP280(Trajectory(alt=250.0, temp=18.5), self.clock,
+                                             press_noise=0.0))
+
+    def test_calibration_prom(self):
+        self.assertEqual(self.i2c.readfrom_mem(0x76, 0xD0, 1)[0], 0x58)
+        cal = struct.unpack('<HhhHhhhhhhhh', self.i2c.readfrom_mem(0x76, 0x88, 24))
+        self.assertEqual(cal[0], 27504)
+        self.assertEqual(cal[2], -1000)
+
+    def test_normal_mode_conversion(self):
+        self.i2c.writeto_mem(0x76, 0xF4, b'\x27')  # x1/x1, normal
+        self.assertEqual(self.i2c.readfrom_mem(0x76, 0xF3, 1)[0] & 0x08, 0x08)
+        self.clock.advance(0.01)
+        temp, press = bmp_read(self.i2c)
+        self.assertAlmostEqual(temp, 18.5, delta=0.01)
+        self.assertAlmostEqual(press, altitude_to_pressure(250.0), delta=1.0)
+
+    def test_forced_mode(self):
+        self.i2c.writeto_mem(0x76, 0xF4, b'\x55')  # x2/x16, forced
+        self.assertAlmostEqual(self.bmp.measure_time(), (1 + 4 + 32.5) / 1000)
+        self.clock.advance(0.02)
+        self.assertEqual(self.i2c.readfrom_mem(0x76, 0xF3, 1)[0] & 0x08, 0x08)
+        self.clock.advance(0.02)
+        self.assertEqual(self.i2c.readfrom_mem(0x76, 0xF3, 1)[0] & 0x08, 0)
+        self.assertEqual(self.i2c.readfrom_mem(0x76, 0xF4, 1)[0] & 0x03, 0)
+        self.assertEqual(self.bmp.conversions, 1)
+
+
+class TestSimQMC5883L(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        self.traj = Trajectory(yaw=math.radians(-30))
+        self.i2c = I2C()
+        self.i2c.attach(SimQMC5883L(self.traj, self.clock, noise=0.0))
+
+    def test_status_flags(self):
+        mag = MagnetometerGY273(self.i2c)  # continuous, 200 Hz, 8 G
+        self.assertEqual(self.i2c.readfrom_mem(0x0D, 0x0D, 1)[0], 0xFF)
+        self.clock.advance(0.006)
+        self.assertEqual(self.i2c.readfrom_mem(0x0D, 0x06, 1)[0] & 0x01, 1)
+        mag.read_raw()
+        self.assertEqual(self.i2c.readfrom_mem(0x0D, 0x06, 1)[0] & 0x05, 0)
+        self.clock.advance(0.011)  # two periods without a read
+        self.assertEqual(self.i2c.readfrom_mem(0x0D, 0x06, 1)[0] & 0x05, 0x05)
+
+    def test_heading_and_overflow(self):
+        mag = MagnetometerGY273(self.i2c)
+        self.clock.advance(0.01)
+        x, y, z = mag.read_raw()
+        self.assertAlmostEqual(x, 0.2 * 3000 * math.cos(math.radians(30)), delta=1)
+        self.assertAlmostEqual(mag.calculate_heading(x, y), 30.0, delta=0.5)
+        self.assertLess(z, 0)
+        big = I2C()
+        big.attach(SimQMC5883L(self.traj, self.clock, field=(15.0, 0.0, 0.0), noise=0.0))
+        big.writeto_mem(0x0D, 0x09, b'\x1D')
+        self.clock.advance(0.01)
+        self.assertEqual(big.readfrom_mem(0x0D, 0x06, 1)[0] & 0x02, 0x02)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# Test for the quadcopter physics simulator
+import unittest
+from quad_sim import QuadSim, motor_drive
+from imu_gy91 import IMUGY91
+from mag_gy273 import MagnetometerGY273
+from gps_neo6m import GPSNEO6M
+
+
+def all_forward(sim, duty):
+    for m in sim.motors.values():
+        m.forward(duty)
+
+
+class TestQuadSim(unittest.TestCase):
+    def setUp(self):
+        self.sim = QuadSim()
+
+    def test_motor_drive(self):
+        m = self.sim.motors['top_left']
+        m.forward(32768)
+        self.assertAlmostEqual(motor_drive(m), 0.5, places=3)
+        m.reverse(65535)
+        self.assertEqual(motor_drive(m), -1.0)
+        m.brake()
+        self.assertEqual(motor_drive(m), 0.0)
+
+    def test_rests_on_ground_at_low_throttle(self):
+        all_forward(self.sim, 14000)
+        self.sim.run(0.5)
+        self.assertTrue(self.sim.on_ground)
+        self.assertEqual(self.sim.pos[2], 0.0)
+        self.assertAlmostEqual(self.sim.t, 0.5)
+
+    def test_climbs_and_sags_battery(self):
+        all_forward(self.sim, 60000)
+        self.sim.run(1.0)
+        self.assertFalse(self.sim.on_ground)
+        self.assertGreater(self.sim.pos[2], 0.5)
+        self.assertLess(self.sim.voltage, self.sim.params.v_full - 0.3)
+        self.assertLess(self.sim.soc, 1.0)
+        roll, pitch, yaw = self.sim.euler()
+        self.assertAlmostEqual(roll, 0.0, places=6)
+        self.assertAlmostEqual(pitch, 0.0, places=6)
+
+    def test_differential_thrust_rolls_and_yaws(self):
+        all_forward(self.sim, 60000)
+        self.sim.motors['top_left'].forward(65535)
+        self.sim.motors['bottom_left'].forward(65535)
+        self.sim.run(0.2)
+        roll, pitch, yaw = self.sim.euler()
+        self.assertGreater(roll, 0.05)  # left side up
+        self.assertAlmostEqual(pitch, 0.0, places=3)
+
+    def test_drivers_read_simulation(self):
+        imu = IMUGY91(self.sim.i2c)
+        mag = MagnetometerGY273(self.sim.i2c)
+        gps = GPSNEO6M(self.sim.uart)
+        self.sim.run(0.01)
+        ax, ay, az, gx, gy, gz, temp = imu.read_burst()
+        self.assertAlmostEqual(az, 1.0, delta=0.02)
+        x, y, z = mag.read_raw()
+        heading = mag.calculate_heading(x, y)
+        self.assertLess(min(heading, 360 - heading), 2.0)  # facing north
+        all_forward(self.sim, 60000)
+        self.sim.run(0.3)
+        ax, ay, az, gx, gy, gz, temp = imu.read_burst()
+        self.assertGreater(az, 1.1)  # climbing: specific force above 1 g
+        self.assertTrue(gps.poll())
+        fix = gps.latest()
+        self.assertAlmostEqual(fix.lat, 51.5, places=4)
+        self.assertAlmostEqual(fix.alt, 50.0 + self.sim.pos[2], delta=0.5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+# Test for the multi-rate scheduler
+import unittest
+from scheduler import Scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+    def __call__(self):
+        return self.now
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sched = Scheduler(self.clock)
+        self.calls = {'fast': [], 'slow': []}
+        self.fast = self.sched.add('fast', 1000, self.calls['fast'].append)
+        self.slow = self.sched.add('slow', 100, self.calls['slow'].append)
+
+    def step(self, us, total_us):
+        while self.clock.now < total_us:
+            self.sched.run_once()
+            self.clock.now += us
+
+    def test_rates(self):
+        self.step(100, 100000)  # 100 ms of 100 us polling
+        self.assertEqual(self.fast.runs, 100)
+        self.assertEqual(self.slow.runs, 10)
+        self.assertEqual(self.fast.skipped, 0)
+        for dt in self.calls['fast'][1:]:
+            self.assertAlmostEqual(dt, 0.001)
+        for dt in self.calls['slow'][1:]:
+            self.assertAlmostEqual(dt, 0.01)
+
+    def test_missed_ticks_are_skipped(self):
+        self.sched.run_once()
+        self.clock.now = 3500  # stall past the 1, 2 and 3 ms deadlines
+        self.assertEqual(self.sched.run_once(), 1)
+        self.assertEqual(self.fast.runs, 2)
+        self.assertEqual(self.fast.skipped, 2)  # the 2 ms and 3 ms ticks
+        self.assertAlmostEqual(self.calls['fast'][-1], 0.0035)
+        # Next deadline stays on the original 1 ms grid
+        self.assertEqual(self.fast.deadline, 4000)
+        self.assertEqual(self.sched.run_once(), 0)
+        self.assertEqual(self.sched.next_wait_us(), 500)
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            self.sched.add('bad', 0, print)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+# Test for the binary telemetry logger
+import io
+import unittest
+from telemetry import TelemetryLog, RECORD_SIZE, FIELDS, decode, to_csv
+
+
+class SlowSink:
+    """Accepts at most `limit` bytes per write, like a non-blocking stream."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = bytearray()
+    def write(self, buf):
+        n = min(self.limit, len(buf))
+        self.data += bytes(buf[:n])
+        return n
+
+
+def sample(i, lat=None, lon=None):
+    return (0.1 * i, 0.0, 1.0, 1.0, -2.0, 3.0, 25.0, 12.5, 5.0, -5.0, 90.0, lat, lon, 30.0)
+
+
+class TestTelemetry(unittest.TestCase):
+    def test_record_size(self):
+        self.assertEqual(RECORD_SIZE, 64)
+
+    def test_round_trip(self):
+        sink = io.BytesIO()
+        log = TelemetryLog(sink, capacity=8)
+        log.log(*sample(1, 51.5012345, -0.1234567))
+        log.log(*sample(2))
+        self.assertEqual(log.flush(), 2 * RECORD_SIZE)
+        recs = decode(sink.getvalue())
+        self.assertEqual(len(recs), 2)
+        first = dict(zip(FIELDS, recs[0]))
+        self.assertEqual(first['seq'], 0)
+        self.assertAlmostEqual(first['ax'], 0.1, places=6)
+        self.assertAlmostEqual(first['lat'], 51.5012345, places=6)
+        self.assertAlmostEqual(first['lon'], -0.1234567, places=6)
+        second = dict(zip(FIELDS, recs[1]))
+        self.assertNotEqual(second['lat'], second['lat'])  # NaN without a fix
+
+    def test_lost_fix_clears_gps_flag(self):
+        from gps_neo6m import NMEAParser
+        from imu_gy91 import IMUSample
+        p = NMEAParser()
+        p.feed(b"$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n")
+        s = IMUSample()
+        s.set_gps(p.fix)
+        sink = io.BytesIO()
+        log = TelemetryLog(sink)
+        log.log(*sample(1, s.lat, s.lon)[:-1], s.alt_gps, s.gps_valid)
+        p.feed(b"$GPGGA,123520,,,,,0,00,,,M,,M,,*61\r\n")  # fix lost
+        s.set_gps(p.fix)
+        self.assertAlmostEqual(s.lat, 48.1173)  # last position is still held
+        log.log(*sample(2, s.lat, s.lon)[:-1], s.alt_gps, s.gps_valid)
+        log.flush()
+        first, second = decode(sink.getvalue())
+        self.assertEqual(first[1], 1)
+        self.assertAlmostEqual(first[14], 48.1173, places=4)
+        self.assertEqual(second[1], 0)
+        self.assertNotEqual(second[14], second[14])
+
+    def test_drops_when_full(self):
+        log = TelemetryLog(None, capacity=4)
+        for i in range(6):
+            log.log(*sample(i))
+        self.assertEqual(log.written, 4)
+        self.assertEqual(log.dropped, 2)
+        self.assertEqual(log.flush(), 0)  # no sink yet
+
+    def test_max_bytes_and_sink_errors(self):
+        sink = io.BytesIO()
+        log = TelemetryLog(sink, capacity=8, max_bytes=3 * RECORD_SIZE)
+        for i in range(2):
+            log.log(*sample(i))
+        self.assertEqual(log.flush(), 2 * RECORD_SIZE)
+        for i in range(2):
+            log.log(*sample(i))
+        self.assertEqual(log.flush(), 0)  # would pass the cap: dropped, file stays put
+        self.assertEqual(log.lost, 2 * RECORD_SIZE)
+        self.assertEqual(log.pending(), 0)
+        self.assertEqual(len(sink.getvalue()), 2 * RECORD_SIZE)
+
+        class FullSink:
+            def write(self, buf):
+                raise OSError(28)  # ENOSPC
+            def flush(self):
+                raise OSError(28)
+        log = TelemetryLog(FullSink(), capacity=4)
+        log.log(*sample(1))
+        self.assertEqual(log.flush(), 0)
+        self.assertEqual(log.lost, RECORD_SIZE)
+        self.assertTrue(log.log(*sample(2)))  # the ring keeps accepting records
+
+    def test_short_writes_and_wrap(self):
+        sink = SlowSink(100)
+        log = TelemetryLog(sink, capacity=4)
+        for i in range(20):
+            log.log(*sample(i))
+            log.flush()
+        while log.pending():
+            log.flush()
+        recs = decode(bytes(sink.data))
+        self.assertEqual(len(recs), log.written)
+        self.assertEqual([r[0] for r in recs], list(range(len(recs))))
+
+    def test_decode_resync_and_csv(self):
+        sink = io.BytesIO()
+        log = TelemetryLog(sink)
+        log.log(*sample(1))
+        log.log(*sample(2))
+        log.flush()
+        data = b"\x00\x01junk" + sink.getvalue()[:-3]
+        self.assertEqual(len(decode(data)), 1)
+        out = io.StringIO()
+        to_csv(sink.getvalue(), out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], ",".join(FIELDS))
+        self.assertEqual(len(lines), 3)
+
+if __name__ == "__main__":
+    unittest.main()